@@ -0,0 +1,234 @@
+#
+# enforcement.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+"""
+Drives the TrafficLimits core through synthetic traffic on a virtual clock,
+and reports what enforcement costs and how well it works: tick latency,
+objects allocated per tick, overshoot past each maximum_*, and the events
+sent to clients.  Runs offline; only Twisted is needed.
+
+    python benchmarks/enforcement.py --trace swarm --torrents 2000 \\
+        --duration 86400 --set maximum_download=10737418240
+"""
+
+import gc
+import json
+import optparse
+import os
+import shutil
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakedeluge
+import traces
+
+# timeit is imported, and so takes its timer, before time.time is replaced
+# with the virtual clock.
+timer = timeit.default_timer
+
+class SynchronousThreads(object):
+    """Runs "threaded" work immediately, as there is no reactor running."""
+
+    def deferToThread(self, function, *args, **kwargs):
+        from twisted.internet import defer
+        return defer.maybeDeferred(function, *args, **kwargs)
+
+    def deferToThreadPool(self, reactor, pool, function, *args, **kwargs):
+        return self.deferToThread(function, *args, **kwargs)
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def run(options):
+    config_dir = fakedeluge.install()
+    try:
+        return simulate(options, config_dir)
+    finally:
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+def simulate(options, config_dir):
+    from twisted.internet import task
+
+    clock = task.Clock()
+    clock.advance(options.start)
+    time.time = clock.seconds
+
+    import trafficlimits.core as core
+    import trafficlimits.fileio
+    import trafficlimits.resume
+    import trafficlimits.watcher
+    core.reactor = clock
+    trafficlimits.fileio.reactor = clock
+    trafficlimits.resume.reactor = clock
+    trafficlimits.watcher.reactor = clock
+    trafficlimits.watcher.inotify = None
+    trafficlimits.fileio.threads = SynchronousThreads()
+
+    for setting in options.settings:
+        key, value = setting.split("=", 1)
+        core.DEFAULT_PREFS[key] = json.loads(value)
+
+    trace = traces.TRACES[options.trace](
+        options.torrents, options.upload, options.download)
+    deluge_core = fakedeluge.Core(trace, clock.seconds())
+    rpcserver = fakedeluge.RPCServer(options.clients)
+    fakedeluge.components.update({
+        "Core": deluge_core,
+        "TorrentManager": fakedeluge.TorrentManager(deluge_core),
+        "EventManager": fakedeluge.EventManager(),
+        "RPCServer": rpcserver,
+    })
+
+    plugin = core.Core()
+    latencies = []
+    allocations = []
+    overshoot = {"upload": [], "download": [], "total": []}
+
+    update_traffic = plugin.update_traffic
+    def timed_update_traffic():
+        gc.collect()
+        gc.disable()
+        objects = len(gc.get_objects())
+        start = timer()
+        try:
+            update_traffic()
+        finally:
+            latencies.append(timer() - start)
+            allocations.append(len(gc.get_objects()) - objects)
+            gc.enable()
+    plugin.update_traffic = timed_update_traffic
+
+    pause = plugin.pause
+    def measured_pause(direction, temporary=False):
+        if not temporary:
+            overshoot[direction].append(
+                getattr(plugin, direction)
+                - plugin.config["maximum_" + direction])
+        pause(direction, temporary)
+    plugin.pause = measured_pause
+
+    plugin.enable()
+    end = clock.seconds() + options.duration
+    while clock.seconds() < end:
+        deluge_core.advance(clock.seconds() + options.step)
+        clock.advance(options.step)
+    exposition = plugin.render_metrics()
+    plugin.disable()
+
+    return {
+        "ticks": len(latencies),
+        "latencies": latencies,
+        "allocations": allocations,
+        "overshoot": overshoot,
+        "events": rpcserver.events,
+        "event_bytes": rpcserver.event_bytes,
+        "uploaded": deluge_core.total_upload,
+        "downloaded": deluge_core.total_download,
+        "metrics": exposition,
+    }
+
+def report(options, result):
+    latencies = result["latencies"]
+    allocations = result["allocations"]
+    print("%s trace, %d torrents, %d s simulated, %d clients"
+          % (options.trace, options.torrents, options.duration,
+             options.clients))
+    print("  ticks:            %d (every %.1f s on average)"
+          % (result["ticks"], options.duration / float(max(1, result["ticks"]))))
+    print("  tick latency:     mean %.0f us, p50 %.0f us, p99 %.0f us, "
+          "max %.0f us"
+          % (1e6 * sum(latencies) / max(1, len(latencies)),
+             1e6 * percentile(latencies, 0.5),
+             1e6 * percentile(latencies, 0.99),
+             1e6 * max(latencies or [0])))
+    print("  objects per tick: mean %.1f, max %d"
+          % (sum(allocations) / float(max(1, len(allocations))),
+             max(allocations or [0])))
+    for direction in ("upload", "download", "total"):
+        values = result["overshoot"][direction]
+        if values:
+            print("  %-8s overshoot: %d breaches, max %d bytes, mean %d bytes"
+                  % (direction, len(values), max(values),
+                     sum(values) / len(values)))
+    print("  events:           %d (%d bytes)"
+          % (result["events"], result["event_bytes"]))
+    print("  transferred:      %d bytes up, %d bytes down"
+          % (result["uploaded"], result["downloaded"]))
+    if options.metrics:
+        print("")
+        print(result["metrics"])
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--trace", choices=sorted(traces.TRACES),
+                      default="swarm",
+                      help="traffic to simulate: %s [%%default]"
+                      % ", ".join(sorted(traces.TRACES)))
+    parser.add_option("--torrents", type="int", default=2000,
+                      help="number of torrents [%default]")
+    parser.add_option("--upload", type="float", default=10 * 1024 ** 2,
+                      help="overall upload rate, bytes/s [%default]")
+    parser.add_option("--download", type="float", default=2 * 1024 ** 2,
+                      help="overall download rate, bytes/s [%default]")
+    parser.add_option("--duration", type="int", default=6 * 60 * 60,
+                      help="seconds to simulate [%default]")
+    parser.add_option("--step", type="float", default=1,
+                      help="simulation step, seconds [%default]")
+    parser.add_option("--start", type="float", default=1262304000,
+                      help="virtual start time, secs since epoch [%default]")
+    parser.add_option("--clients", type="int", default=1,
+                      help="number of connected clients [%default]")
+    parser.add_option("--set", dest="settings", action="append",
+                      default=["maximum_download=10737418240"],
+                      metavar="KEY=JSON",
+                      help="set a config value, e.g., pause_mode=\"torrents\"")
+    parser.add_option("--metrics", action="store_true", default=False,
+                      help="also print the plugin's own metrics")
+    options, args = parser.parse_args()
+    report(options, run(options))
+
+if __name__ == "__main__":
+    main()
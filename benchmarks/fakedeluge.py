@@ -0,0 +1,394 @@
+#
+# fakedeluge.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+"""
+Stand-ins for the parts of Deluge that the TrafficLimits core (and, enough
+to enable them, the UIs) use, so that it can be driven offline by the
+benchmarks.  install() must be called before anything from trafficlimits is
+imported.
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import types
+
+class Config(object):
+    """Like deluge.config.Config, minus the file."""
+
+    def __init__(self, filename, defaults):
+        self.filename = filename
+        self.config = dict(defaults)
+        self.saves = 0
+
+    def __getitem__(self, key):
+        return self.config[key]
+
+    def __setitem__(self, key, value):
+        self.config[key] = value
+
+    def __contains__(self, key):
+        return key in self.config
+
+    def save(self, filename=None):
+        self.saves += 1
+
+class Session(object):
+    def __init__(self, core):
+        self.core = core
+
+    def pause(self):
+        self.core.session_paused = True
+
+    def resume(self):
+        self.core.session_paused = False
+
+class Core(object):
+    """
+    A Deluge core whose torrents transfer at whatever rates a trace says.
+    advance() must be called as (virtual) time passes.
+    """
+
+    def __init__(self, trace, now):
+        self.trace = trace
+        self.session = Session(self)
+        self.session_paused = False
+        self.paused = set()
+        self.total_upload = 0
+        self.total_download = 0
+        self.torrent_upload = [0] * trace.torrents
+        self.torrent_download = [0] * trace.torrents
+        self.torrent_ids = ["%040x" % i for i in xrange(trace.torrents)]
+        self.active = {}
+        self.config = {"max_upload_speed": -1.0, "max_download_speed": -1.0}
+        self.last = now
+
+    def advance(self, now):
+        elapsed = now - self.last
+        self.last = now
+        self.active = {}
+        if elapsed <= 0 or self.session_paused:
+            return
+
+        # Speed limits are in KiB/s, and shared out in proportion.
+        rates = self.trace.rates(now)
+        caps = []
+        for key, column in (("max_upload_speed", 0),
+                            ("max_download_speed", 1)):
+            limit = self.config[key]
+            wanted = sum(rate[column] for i, rate in rates.iteritems()
+                         if i not in self.paused)
+            if limit > 0 and wanted > limit * 1024:
+                caps.append(limit * 1024 / wanted)
+            else:
+                caps.append(1.0)
+
+        for i, (upload, download) in rates.iteritems():
+            if i in self.paused:
+                continue
+            upload = int(upload * caps[0] * elapsed)
+            download = int(download * caps[1] * elapsed)
+            self.torrent_upload[i] += upload
+            self.torrent_download[i] += download
+            self.total_upload += upload
+            self.total_download += download
+            if upload or download:
+                self.active[self.torrent_ids[i]] = i
+
+    def get_session_status(self, keys):
+        return {"total_upload": self.total_upload,
+                "total_download": self.total_download}
+
+    def _status(self, i, keys):
+        status = {}
+        for key in keys:
+            if key == "total_payload_upload":
+                status[key] = self.torrent_upload[i]
+            elif key == "total_payload_download":
+                status[key] = self.torrent_download[i]
+            elif key == "label":
+                status[key] = self.trace.label(i)
+            elif key == "tracker_host":
+                status[key] = self.trace.tracker(i)
+            elif key == "owner":
+                status[key] = "localclient"
+            elif key == "queue":
+                status[key] = i
+            elif key == "state":
+                status[key] = "Paused" \
+                    if self.session_paused or i in self.paused else "Seeding"
+            elif key == "total_size":
+                status[key] = 0
+            elif key == "num_peers":
+                status[key] = len(PEERS)
+            elif key == "ratio":
+                status[key] = self.torrent_upload[i] \
+                    / float(max(1, self.torrent_download[i]))
+        return status
+
+    def get_torrent_status(self, torrent_id, keys):
+        return self._status(int(torrent_id, 16), keys)
+
+    def get_torrents_status(self, filter_dict, keys):
+        if "Active" in filter_dict.get("state", ()):
+            torrents = self.active.iteritems()
+        elif "id" in filter_dict:
+            torrents = ((torrent_id, int(torrent_id, 16))
+                        for torrent_id in filter_dict["id"])
+        else:
+            torrents = ((torrent_id, i) for i, torrent_id
+                        in enumerate(self.torrent_ids))
+        return dict((torrent_id, self._status(i, keys))
+                    for torrent_id, i in torrents)
+
+    def pause_torrent(self, torrent_ids):
+        self.paused.update(int(torrent_id, 16) for torrent_id in torrent_ids)
+
+    def resume_torrent(self, torrent_ids):
+        self.paused.difference_update(int(torrent_id, 16)
+                                      for torrent_id in torrent_ids)
+
+    def get_config_value(self, key):
+        return self.config[key]
+
+    def set_config(self, config):
+        self.config.update(config)
+
+# Each torrent's peers, as (address, port, share of its traffic); one of
+# them on the LAN.
+PEERS = [("10.0.%d.%d", 6881, 0.5), ("203.0.%d.%d", 51413, 0.5)]
+
+class PeerInfo(object):
+    def __init__(self, ip, total_upload, total_download):
+        self.ip = ip
+        self.total_upload = total_upload
+        self.total_download = total_download
+
+class Handle(object):
+    """A torrent handle, with peers that have been connected throughout."""
+
+    def __init__(self, core, i):
+        self.core = core
+        self.i = i
+
+    def get_peer_info(self):
+        i = self.i
+        return [PeerInfo((address % (i // 256 % 256, i % 256), port),
+                         int(self.core.torrent_upload[i] * share),
+                         int(self.core.torrent_download[i] * share))
+                for address, port, share in PEERS]
+
+class Torrent(object):
+    def __init__(self, handle):
+        self.handle = handle
+
+class TorrentManager(object):
+    def __init__(self, core):
+        self.torrents = dict((torrent_id, Torrent(Handle(core, i)))
+                             for i, torrent_id in enumerate(core.torrent_ids))
+
+class EventManager(object):
+    def __init__(self):
+        self.handlers = {}
+        self.emitted = 0
+
+    def register_event_handler(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def deregister_event_handler(self, event, handler):
+        self.handlers[event].remove(handler)
+
+    def emit(self, event):
+        self.emitted += 1
+
+class Factory(object):
+    def __init__(self, clients):
+        self.interested_events = dict(
+            (i, ["TrafficLimitUpdate"]) for i in xrange(clients))
+
+class RPCServer(object):
+    """Counts the events that would have been sent to each client."""
+
+    def __init__(self, clients):
+        self.factory = Factory(clients)
+        self.events = 0
+        self.event_bytes = 0
+
+    def emit_event_for_session_id(self, session_id, event):
+        self.events += 1
+        self.event_bytes += len(repr(event.args))
+
+class DelugeEvent(object):
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    @property
+    def args(self):
+        return self._args
+
+class Client(object):
+    """
+    Like deluge.ui.client.client, with every RPC answered straight away by
+    calling the same method on the plugin's core, if there is one.
+    """
+
+    def __init__(self):
+        self.core = None
+        self.handlers = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return Plugin(self, name)
+
+    def register_event_handler(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def deregister_event_handler(self, event, handler):
+        self.handlers[event].remove(handler)
+
+class Plugin(object):
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getattr__(self, method):
+        from twisted.internet import defer
+        def call(*args, **kwargs):
+            if self.client.core is None:
+                return defer.Deferred()
+            return defer.maybeDeferred(getattr(self.client.core, method),
+                                       *args, **kwargs)
+        return call
+
+class StatusItem(object):
+    def set_text(self, text):
+        self.text = text
+
+    def set_tooltip(self, tooltip):
+        self.tooltip = tooltip
+
+class StatusBar(object):
+    def add_item(self, **kwargs):
+        return StatusItem()
+
+    def remove_item(self, item):
+        pass
+
+class Preferences(object):
+    def __init__(self):
+        self.pages = {}
+
+    def add_page(self, name, widget):
+        self.pages[name] = widget
+
+    def remove_page(self, name):
+        del self.pages[name]
+
+    def show(self, page=None):
+        pass
+
+class PluginManager(object):
+    def __init__(self):
+        self.hooks = {}
+
+    def register_hook(self, hook, function):
+        self.hooks.setdefault(hook, []).append(function)
+
+    def deregister_hook(self, hook, function):
+        self.hooks[hook].remove(function)
+
+    def run_hook(self, hook):
+        for function in self.hooks.get(hook, []):
+            function()
+
+def fsize(size):
+    return "%.1f KiB" % (size / 1024.0)
+
+def ftime(seconds):
+    return "%ds" % seconds
+
+components = {}
+client = Client()
+
+def install(config_dir=None):
+    """
+    Puts the stand-ins into sys.modules, in place of any real Deluge.
+    Returns the directory used for config files.
+    """
+    if config_dir is None:
+        config_dir = tempfile.mkdtemp(prefix="trafficlimits-")
+
+    def module(name, **attributes):
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+        if "." in name:
+            parent, child = name.rsplit(".", 1)
+            setattr(sys.modules[parent], child, module)
+        return module
+
+    def get_config_dir(filename=None):
+        if filename is None:
+            return config_dir
+        return os.path.join(config_dir, filename)
+
+    log = logging.getLogger("trafficlimits")
+    log.addHandler(logging.NullHandler())
+    log.propagate = False
+
+    module("deluge")
+    module("deluge.log", LOG=log)
+    module("deluge.component", get=components.__getitem__)
+    module("deluge.configmanager", ConfigManager=Config,
+           get_config_dir=get_config_dir)
+    module("deluge.core")
+    module("deluge.core.rpcserver", export=lambda function: function,
+           RPC_EVENT=3)
+    module("deluge.event", DelugeEvent=DelugeEvent)
+    module("deluge.common", fsize=fsize, ftime=ftime)
+    module("deluge.ui")
+    module("deluge.ui.client", client=client)
+    module("deluge.plugins")
+    module("deluge.plugins.init", PluginInitBase=object)
+    module("deluge.plugins.pluginbase", CorePluginBase=object,
+           GtkPluginBase=object, WebPluginBase=object)
+    return config_dir
@@ -0,0 +1,200 @@
+#
+# startup.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+"""
+Measures how long each of the plugin's entry points (see __init__.py) takes
+to import and to enable, against the stand-ins for Deluge.  Every run is in
+a fresh interpreter, so nothing is already imported but Twisted, which
+Deluge always has loaded before any plugin.  The GTK entry point is skipped
+where PyGTK is not installed.
+
+    python benchmarks/startup.py --runs 20
+"""
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import timeit
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+sys.path.insert(1, os.path.dirname(BENCHMARKS))
+
+timer = timeit.default_timer
+
+# Entry point -> the module and class its PluginInitBase loads.
+ENTRY_POINTS = [
+    ("core", "trafficlimits.core", "Core"),
+    ("gtk", "trafficlimits.gtkui", "GtkUI"),
+    ("web", "trafficlimits.webui", "WebUI"),
+]
+
+def measure(entry, torrents):
+    """
+    Imports and enables one entry point, in this process.  Returns a dict
+    of "import" and "enable" seconds, or of the "skipped" reason.
+    """
+    import fakedeluge
+    config_dir = fakedeluge.install()
+    try:
+        return _measure(fakedeluge, entry, torrents)
+    finally:
+        import shutil
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+def _measure(fakedeluge, entry, torrents):
+    from twisted.internet import task
+    import traces
+
+    name, module_name, class_name = [e for e in ENTRY_POINTS
+                                     if e[0] == entry][0]
+    if entry == "gtk":
+        try:
+            import gtk
+        except ImportError as error:
+            return {"skipped": str(error)}
+
+    start = timer()
+    module = __import__(module_name, fromlist=[class_name])
+    imported = timer() - start
+
+    clock = task.Clock()
+    trace = traces.TRACES["constant"](torrents, 1024 ** 2, 1024 ** 2)
+    core = fakedeluge.Core(trace, clock.seconds())
+    fakedeluge.components.update({
+        "Core": core,
+        "EventManager": fakedeluge.EventManager(),
+        "RPCServer": fakedeluge.RPCServer(1),
+        "Preferences": fakedeluge.Preferences(),
+        "PluginManager": fakedeluge.PluginManager(),
+        "StatusBar": fakedeluge.StatusBar(),
+    })
+    if entry == "core":
+        import trafficlimits.fileio
+        import trafficlimits.resume
+        import trafficlimits.watcher
+        for patched in (module, trafficlimits.fileio, trafficlimits.resume,
+                        trafficlimits.watcher):
+            patched.reactor = clock
+        trafficlimits.fileio.threads = SynchronousThreads()
+
+    plugin = getattr(module, class_name)()
+    start = timer()
+    plugin.enable()
+    enabled = timer() - start
+
+    # Let anything put off until after enabling run, then tidy up.
+    clock.advance(0)
+    plugin.disable()
+    return {"import": imported, "enable": enabled}
+
+class SynchronousThreads(object):
+    def deferToThread(self, function, *args, **kwargs):
+        from twisted.internet import defer
+        return defer.maybeDeferred(function, *args, **kwargs)
+
+    def deferToThreadPool(self, reactor, pool, function, *args, **kwargs):
+        return self.deferToThread(function, *args, **kwargs)
+
+def run(entry, options):
+    """Measures entry options.runs times, each in a new interpreter."""
+    results = []
+    for i in xrange(options.runs):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), "--child", entry,
+             "--torrents", str(options.torrents)])
+        result = json.loads(output)
+        if "skipped" in result:
+            return result
+        results.append(result)
+    return {"import": [r["import"] for r in results],
+            "enable": [r["enable"] for r in results]}
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def report(options, results):
+    print("%d runs, %d torrents" % (options.runs, options.torrents))
+    for name, module_name, class_name in ENTRY_POINTS:
+        result = results[name]
+        if "skipped" in result:
+            print("  %-5s skipped (%s)" % (name, result["skipped"]))
+            continue
+        print("  %-5s import: median %6.1f ms, min %6.1f ms;  "
+              "enable: median %6.1f ms, min %6.1f ms"
+              % (name, 1e3 * median(result["import"]),
+                 1e3 * min(result["import"]),
+                 1e3 * median(result["enable"]),
+                 1e3 * min(result["enable"])))
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--runs", type="int", default=10,
+                      help="interpreters to start for each entry point "
+                      "[%default]")
+    parser.add_option("--torrents", type="int", default=1000,
+                      help="number of torrents loaded [%default]")
+    parser.add_option("--entry", dest="entries", action="append",
+                      choices=[e[0] for e in ENTRY_POINTS],
+                      help="entry point to measure (may be repeated) "
+                      "[all]")
+    parser.add_option("--child", choices=[e[0] for e in ENTRY_POINTS],
+                      help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.child:
+        from twisted.internet import reactor
+        sys.stdout.write(json.dumps(measure(options.child,
+                                            options.torrents)))
+        return
+
+    results = {}
+    for name, module_name, class_name in ENTRY_POINTS:
+        if options.entries and name not in options.entries:
+            results[name] = {"skipped": "not asked for"}
+        else:
+            results[name] = run(name, options)
+    report(options, results)
+
+if __name__ == "__main__":
+    main()
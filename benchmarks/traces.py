@@ -0,0 +1,123 @@
+#
+# traces.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+"""
+Synthetic traffic for the benchmarks.  A trace says, for any moment, which
+torrents are transferring and at what rates (bytes/s).
+"""
+
+import heapq
+import random
+
+class Trace(object):
+    def __init__(self, torrents, labels=("tv", "linux", ""),
+                 trackers=("tracker.example.org", "tracker.example.net")):
+        self.torrents = torrents
+        self.labels = labels
+        self.trackers = trackers
+
+    def rates(self, now):
+        """Returns a dict, torrent number -> (upload, download) bytes/s."""
+        raise NotImplementedError
+
+    def label(self, i):
+        return self.labels[i % len(self.labels)]
+
+    def tracker(self, i):
+        return self.trackers[i % len(self.trackers)]
+
+class Constant(Trace):
+    """Every torrent transfers at a steady rate, sharing upload and download."""
+
+    def __init__(self, torrents, upload, download, **kwargs):
+        Trace.__init__(self, torrents, **kwargs)
+        share = float(max(torrents, 1))
+        self.constant = dict((i, (upload / share, download / share))
+                             for i in xrange(torrents))
+
+    def rates(self, now):
+        return self.constant
+
+class Bursty(Trace):
+    """
+    Torrents switch on and off at random, each burst lasting up to
+    burst seconds, with about a fraction of them on at once.
+    """
+
+    def __init__(self, torrents, upload, download, fraction=0.2, burst=60,
+                 seed=0, **kwargs):
+        Trace.__init__(self, torrents, **kwargs)
+        self.random = random.Random(seed)
+        self.upload = upload
+        self.download = download
+        self.fraction = fraction
+        self.burst = burst
+        self.on = {}
+        # When each torrent next changes, soonest first.
+        self.changes = [(0, i) for i in xrange(torrents)]
+
+    def rates(self, now):
+        while self.changes and self.changes[0][0] <= now:
+            until, i = heapq.heappop(self.changes)
+            heapq.heappush(self.changes,
+                           (now + self.random.uniform(1, self.burst), i))
+            if self.random.random() < self.fraction:
+                scale = self.random.uniform(0, 2) / (
+                    self.fraction * self.torrents)
+                self.on[i] = (self.upload * scale, self.download * scale)
+            else:
+                self.on.pop(i, None)
+        return self.on
+
+class Swarm(Bursty):
+    """
+    Thousands of torrents, of which a few percent are active at a time,
+    changing every churn seconds; like a large seedbox.
+    """
+
+    def __init__(self, torrents=2000, upload=10 * 1024 ** 2,
+                 download=2 * 1024 ** 2, fraction=0.05, churn=300, **kwargs):
+        Bursty.__init__(self, torrents, upload, download, fraction,
+                        churn, **kwargs)
+
+TRACES = {
+    "constant": Constant,
+    "bursty": Bursty,
+    "swarm": Swarm,
+}
@@ -69,5 +69,9 @@ setup(
     %s = %s:GtkUIPlugin
     [deluge.plugin.web]
     %s = %s:WebUIPlugin
-    """ % ((__plugin_name__, __plugin_name__.lower())*3)
+    [console_scripts]
+    trafficlimits-export = %s.exporter:main
+    trafficlimits-replay = %s.replay:main
+    """ % ((__plugin_name__, __plugin_name__.lower())*3
+           + (__plugin_name__.lower(),)*2)
 )
@@ -0,0 +1,152 @@
+#
+# accounting.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from array import array
+
+class TorrentAccounting(object):
+    """
+    Per-torrent transfer accounting.
+
+    Counters are kept in flat arrays indexed by a slot number assigned to
+    each torrent the first time it is seen, so that a tick touches only the
+    torrents present in the (active-only) batched status it is given.
+    Doubles are used rather than integers because they hold byte counts
+    exactly up to 2**53 on every platform, where array("L") may be 32 bits.
+    """
+
+    STATUS_KEYS = ["total_payload_upload", "total_payload_download"]
+
+    def __init__(self):
+        self.slots = {}
+        self.torrent_ids = []
+        self.free_slots = []
+        self.last_upload = array("d")
+        self.last_download = array("d")
+        self.changed = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def slot(self, torrent_id):
+        """Returns the slot for torrent_id, allocating one if needed."""
+        try:
+            return self.slots[torrent_id]
+        except KeyError:
+            pass
+
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.torrent_ids[slot] = torrent_id
+            self.last_upload[slot] = 0
+            self.last_download[slot] = 0
+        else:
+            slot = len(self.torrent_ids)
+            self.torrent_ids.append(torrent_id)
+            self.last_upload.append(0)
+            self.last_download.append(0)
+        self.slots[torrent_id] = slot
+        return slot
+
+    def update(self, torrents_status):
+        """
+        Folds a batched torrent status into the counters.
+
+        :param torrents_status: dict, torrent_id -> status dict containing
+            STATUS_KEYS, normally only for torrents that are transferring
+        :returns: dict, torrent_id -> (upload, download) bytes since the
+            previous update, for torrents that moved data
+        """
+        changed = {}
+        for torrent_id, status in torrents_status.iteritems():
+            upload = status.get("total_payload_upload", 0)
+            download = status.get("total_payload_download", 0)
+            slot = self.slots.get(torrent_id)
+            if slot is None:
+                # What a torrent first seen transferred before now is
+                # unknown to us; count from here.
+                slot = self.slot(torrent_id)
+                self.last_upload[slot] = upload
+                self.last_download[slot] = download
+                continue
+
+            # libtorrent restarts these counters when a torrent is paused
+            # and resumed, so a value going backwards is a fresh count.
+            delta_upload = upload - self.last_upload[slot]
+            if delta_upload < 0:
+                delta_upload = upload
+            delta_download = download - self.last_download[slot]
+            if delta_download < 0:
+                delta_download = download
+
+            self.last_upload[slot] = upload
+            self.last_download[slot] = download
+            if delta_upload or delta_download:
+                changed[torrent_id] = (delta_upload, delta_download)
+
+        self.changed = changed
+        return changed
+
+    def add(self, torrent_id):
+        """Starts counting a torrent that has just been added from zero."""
+        self.slot(torrent_id)
+
+    def remove(self, torrent_id):
+        slot = self.slots.pop(torrent_id, None)
+        if slot is not None:
+            self.torrent_ids[slot] = None
+            self.free_slots.append(slot)
+        self.changed.pop(torrent_id, None)
+
+    def transferring(self, direction):
+        """
+        Returns the torrents that moved data in direction ("upload",
+        "download" or "total") during the last update, heaviest first.
+        """
+        if direction == "upload":
+            weight = lambda delta: delta[0]
+        elif direction == "download":
+            weight = lambda delta: delta[1]
+        else:
+            weight = lambda delta: delta[0] + delta[1]
+
+        torrent_ids = [torrent_id for torrent_id, delta
+                       in self.changed.iteritems() if weight(delta) > 0]
+        torrent_ids.sort(key=lambda torrent_id: weight(self.changed[torrent_id]),
+                         reverse=True)
+        return torrent_ids
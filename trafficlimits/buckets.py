@@ -0,0 +1,230 @@
+#
+# buckets.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from array import array
+import time
+
+from forecast import RateEstimator, time_to_limit
+
+# Bucket "match" values, and the torrent status key each one compares.
+MATCH_KEYS = {
+    "label": "label",
+    "tracker": "tracker_host",
+    "owner": "owner",
+}
+
+STATUS_KEYS = sorted(set(MATCH_KEYS.values()))
+
+class Buckets(object):
+    """
+    Independent quotas for groups of torrents.
+
+    Each bucket is configured as a dict like
+
+        {"name": "tv", "match": "label", "value": "tv",
+         "maximum_upload": -1, "maximum_download": -1,
+         "maximum_total": 53687091200}
+
+    A torrent belongs to every bucket whose match key has the given value in
+    its status.  The torrent -> bucket index is built once, then maintained
+    from torrent added/removed events and from the status of active torrents
+    that is fetched each tick anyway, so nothing is reclassified unless its
+    label, tracker or owner actually changed.
+    """
+
+    def __init__(self, buckets, usage=None):
+        """
+        :param buckets: list of bucket dicts, as described above
+        :param usage: dict, name -> [upload, download, reset_time], as
+            previously returned by usage()
+        """
+        self.buckets = [bucket for bucket in buckets
+                        if bucket.get("match") in MATCH_KEYS]
+        self.names = [bucket["name"] for bucket in self.buckets]
+        self.maximum_upload = [bucket.get("maximum_upload", -1)
+                               for bucket in self.buckets]
+        self.maximum_download = [bucket.get("maximum_download", -1)
+                                 for bucket in self.buckets]
+        self.maximum_total = [bucket.get("maximum_total", -1)
+                              for bucket in self.buckets]
+
+        self.index = {}
+        for i, bucket in enumerate(self.buckets):
+            key = (MATCH_KEYS[bucket["match"]], bucket.get("value", ""))
+            self.index.setdefault(key, []).append(i)
+
+        count = len(self.buckets)
+        self.upload = array("d", [0]) * count
+        self.download = array("d", [0]) * count
+        self.reset_time = [time.time()] * count
+        for i, name in enumerate(self.names):
+            if usage and name in usage:
+                self.upload[i], self.download[i], self.reset_time[i] \
+                    = usage[name]
+
+        self.tick_upload = array("d", [0]) * count
+        self.tick_download = array("d", [0]) * count
+        self.upload_rate = [RateEstimator() for bucket in self.buckets]
+        self.download_rate = [RateEstimator() for bucket in self.buckets]
+
+        self.members = [set() for bucket in self.buckets]
+        self.torrents = {}	# torrent_id -> (match values, bucket indices)
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def classify(self, torrent_id, status):
+        """Files torrent_id into buckets if its match values changed."""
+        values = tuple([status.get(key, "") for key in STATUS_KEYS])
+        previous = self.torrents.get(torrent_id)
+        if previous is not None and previous[0] == values:
+            return
+
+        indices = []
+        for key, value in zip(STATUS_KEYS, values):
+            indices.extend(self.index.get((key, value), ()))
+
+        if previous is not None:
+            for i in previous[1]:
+                self.members[i].discard(torrent_id)
+        for i in indices:
+            self.members[i].add(torrent_id)
+        self.torrents[torrent_id] = (values, indices)
+
+    def classify_all(self, torrents_status):
+        for torrent_id, status in torrents_status.iteritems():
+            self.classify(torrent_id, status)
+
+    def remove(self, torrent_id):
+        previous = self.torrents.pop(torrent_id, None)
+        if previous is not None:
+            for i in previous[1]:
+                self.members[i].discard(torrent_id)
+
+    def update(self, torrents_status, changed, elapsed):
+        """
+        :param torrents_status: dict, torrent_id -> status dict for the
+            torrents fetched this tick, including STATUS_KEYS
+        :param changed: dict, torrent_id -> (upload, download) deltas, as
+            returned by TorrentAccounting.update()
+        :param elapsed: float, seconds since the previous update
+        """
+        for torrent_id, status in torrents_status.iteritems():
+            self.classify(torrent_id, status)
+
+        count = len(self.buckets)
+        self.tick_upload = array("d", [0]) * count
+        self.tick_download = array("d", [0]) * count
+        for torrent_id, (upload, download) in changed.iteritems():
+            for i in self.torrents[torrent_id][1]:
+                self.tick_upload[i] += upload
+                self.tick_download[i] += download
+
+        for i in xrange(count):
+            self.upload[i] += self.tick_upload[i]
+            self.download[i] += self.tick_download[i]
+            self.upload_rate[i].update(self.tick_upload[i], elapsed)
+            self.download_rate[i].update(self.tick_download[i], elapsed)
+
+    def exceeded(self):
+        """
+        Returns a list of (bucket index, direction) for every bucket that is
+        over one of its limits.
+        """
+        exceeded = []
+        for i in xrange(len(self.buckets)):
+            if 0 <= self.maximum_upload[i] < self.upload[i]:
+                exceeded.append((i, "upload"))
+            elif 0 <= self.maximum_download[i] < self.download[i]:
+                exceeded.append((i, "download"))
+            elif 0 <= self.maximum_total[i] \
+                    < self.upload[i] + self.download[i]:
+                exceeded.append((i, "total"))
+        return exceeded
+
+    def time_to_limit(self):
+        """
+        Returns a dict, name -> seconds until the bucket reaches its nearest
+        limit at the current rate, for buckets with a forecast.
+        """
+        forecast = {}
+        for i, name in enumerate(self.names):
+            upload_rate = self.upload_rate[i].peak()
+            download_rate = self.download_rate[i].peak()
+            seconds = [s for s in [
+                time_to_limit(self.upload[i], self.maximum_upload[i],
+                              upload_rate),
+                time_to_limit(self.download[i], self.maximum_download[i],
+                              download_rate),
+                time_to_limit(self.upload[i] + self.download[i],
+                              self.maximum_total[i],
+                              upload_rate + download_rate),
+            ] if s is not None]
+            if seconds:
+                forecast[name] = min(seconds)
+        return forecast
+
+    def reset(self, i=None):
+        """Zeroes bucket i, or every bucket if i is None."""
+        indices = xrange(len(self.buckets)) if i is None else [i]
+        now = time.time()
+        for i in indices:
+            self.upload[i] = 0
+            self.download[i] = 0
+            self.reset_time[i] = now
+
+    def usage(self):
+        """Returns the counters in a form suitable for saving to config."""
+        return dict(
+            (name, [self.upload[i], self.download[i], self.reset_time[i]])
+            for i, name in enumerate(self.names)
+        )
+
+    def state(self):
+        """
+        Returns a list with, for each bucket, [name, upload, download,
+        total, maximum_upload, maximum_download, maximum_total, reset_time].
+        """
+        return [
+            [name, self.upload[i], self.download[i],
+             self.upload[i] + self.download[i],
+             self.maximum_upload[i], self.maximum_download[i],
+             self.maximum_total[i], self.reset_time[i]]
+            for i, name in enumerate(self.names)
+        ]
@@ -37,6 +37,21 @@
 #    statement from all source files in the program, then also delete it here.
 #
 
+import os
+
 def get_resource(filename):
-    import pkg_resources, os
+    path = os.path.join(os.path.dirname(__file__), "data", filename)
+    if os.path.exists(path):
+        return path
+    # Installed as a zipped egg: have it extracted.  Importing pkg_resources
+    # is slow, so is only done when there is no other way.
+    import pkg_resources
     return pkg_resources.resource_filename("trafficlimits", os.path.join("data", filename))
+
+# The fields of Core.get_state(), in order.
+STATE_FIELDS = [
+    "label", "upload", "download", "total",
+    "maximum_upload", "maximum_download", "maximum_total",
+    "reset_time_upload", "reset_time_download", "reset_time_total",
+    "buckets", "windows", "rules",
+]
@@ -41,11 +41,36 @@ from deluge.log import LOG as log
 from deluge.plugins.pluginbase import CorePluginBase
 import deluge.component as component
 import deluge.configmanager
-from deluge.core.rpcserver import export
-import os
+from deluge.core.rpcserver import export, RPC_EVENT
 from deluge.event import DelugeEvent
-from twisted.internet.task import LoopingCall
+from twisted.internet import defer, reactor
+from twisted.internet.error import CannotListenError
 import time
+from accounting import TorrentAccounting
+import buckets
+from history import History
+import exporter
+import periods
+from forecast import RateEstimator, time_to_limit, next_interval
+from updates import UpdateCoalescer
+from common import STATE_FIELDS
+from watcher import LimitsWatcher
+from schedule import Schedule
+from journal import Journal
+import fileio
+from sharedquota import SharedQuota
+from windows import Windows
+import rules
+from interface import InterfaceCounters
+import unmetered
+from resume import ResumeScheduler
+from partial import PartialPauser
+import pacing
+import metrics
+from metrics import Metrics, timer
+
+# Longest that wait_for_change() will hold a request, in seconds.
+MAXIMUM_WAIT = 300
 
 init_time = time.time()
 DEFAULT_PREFS = {
@@ -58,28 +83,166 @@ DEFAULT_PREFS = {
     "reset_time_upload": init_time,
     "reset_time_download": init_time,
     "reset_time_total": init_time,
-    "label": ""
+    "label": "",
+    "pause_mode": "session",	# "session" or "torrents"
+    "resume_batch": 0,		# torrents resumed at a time; 0 for all at once
+    "resume_interval": 10,	# seconds between batches
+    "resume_order": "queue",	# "queue", "ratio" or "size"
+    "partial_pausing": [],	# [fraction of a limit, fraction of torrents]
+    "pause_priority": "queue",	# "queue", "ratio" or "label"
+    "label_priorities": {},	# label -> priority, higher to keep running
+    "buckets": [],
+    "bucket_usage": {},
+    "windows": [],
+    "rules": [],
+    "rule_usage": {},
+    "minimum_interval": 1,
+    "maximum_interval": 60,
+    "event_threshold": 0,	# bytes
+    "event_interval": 1,	# seconds between updates to each client
+    "schedule": [],
+    "schedule_applied": 0,	# start of the last scheduled rule applied
+    "journal_sync_interval": 60,
+    "pacing": False,
+    "pacing_period": 30 * 24 * 60 * 60,	# unless the schedule says otherwise
+    "pacing_window": 60 * 60,
+    "pacing_original": {},	# the user's speed limits, while pacing
+    "resume_pending": [],	# torrents still to be resumed, in order
+    "metrics_port": 0,		# 0 for none
+    "metrics_socket": "",	# path of a UNIX socket, or "" for none
+    "shared_quota": "",		# path of a file shared with other instances
+    "accounting_source": "session",	# "session" or "interface"
+    "interface": "",		# network interface to count, e.g., "eth0"
+    "unmetered": []		# CIDR ranges of peers not to count
 }
 
 class Core(CorePluginBase):
     def enable(self):
         log.debug("TrafficLimits: Enabling...")
+        self.metrics = Metrics()
         self.config = deluge.configmanager.ConfigManager("trafficlimits.conf",
                                                          DEFAULT_PREFS)
+        self.enabled = True
+        self.io = fileio.BackgroundIO()
+        self.saver = fileio.ConfigSaver(self.config, self.io)
+        self.journal = Journal(
+            deluge.configmanager.get_config_dir("trafficlimits.journal"),
+            self.io, self.config["journal_sync_interval"])
+        self.recover()
+        self.journal.open()
+        self.history = History(deluge.configmanager.get_config_dir(
+            "trafficlimits.history"))
+        self.periods = periods.PeriodLog(deluge.configmanager.get_config_dir(
+            "trafficlimits.periods"))
         self.paused = False	# Paused by us, not some other plugin.
+        self.paused_torrents = set()
+        self.session_paused = False
+        self.session_torrents = set()	# Running when the session was paused.
+        self.partially_paused = set()
+        self.resumer = ResumeScheduler(self.config["resume_batch"],
+                                       self.config["resume_interval"],
+                                       self.config["resume_order"],
+                                       self.config, self.saver.save)
+        self.temporary_pause = False	# Lasts only while a limit is over.
+        self.accounting = TorrentAccounting()
         self.label = self.config["label"]
-        self.limits_mtime = 0
+        self.unmetered_upload = 0	# to and from unmetered peers, so far
+        self.unmetered_download = 0
+        self.load_unmetered()
+        self.open_interface()
         self.set_initial()
-        self.load_limits()
+        self.upload = self.config["previous_upload"]
+        self.download = self.config["previous_download"]
+        self.total = self.config["previous_total"]
+        self.last_upload = self.initial_upload
+        self.last_download = self.initial_download
+        self.last_update = time.time()
+        self.upload_rate = RateEstimator()
+        self.download_rate = RateEstimator()
+        self.others_upload_rate = RateEstimator()
+        self.others_download_rate = RateEstimator()
+        self.others = (0, 0)
+        self.shared = None
+        if self.config["shared_quota"]:
+            self.open_shared()
+        self.forecast = {}
+        self.pacer = pacing.Pacer(self.config, self.saver.save)
+        self.pacer.recover()
+        self.coalescer = UpdateCoalescer(self.config["event_threshold"],
+                                         self.config["event_interval"])
+        self.event_timer = None
+        self.config_version = 0	# Bumped by set_config().
+        self.waiters = []	# (Deferred, timeout) from wait_for_change().
+        self.update_timer = None
+        self.load_windows()
+        self.load_rules()
+        self.watcher = None
+        self.schedule_timer = None
+        self.metrics_listener = None
+        self.load_partial()
+        self.load_buckets()
 
-        self.update_timer = LoopingCall(self.update_traffic)
-        self.update_timer.start(10)
+        component.get("EventManager").register_event_handler(
+            "TorrentAddedEvent", self.on_torrent_added)
+        component.get("EventManager").register_event_handler(
+            "TorrentRemovedEvent", self.on_torrent_removed)
+
+        # The rest can wait until Deluge has finished enabling plugins.
+        self.started = False
+        self.update_timer = reactor.callLater(0, self.start)
         log.debug("TrafficLimits: Enabled.")
 
 
+    def start(self):
+        """Loads the limits file, and then carries on with start_updates()."""
+        self.load_limits().addCallback(self.start_updates)
+
+
+    def start_updates(self, result=None):
+        """
+        Carries on resuming anything left paused last time, loads the
+        schedule, starts watching for changes and serving metrics, and makes
+        the first update.
+        """
+        if not self.enabled:
+            return
+        self.started = True
+        # Deluge only loads its torrents once plugins are enabled.
+        self.resumer.recover()
+        self.watcher = LimitsWatcher(
+            deluge.configmanager.get_config_dir("trafficlimits"),
+            self.on_limits_changed, self.io)
+        self.watcher.start()
+        self.load_schedule()
+
+        try:
+            self.metrics_listener = metrics.listen(
+                self.config["metrics_port"], self.config["metrics_socket"],
+                self.render_metrics)
+        except (ImportError, CannotListenError) as error:
+            log.error("TrafficLimits: Unable to serve metrics: " + str(error))
+
+        self.tick()
+
+
     def disable(self):
         log.debug("TrafficLimits: Disabling...")
-        self.update_timer.stop()
+        self.enabled = False
+        if self.update_timer.active():
+            self.update_timer.cancel()
+        if self.event_timer and self.event_timer.active():
+            self.event_timer.cancel()
+        self.notify_waiters()
+        if self.watcher:
+            self.watcher.stop()
+        if self.metrics_listener:
+            self.metrics_listener.stopListening()
+        if self.schedule_timer and self.schedule_timer.active():
+            self.schedule_timer.cancel()
+        component.get("EventManager").deregister_event_handler(
+            "TorrentAddedEvent", self.on_torrent_added)
+        component.get("EventManager").deregister_event_handler(
+            "TorrentRemovedEvent", self.on_torrent_removed)
 
         self.config["previous_upload"] \
             += self.session_upload - self.initial_upload
@@ -87,29 +250,129 @@ class Core(CorePluginBase):
             += self.session_download - self.initial_download
         self.config["previous_total"] \
             += self.session_total - self.initial_total
-        self.config.save()
+        self.config["bucket_usage"] = self.buckets.usage()
+        self.config["rule_usage"] = self.rules.usage(self.snapshot())
+        self.pacer.restore()
         if self.paused:
-            component.get("Core").session.resume()
+            self.resume()
+        self.resumer.finish()
+        # Let anything under way in the background finish first.
+        self.saver.cancel()
+        self.io.stop()
+        self.saver.close()
+        self.journal.close(clean=True)
+        if self.shared:
+            self.shared.close()
+        if self.interface:
+            self.interface.close()
+        self.history.close()
         log.debug("TrafficLimits: Disabled.")
 
 
+    def recover(self):
+        """
+        Restores the counters from the journal, which will only have
+        anything in it if we were not shut down cleanly last time.
+        """
+        recovered = self.journal.replay()
+        if recovered is None:
+            return
+        checkpoint, counters = recovered
+        log.info("TrafficLimits: Recovering counters saved at "
+                 + time.strftime("%c", time.localtime(checkpoint[0])) + ".")
+        (checkpoint_time,
+         self.config["previous_upload"],
+         self.config["previous_download"],
+         self.config["previous_total"],
+         self.config["reset_time_upload"],
+         self.config["reset_time_download"],
+         self.config["reset_time_total"]) = checkpoint
+        # The quota buckets and rules are loaded from these later.
+        for key, value in counters.iteritems():
+            self.config[key] = value
+
+
+    def tick(self):
+        """
+        Updates, then arranges to be called again.  The delay is half the
+        forecast time until the nearest limit is reached, kept between
+        minimum_interval and maximum_interval, so checks are rare while
+        limits are far off and frequent as one gets close.
+        """
+        start = timer()
+        try:
+            self.update_traffic()
+        finally:
+            self.metrics.increment("ticks")
+            self.metrics.stage("tick", start)
+            delay = next_interval(self.forecast.get("nearest"),
+                                  self.config["minimum_interval"],
+                                  self.config["maximum_interval"])
+            self.forecast["next_update"] = delay
+            self.update_timer = reactor.callLater(delay, self.tick)
+
+
+    def reschedule(self):
+        """Brings the next update forward to now, e.g., after new limits."""
+        if not self.started:
+            return	# start() will update soon enough.
+        if self.update_timer and self.update_timer.active():
+            self.update_timer.cancel()
+            self.update_timer = reactor.callLater(0, self.tick)
+
+
     def update_traffic(self):
         log.debug("TrafficLimits: Updating...")
 
-        try:
-            if os.stat(deluge.configmanager.get_config_dir("trafficlimits")) \
-                    .st_mtime != self.limits_mtime:
-                self.load_limits();
-        except OSError as error:
-            log.debug("TrafficLimits: "
-                      + deluge.configmanager.get_config_dir("trafficlimits")
-                      + ": " + str(error))
+        start = timer()
+        self.watcher.poll()
+        start = self.metrics.stage("limits", start)
+
+        if self.peers is not None:
+            self.update_unmetered()
+            start = self.metrics.stage("unmetered", start)
+
+        self.session_upload, self.session_download = self.read_counters()
+        self.session_total = self.session_upload + self.session_download
+        start = self.metrics.stage("session_status", start)
+
+        if self.shared:
+            for direction, reset_time, breached in self.shared.resets():
+                self.reset_counter(direction, reset_time)
+                if breached:
+                    log.info("TrafficLimits: Session paused due to excessive "
+                             + direction + " by another instance.")
+                    self.pause(direction)
 
-        status = component.get("Core").get_session_status(["total_upload",
-                                                           "total_download"])
-        self.session_upload = status["total_upload"]
-        self.session_download = status["total_download"]
-        self.session_total = status["total_upload"] + status["total_download"]
+        now = time.time()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.history.record(now,
+                            self.session_upload - self.last_upload,
+                            self.session_download - self.last_download)
+        self.windows.add(now,
+                         self.session_upload - self.last_upload,
+                         self.session_download - self.last_download)
+        self.upload_rate.update(self.session_upload - self.last_upload,
+                                elapsed)
+        self.download_rate.update(self.session_download - self.last_download,
+                                  elapsed)
+        self.last_upload = self.session_upload
+        self.last_download = self.session_download
+        start = self.metrics.stage("history", start)
+
+        if self.config["pause_mode"] == "torrents" or self.buckets \
+                or self.partial:
+            torrents_status = component.get("Core").get_torrents_status(
+                {"state": ["Active"]}, self.status_keys
+            )
+            start = self.metrics.stage("torrents_status", start)
+            changed = self.accounting.update(torrents_status)
+            if self.buckets:
+                self.buckets.update(torrents_status, changed, elapsed)
+            if self.partial:
+                self.partial.update(torrents_status, now)
+            start = self.metrics.stage("accounting", start)
 
         self.upload = ( self.config["previous_upload"]
                         + self.session_upload - self.initial_upload )
@@ -117,101 +380,644 @@ class Core(CorePluginBase):
                           + self.session_download - self.initial_download )
         self.total = ( self.config["previous_total"]
                        + self.session_total - self.initial_total )
+        if self.shared:
+            self.update_shared(elapsed)
+            start = self.metrics.stage("shared", start)
 
-        if ( self.config["maximum_upload"] >= 0
-             and self.upload > self.config["maximum_upload"] ):
-            log.info("TrafficLimits: Session paused due to excessive upload.")
-            self.paused = True
-            component.get("Core").session.pause()
-            self.initial_upload = self.session_upload
-            self.config["previous_upload"] = 0
-            self.config["reset_time_upload"] = time.time()
-
-        if ( self.config["maximum_download"] >= 0
-             and self.download > self.config["maximum_download"] ):
-            log.info("TrafficLimits: Session paused due to excessive download.")
-            self.paused = True
-            component.get("Core").session.pause()
-            self.initial_download = self.session_download
-            self.config["previous_download"] = 0
-            self.config["reset_time_download"] = time.time()
+        self.enforce(now)
 
-        if ( self.config["maximum_total"] >= 0
-             and self.total > self.config["maximum_total"] ):
-            log.info("TrafficLimits: Session paused due to excessive throughput.")
-            self.paused = True
-            component.get("Core").session.pause()
-            self.initial_total = self.session_total
-            self.config["previous_total"] = 0
-            self.config["reset_time_total"] = time.time()
-
-        component.get("EventManager").emit(
-            TrafficLimitUpdate(
-                self.config["label"], self.upload, self.download, self.total,
-                self.config["maximum_upload"],
-                self.config["maximum_download"],
-                self.config["maximum_total"],
-                self.config["reset_time_upload"],
-                self.config["reset_time_download"],
-                self.config["reset_time_total"]
+        for i, direction in self.buckets.exceeded():
+            log.info("TrafficLimits: Torrents in %s paused due to excessive %s."
+                     % (self.buckets.names[i], direction))
+            members = self.buckets.members[i]
+            self.pause_torrents(
+                [torrent_id for torrent_id
+                 in self.accounting.transferring(direction)
+                 if torrent_id in members]
             )
+            self.buckets.reset(i)
+        start = self.metrics.stage("enforcement", start)
+
+        if self.config["pacing"]:
+            self.update_pacing(now)
+        elif self.pacer.active():
+            self.pacer.restore()
+        start = self.metrics.stage("pacing", start)
+
+        self.journal.append(
+            (now,
+             self.config["previous_upload"]
+             + self.session_upload - self.initial_upload,
+             self.config["previous_download"]
+             + self.session_download - self.initial_download,
+             self.config["previous_total"]
+             + self.session_total - self.initial_total,
+             self.config["reset_time_upload"],
+             self.config["reset_time_download"],
+             self.config["reset_time_total"]),
+            {"bucket_usage": self.buckets.usage(),
+             "rule_usage": self.rules.usage(self.snapshot())}
         )
+        start = self.metrics.stage("journal", start)
+
+        self.update_forecast()
+
+        state = dict(zip(STATE_FIELDS, self.get_state()))
+        state["config_version"] = self.config_version
+        if self.coalescer.update(state):
+            self.emit_update()
+            self.notify_waiters()
+        self.metrics.stage("events", start)
 
         log.debug("TrafficLimits: Updated.")
 
 
-    def load_limits(self):
-        log.debug("TrafficLimits: Loading limits...")
+    def snapshot(self):
+        """Returns the counters that rules are evaluated on."""
+        return (self.upload, self.download, self.total,
+                self.session_upload, self.session_download, self.session_total)
+
+
+    def enforce(self, now):
+        """
+        Evaluates the rules and the sliding windows together, and takes at
+        most one action for all that were breached.
+        """
+        snapshot = self.snapshot()
+        released = self.rules.expire(snapshot, now)
+        breached = self.rules.breached(snapshot)
+        exceeded = set(self.windows.exceeded())
+        windows = sorted(exceeded - self.windows_exceeded)
+        self.windows_exceeded = exceeded
+
+        for i in breached:
+            log.info("TrafficLimits: %s limit of %d bytes exceeded."
+                     % (self.rules.names[i].capitalize(),
+                        self.rules.maximum[i]))
+        for i, direction in windows:
+            log.info("TrafficLimits: %s limit exceeded in %s."
+                     % (direction.capitalize(), self.windows.names[i]))
+
+        decision = rules.decide(
+            [self.rules.directions[i] for i in breached]
+            + [direction for i, direction in windows],
+            [self.rules.actions[i] for i in breached]
+            + ["pause"] * len(windows))
+        if decision is not None and decision[0] == "pause":
+            log.info("TrafficLimits: Session paused due to excessive %s."
+                     % decision[1])
+            # Limits that start again straight away pause until the label
+            # changes; the rest only while they are over.
+            self.pause(decision[1], not any(
+                self.rules.actions[i] == "pause"
+                and self.rules.policies[i] == "breach" for i in breached))
+        elif self.partial:
+            self.pause_partially(now)
+
+        for i in breached:
+            if i < rules.MAIN:
+                self.reset_counter(self.rules.directions[i], breached=True)
+            elif self.rules.policies[i] == "breach":
+                self.rules.reset(i, snapshot, now)
+            else:
+                self.rules.hold(i)
+
+        if self.temporary_pause and not exceeded \
+                and not self.rules.holding():
+            log.info("TrafficLimits: Session resumed as %s."
+                     % ("a period has ended" if released
+                        else "the windows are within their limits"))
+            self.resume()
+
 
+    def pause_partially(self, now):
+        """
+        Pauses the lowest priority torrents, as many as partial_pausing
+        calls for at the fullest of the main limits.
+        """
+        used = max([0.0] + [
+            used / float(maximum) for used, maximum
+            in zip((self.upload, self.download, self.total),
+                   (self.config["maximum_upload"],
+                    self.config["maximum_download"],
+                    self.config["maximum_total"]))
+            if maximum > 0])
+        wanted = self.partial.wanted(used, len(self.partially_paused),
+                                     now)
+        if wanted > 0:
+            torrent_ids = self.partial.lowest(wanted, now)
+            log.info("TrafficLimits: %d%% of a limit used; pausing the "
+                     "lowest priority torrents." % (100 * used))
+            self.pause_torrents(torrent_ids)
+            self.partially_paused.update(torrent_ids)
+
+
+    def open_shared(self):
+        """
+        Joins the instances sharing the quota in the shared_quota file, and
+        catches up with any reset they made while we were not running.
+        """
+        shared = SharedQuota(self.config["shared_quota"],
+                             deluge.configmanager.get_config_dir())
+        if not shared.open():
+            return
+        self.shared = shared
+        for direction in ("upload", "download", "total"):
+            reset_time = shared.reset_time(direction)
+            if reset_time > self.config["reset_time_" + direction]:
+                self.reset_counter(direction, reset_time)
+
+
+    def update_shared(self, elapsed):
+        """
+        Publishes our usage, and replaces the counters with the usage of
+        the whole host, so that the limits apply to all instances together.
+        """
+        self.shared.publish(self.upload, self.download, self.total)
+        upload, download, self.total = self.shared.totals()
+
+        # Follow the other instances' rates as well, so that we check often
+        # enough as the host approaches a limit.
+        others = (upload - self.upload, download - self.download)
+        self.others_upload_rate.update(max(0, others[0] - self.others[0]),
+                                       elapsed)
+        self.others_download_rate.update(max(0, others[1] - self.others[1]),
+                                         elapsed)
+        self.others = others
+        self.upload = upload
+        self.download = download
+
+
+    def emit_update(self):
+        """
+        Sends each client listening for TrafficLimitUpdate whatever changed
+        since it was last sent one, unless that was too recent, in which
+        case it is sent later.
+        """
+        self.event_timer = None
+        rpcserver = component.get("RPCServer")
+        clients = [session_id for session_id, events
+                   in rpcserver.factory.interested_events.iteritems()
+                   if TrafficLimitUpdate.__name__ in events]
+        self.coalescer.forget(clients)
+
+        now = time.time()
+        delays = []
+        for session_id in clients:
+            changes = self.coalescer.changes(session_id, now)
+            if changes is not None:
+                self.emit_to_session(rpcserver, session_id,
+                                     TrafficLimitUpdate(self.coalescer.version,
+                                                        changes))
+            else:
+                delay = self.coalescer.waiting(session_id, now)
+                if delay is not None:
+                    delays.append(delay)
+
+        if delays:
+            self.event_timer = reactor.callLater(min(delays), self.emit_update)
+
+
+    def emit_to_session(self, rpcserver, session_id, event):
+        self.metrics.increment("events")
         try:
-            limits = open(deluge.configmanager.get_config_dir("trafficlimits"))
-            limits_mtime = os.fstat(limits.fileno()).st_mtime
-            label = limits.readline().rstrip(os.linesep)
-            maximum_upload = int(limits.readline().rstrip(os.linesep))
-            maximum_download = int(limits.readline().rstrip(os.linesep))
+            emit = rpcserver.emit_event_for_session_id
+        except AttributeError:
+            # Older RPCServers have no method for this, so send the event
+            # over the session's own connection.
+            rpcserver.factory.session_protocols[session_id].sendData(
+                (RPC_EVENT, event.name, event.args)
+            )
+        else:
+            emit(session_id, event)
+
+
+    def update_pacing(self, now):
+        """
+        Adjusts the session speed limits so that what is left of each limit
+        lasts until the end of its period: the next scheduled transition if
+        there is one, or pacing_period after it was last reset.
+        """
+        end = self.schedule.next_transition(now)
+
+        def rate(direction, used):
+            start = self.config["reset_time_" + direction]
+            return pacing.allowed_rate(
+                used, self.config["maximum_" + direction], start,
+                end or start + self.config["pacing_period"], now,
+                self.config["pacing_window"])
+
+        upload = rate("upload", self.upload)
+        download = rate("download", self.download)
+        total = rate("total", self.total)
+        if total is not None:
+            # Share the total between directions as they are being used.
+            upload_rate = ( self.upload_rate.peak()
+                            + self.others_upload_rate.peak() )
+            download_rate = ( self.download_rate.peak()
+                              + self.others_download_rate.peak() )
+            share = 0.5
+            if upload_rate + download_rate > 0:
+                share = upload_rate / (upload_rate + download_rate)
+            upload = min(upload, total * share) if upload is not None \
+                else total * share
+            download = min(download, total * (1 - share)) \
+                if download is not None else total * (1 - share)
+
+        if self.shared:
+            # Those rates are for the whole host; take our part of them.
+            def part(rate, local, others):
+                if rate is None:
+                    return None
+                combined = local.peak() + others.peak()
+                return rate * local.peak() / combined if combined > 0 \
+                    else rate
+            upload = part(upload, self.upload_rate, self.others_upload_rate)
+            download = part(download, self.download_rate,
+                            self.others_download_rate)
 
-            line = limits.readline().rstrip(os.linesep)
-            maximum_total = -1 if line == '' else int(line)
+        self.pacer.apply(upload, download, now)
 
-        except (IOError, OSError, ValueError) as error:
+
+    def update_forecast(self):
+        upload_rate = ( self.upload_rate.peak()
+                        + self.others_upload_rate.peak() )
+        download_rate = ( self.download_rate.peak()
+                          + self.others_download_rate.peak() )
+        self.forecast = {
+            "upload": time_to_limit(self.upload,
+                                    self.config["maximum_upload"],
+                                    upload_rate),
+            "download": time_to_limit(self.download,
+                                      self.config["maximum_download"],
+                                      download_rate),
+            "total": time_to_limit(self.total, self.config["maximum_total"],
+                                   upload_rate + download_rate),
+            "buckets": self.buckets.time_to_limit(),
+            "windows": self.windows.time_to_limit(time.time(), upload_rate,
+                                                  download_rate),
+            "rules": self.rules.time_to_limit(self.snapshot(),
+                                              self.upload_rate.peak(),
+                                              self.download_rate.peak()),
+            "upload_rate": upload_rate,
+            "download_rate": download_rate,
+        }
+        seconds = [self.forecast[direction] for direction
+                   in ("upload", "download", "total")
+                   if self.forecast[direction] is not None]
+        seconds.extend(self.forecast["buckets"].values())
+        seconds.extend(self.forecast["windows"].values())
+        seconds.extend(self.forecast["rules"].values())
+        if self.rules.holding():
+            seconds.append(max(0, self.rules.soonest - time.time()))
+        self.forecast["nearest"] = min(seconds) if seconds else None
+
+
+    def load_limits(self):
+        """
+        Reads the limits file in the background.  Returns a Deferred that
+        fires once its limits are in force, or have been found wanting.
+        """
+        log.debug("TrafficLimits: Loading limits...")
+        self.metrics.increment("limits_loads")
+        return self.io.read(
+            deluge.configmanager.get_config_dir("trafficlimits")
+        ).addCallbacks(self.on_limits_read, self.on_limits_error)
+
+
+    def on_limits_read(self, text):
+        if not self.enabled:
+            return
+        lines = text.splitlines() + [""] * 4
+        try:
+            label = lines[0]
+            maximum_upload = int(lines[1])
+            maximum_download = int(lines[2])
+            maximum_total = -1 if lines[3] == '' else int(lines[3])
+        except ValueError as error:
             log.error("TrafficLimits: "
                       + deluge.configmanager.get_config_dir("trafficlimits")
                       + ": " + str(error))
             return
 
-        self.limits_mtime = limits_mtime
+        self.apply_limits(label, maximum_upload, maximum_download,
+                          maximum_total)
+        self.reschedule()
+        log.debug("TrafficLimits: Loaded limits.")
+
+
+    def on_limits_error(self, failure):
+        log.error("TrafficLimits: "
+                  + deluge.configmanager.get_config_dir("trafficlimits")
+                  + ": " + failure.getErrorMessage())
+
+
+    def apply_limits(self, label, maximum_upload, maximum_download,
+                     maximum_total, reset=None):
+        """
+        Puts new limits and label into force.  The counters are cleared, and
+        anything we paused is resumed, if reset is true, or if reset is None
+        and the label has changed.
+        """
         self.label = label
         self.config["maximum_upload"] = maximum_upload
         self.config["maximum_download"] = maximum_download
         self.config["maximum_total"] = maximum_total
+        self.rules.set_limits(maximum_upload, maximum_download, maximum_total)
 
-        if self.label != self.config["label"]:
-            self.config["label"] = self.label
+        if reset or (reset is None and self.label != self.config["label"]):
+            # Clear the counters first, so the periods ending are logged
+            # under the old label.
             self.reset_initial()
             if self.paused:
-                self.paused = False
-                component.get("Core").session.resume()
+                self.resume()
+        self.config["label"] = self.label
+        self.saver.save()
+
+
+    def load_schedule(self):
+        if self.schedule_timer and self.schedule_timer.active():
+            self.schedule_timer.cancel()
+        self.schedule = Schedule(self.config["schedule"])
+        self.apply_schedule()
+
+
+    def apply_schedule(self):
+        """
+        Applies the scheduled rule in force now, unless it already has been,
+        and sets a timer for the next transition.
+        """
+        self.schedule_timer = None
+        now = time.time()
+        active = self.schedule.active(now)
+        if active is None:
+            return
+
+        start, rule = active
+        reset = rule.get("reset")
+        if start <= self.config["schedule_applied"]:
+            # Already started before a restart; don't clear it again.
+            reset = False
+        self.metrics.increment("schedule_transitions")
+        log.info("TrafficLimits: Applying scheduled limits for "
+                 + rule.get("label", "") + ".")
+        self.apply_limits(rule.get("label", ""),
+                          rule.get("maximum_upload", -1),
+                          rule.get("maximum_download", -1),
+                          rule.get("maximum_total", -1),
+                          reset)
+        self.config["schedule_applied"] = start
+        self.saver.save()
+        self.reschedule()
+
+        next_transition = self.schedule.next_transition(now)
+        if next_transition is not None:
+            self.schedule_timer = reactor.callLater(
+                max(0, next_transition - time.time()), self.apply_schedule)
+
+
+    def on_limits_changed(self):
+        self.load_limits()
+
+
+    def load_windows(self):
+        """(Re)builds the sliding windows from the traffic history."""
+        self.windows = Windows(self.config["windows"])
+        self.windows.load(self.history, time.time())
+        self.windows_exceeded = set()
+
+
+    def load_rules(self):
+        """(Re)builds the rules, from the main limits and the rules list."""
+        self.rules = rules.Rules(self.config["rules"],
+                                 self.config["rule_usage"], self.snapshot())
+        self.rules.set_limits(self.config["maximum_upload"],
+                              self.config["maximum_download"],
+                              self.config["maximum_total"])
+
+
+    def load_partial(self):
+        self.partial = PartialPauser(self.config["partial_pausing"],
+                                     self.config["pause_priority"],
+                                     self.config["label_priorities"])
+
+
+    def load_buckets(self):
+        """(Re)builds the quota buckets and files every torrent into them."""
+        self.buckets = buckets.Buckets(self.config["buckets"],
+                                       self.config["bucket_usage"])
+        self.status_keys = TorrentAccounting.STATUS_KEYS \
+            + self.partial.status_keys()
+        if self.buckets:
+            self.status_keys = self.status_keys + buckets.STATUS_KEYS
+            self.buckets.classify_all(
+                component.get("Core").get_torrents_status(
+                    {}, buckets.STATUS_KEYS
+                )
+            )
 
-        log.debug("TrafficLimits: Loaded limits.")
 
     @export
     def reset_initial(self):
-        self.config["previous_upload"] = 0
-        self.config["previous_download"] = 0
-        self.config["previous_total"] = 0
-        self.config["reset_time_upload"] = time.time()
-        self.config["reset_time_download"] = self.config["reset_time_upload"]
-        self.config["reset_time_total"] = self.config["reset_time_upload"]
         self.set_initial()
+        for direction in ("upload", "download", "total"):
+            self.reset_counter(direction)
+        self.rules.reset_all(self.snapshot(), time.time())
+
+
+    def reset_counter(self, direction, reset_time=None, breached=False):
+        """
+        Starts a new period for the counter in direction.  If reset_time is
+        given, we are following a reset made by another instance sharing
+        the quota; otherwise, they are told about it.
+        """
+        if reset_time is None:
+            reset_time = time.time()
+            if self.shared:
+                reset_time = self.shared.reset(direction, reset_time,
+                                               breached)
+        start = self.config["reset_time_" + direction]
+        used = getattr(self, direction)
+        # Don't log periods in which nothing could have been counted, as when
+        # the label is set just after startup.
+        if used or reset_time - start >= self.config["maximum_interval"]:
+            self.io.run(self.periods.append, direction, self.config["label"],
+                        start, reset_time, used, breached)
+        setattr(self, "initial_" + direction,
+                getattr(self, "session_" + direction))
+        self.config["previous_" + direction] = 0
+        self.config["reset_time_" + direction] = reset_time
+        self.saver.save()
+
+
+    @export
+    def reset_bucket(self, name):
+        """Zeroes the counters of the named quota bucket."""
+        if name in self.buckets.names:
+            self.buckets.reset(self.buckets.names.index(name))
 
 
     def set_initial(self):
-        status = component.get("Core").get_session_status(
-            ["total_download", "total_upload"]
-        )
-        self.initial_upload = status["total_upload"]
-        self.initial_download = status["total_download"]
-        self.initial_total = status["total_upload"] + status["total_download"]
+        upload, download = self.read_counters()
+        self.session_upload = self.initial_upload = upload
+        self.session_download = self.initial_download = download
+        self.session_total = self.initial_total = upload + download
+
+
+    def read_counters(self):
+        """
+        Returns the bytes (uploaded, downloaded) so far according to the
+        accounting source: Deluge's session, or the network interface.
+        Traffic with unmetered peers is left out.
+        """
+        if self.interface is not None:
+            try:
+                upload, download = self.interface.update()
+            except (OSError, ValueError) as error:
+                log.error("TrafficLimits: Unable to read the counters of "
+                          + self.interface.interface + ": " + str(error))
+                upload = self.interface.upload
+                download = self.interface.download
+        else:
+            status = component.get("Core").get_session_status(
+                ["total_upload", "total_download"])
+            upload = status["total_upload"]
+            download = status["total_download"]
+        return (upload - self.unmetered_upload,
+                download - self.unmetered_download)
+
+
+    def load_unmetered(self):
+        """(Re)builds the table of peers in the unmetered ranges."""
+        ranges = unmetered.Ranges(self.config["unmetered"])
+        self.peers = unmetered.PeerTable(ranges) if ranges else None
+
+
+    def update_unmetered(self):
+        """
+        Adds up the traffic with unmetered peers since the last update.
+        Only the peers of active torrents are looked at.
+        """
+        torrents = component.get("TorrentManager").torrents
+        active = component.get("Core").get_torrents_status(
+            {"state": ["Active"]}, ["num_peers"])
+        upload, download = self.peers.update(
+            ((torrent_id, torrents[torrent_id].handle.get_peer_info())
+             for torrent_id, status in active.iteritems()
+             if status["num_peers"] and torrent_id in torrents),
+            time.time())
+        self.unmetered_upload += upload
+        self.unmetered_download += download
+
+
+    def open_interface(self):
+        self.interface = None
+        if self.config["accounting_source"] == "interface":
+            interface = InterfaceCounters(self.config["interface"])
+            if interface.open():
+                self.interface = interface
+
+
+    def switch_source(self):
+        """
+        Starts counting from the configured accounting source, carrying over
+        what was counted from the old one.
+        """
+        self.config["rule_usage"] = self.rules.usage(self.snapshot())
+        for direction in ("upload", "download", "total"):
+            self.config["previous_" + direction] \
+                += getattr(self, "session_" + direction) \
+                - getattr(self, "initial_" + direction)
+        if self.interface:
+            self.interface.close()
+        self.open_interface()
+        self.set_initial()
+        self.last_upload = self.initial_upload
+        self.last_download = self.initial_download
+        self.load_rules()
+
+
+    def pause(self, direction, temporary=False):
+        """
+        Stops transfers after a limit in direction ("upload", "download" or
+        "total") has been exceeded.  In "torrents" mode, only the torrents
+        that were moving data in that direction are paused.  If temporary
+        is true, the pause lasts only until no sliding window or rule with a
+        scheduled reset is over its limit.
+        """
+        self.temporary_pause = temporary \
+            and (self.temporary_pause or not self.paused)
+        self.paused = True
+        self.metrics.increment("pauses")
+        # Anything not yet resumed from last time stays paused.
+        self.paused_torrents.update(self.resumer.stop())
+        if self.config["pause_mode"] != "torrents":
+            if not self.session_paused and self.resumer.batch > 0:
+                # Note what was running, to bring it back in batches.
+                self.session_torrents = set([
+                    torrent_id for torrent_id, status
+                    in component.get("Core").get_torrents_status(
+                        {}, ["state"]).iteritems()
+                    if status["state"] not in ("Paused", "Error")
+                ])
+            self.session_paused = True
+            component.get("Core").session.pause()
+            return
+
+        self.pause_torrents(self.accounting.transferring(direction))
+
+
+    def pause_torrents(self, torrent_ids):
+        torrent_ids = [torrent_id for torrent_id in torrent_ids
+                       if torrent_id not in self.paused_torrents]
+        if torrent_ids:
+            log.info("TrafficLimits: Pausing %d torrents." % len(torrent_ids))
+            self.paused = True
+            component.get("Core").pause_torrent(torrent_ids)
+            self.paused_torrents.update(torrent_ids)
+
+
+    def resume(self):
+        """Undoes whatever pause() did."""
+        self.paused = False
+        self.temporary_pause = False
+        self.windows_exceeded = set()	# So still exceeded ones pause again.
+        self.metrics.increment("resumes")
+        torrent_ids = list(self.paused_torrents)
+        self.paused_torrents.clear()
+        self.partially_paused.clear()
+        if self.config["pause_mode"] != "torrents":
+            if self.session_torrents:
+                # Hold them back, so that the scheduler can let them go.
+                component.get("Core").pause_torrent(
+                    list(self.session_torrents))
+                torrent_ids.extend(self.session_torrents)
+                self.session_torrents = set()
+            self.session_paused = False
+            component.get("Core").session.resume()
+        self.resumer.start(torrent_ids)
+
+
+    def on_torrent_added(self, torrent_id, *args):
+        self.accounting.add(torrent_id)
+        if self.buckets:
+            self.buckets.classify(
+                torrent_id,
+                component.get("Core").get_torrent_status(torrent_id,
+                                                         buckets.STATUS_KEYS)
+            )
+
+
+    def on_torrent_removed(self, torrent_id):
+        self.accounting.remove(torrent_id)
+        if self.peers is not None:
+            self.peers.remove(torrent_id)
+        self.buckets.remove(torrent_id)
+        self.paused_torrents.discard(torrent_id)
+        self.session_torrents.discard(torrent_id)
+        self.partially_paused.discard(torrent_id)
+        self.partial.remove(torrent_id)
+        self.resumer.discard(torrent_id)
 
 
     @export
@@ -219,7 +1025,35 @@ class Core(CorePluginBase):
         """Sets the config dictionary"""
         for key in config.keys():
             self.config[key] = config[key]
-        self.config.save()
+        if "partial_pausing" in config or "pause_priority" in config \
+                or "label_priorities" in config:
+            self.load_partial()
+        if "buckets" in config or "partial_pausing" in config \
+                or "pause_priority" in config:
+            self.config["bucket_usage"] = self.buckets.usage()
+            self.load_buckets()
+        if "schedule" in config:
+            self.load_schedule()
+        if "windows" in config:
+            self.load_windows()
+        if "rules" in config:
+            self.config["rule_usage"] = self.rules.usage(self.snapshot())
+            self.load_rules()
+        if "accounting_source" in config or "interface" in config:
+            self.switch_source()
+        if "unmetered" in config:
+            self.load_unmetered()
+        self.rules.set_limits(self.config["maximum_upload"],
+                              self.config["maximum_download"],
+                              self.config["maximum_total"])
+        self.resumer.batch = self.config["resume_batch"]
+        self.resumer.interval = self.config["resume_interval"]
+        self.resumer.order = self.config["resume_order"]
+        self.coalescer.threshold = self.config["event_threshold"]
+        self.coalescer.interval = self.config["event_interval"]
+        self.saver.save()
+        self.config_version += 1
+        self.reschedule()
 
 
     @export
@@ -237,30 +1071,255 @@ class Core(CorePluginBase):
             self.config["maximum_total"],
             self.config["reset_time_upload"],
             self.config["reset_time_download"],
-            self.config["reset_time_total"]
+            self.config["reset_time_total"],
+            self.buckets.state(),
+            self.windows.state(),
+            self.rules.state(self.snapshot())
         ]
         return state
 
 
+    @export
+    def get_snapshot(self):
+        """
+        Returns everything a client needs in one call: a dict with the
+        "version" of the state (as in TrafficLimitUpdate events), the
+        "config" dictionary, the "state" as a dict by field name (see
+        common.STATE_FIELDS) and the "forecast".
+        """
+        return {
+            "version": self.coalescer.version,
+            "config": self.config.config,
+            "state": dict(zip(STATE_FIELDS, self.get_state())),
+            "forecast": self.forecast
+        }
+
+
+    @export
+    def wait_for_change(self, since_version, timeout=60):
+        """
+        Returns get_snapshot() as soon as the version is newer than
+        since_version: straight away if it already is, otherwise once the
+        counters, limits or config change, or after timeout seconds (at
+        most MAXIMUM_WAIT), whichever comes first.  On a timeout, the
+        version is unchanged.
+        """
+        if self.coalescer.version > since_version:
+            return self.get_snapshot()
+        waiter = defer.Deferred()
+        timer = reactor.callLater(max(0, min(timeout, MAXIMUM_WAIT)),
+                                  self.on_wait_timeout, waiter)
+        self.waiters.append((waiter, timer))
+        return waiter
+
+
+    def on_wait_timeout(self, waiter):
+        for i, (deferred, timer) in enumerate(self.waiters):
+            if deferred is waiter:
+                del self.waiters[i]
+                break
+        waiter.callback(self.get_snapshot())
+
+
+    def notify_waiters(self):
+        """Answers every pending wait_for_change() with one snapshot."""
+        if not self.waiters:
+            return
+        waiters, self.waiters = self.waiters, []
+        snapshot = self.get_snapshot()
+        for waiter, timer in waiters:
+            if timer.active():
+                timer.cancel()
+            waiter.callback(snapshot)
+
+
+    @export
+    def get_forecast(self):
+        """
+        Returns a dict with the forecast seconds until each limit is reached
+        ("upload", "download", "total", and "buckets", "windows" and "rules",
+        dicts by name; for a window already over its limit, the seconds
+        until it is back within it), None where there is no limit or no
+        traffic, the smoothed "upload_rate" and "download_rate" in bytes/s,
+        and the seconds until the "next_update".
+        """
+        return self.forecast
+
+
+    @export
+    def get_resume_progress(self):
+        """
+        Returns how far resuming in batches has got: a dict with the number
+        of torrents "resumed" and still "pending", when it "started", and
+        the seconds until the "next_batch" (None if there is none).
+        """
+        return self.resumer.progress()
+
+
+    @export
+    def get_metrics(self):
+        """
+        Returns a dict of the plugin's "counters", the latency histograms of
+        each "stages" of an update (see metrics.Metrics.snapshot()), and
+        "gauges", a list of [name, labels, value] giving usage and limits.
+        """
+        snapshot = self.metrics.snapshot()
+        snapshot["gauges"] = [list(gauge) for gauge in self.gauges()]
+        return snapshot
+
+
+    def gauges(self):
+        gauges = []
+        for name, values in (
+                ("used_bytes", (self.upload, self.download, self.total)),
+                ("maximum_bytes", (self.config["maximum_upload"],
+                                   self.config["maximum_download"],
+                                   self.config["maximum_total"])),
+                ("seconds_to_limit", (self.forecast.get("upload"),
+                                      self.forecast.get("download"),
+                                      self.forecast.get("total")))):
+            for direction, value in zip(("upload", "download", "total"),
+                                        values):
+                gauges.append((name, {"direction": direction}, value))
+
+        rows = self.buckets.state()
+        for name, column in (("bucket_used_bytes", 1),
+                             ("bucket_maximum_bytes", 4)):
+            for row in rows:
+                for offset, direction in enumerate(("upload", "download",
+                                                    "total")):
+                    gauges.append((name, {"bucket": row[0],
+                                          "direction": direction},
+                                   row[column + offset]))
+
+        rows = self.windows.state()
+        for name, column in (("window_used_bytes", 2),
+                             ("window_maximum_bytes", 5)):
+            for row in rows:
+                for offset, direction in enumerate(("upload", "download",
+                                                    "total")):
+                    gauges.append((name, {"window": row[0],
+                                          "direction": direction},
+                                   row[column + offset]))
+
+        for row in self.rules.state(self.snapshot()):
+            gauges.append(("rule_used_bytes", {"rule": row[0],
+                                               "direction": row[1]}, row[2]))
+            gauges.append(("rule_maximum_bytes", {"rule": row[0],
+                                                  "direction": row[1]},
+                           row[3]))
+
+        gauges.append(("paused", {}, int(self.paused)))
+        gauges.append(("paused_torrents", {}, len(self.paused_torrents)))
+        gauges.append(("resume_pending", {}, len(self.resumer.pending)))
+        gauges.append(("waiting_requests", {}, len(self.waiters)))
+        gauges.append(("unmetered_peers", {},
+                       len(self.peers) if self.peers is not None else 0))
+        for direction, value in (("upload", self.unmetered_upload),
+                                 ("download", self.unmetered_download)):
+            gauges.append(("unmetered_bytes", {"direction": direction},
+                           value))
+        gauges.append(("partially_paused_torrents", {},
+                       len(self.partially_paused)))
+        return gauges
+
+
+    def render_metrics(self):
+        return self.metrics.exposition(self.gauges())
+
+
+    @export
+    def get_history(self, start, end, resolution):
+        """
+        Returns a list of [start, upload, download] for each interval of
+        resolution seconds between start and end (secs since epoch).  The
+        answer comes from the rollup nearest to the requested resolution
+        that still reaches back to start, so the intervals may be coarser
+        than asked for if it is very fine or start is long ago.
+        """
+        return self.history.query(start, end, resolution)
+
+
+    @export
+    def export_usage(self, kind="intervals", format="csv", start=0,
+                     end=None, resolution=3600, cursor=None, limit=1000):
+        """
+        Returns a chunk of the usage recorded, for reconciling against a
+        bill, as a dict of "data", the text of up to limit rows (at most
+        exporter.MAXIMUM_CHUNK), and the "cursor" to pass back to get the
+        next chunk, or None after the last.
+
+        :param kind: "intervals", for the traffic in each interval of
+            resolution seconds between start and end (secs since epoch; end
+            defaults to now) from the history, as exporter.INTERVAL_FIELDS;
+            or "periods", for each period between resets of a counter, as
+            periods.FIELDS, ending with those still in progress (with no
+            end)
+        :param format: "csv", with a header in the first chunk, or "jsonl"
+        """
+        if format not in exporter.FORMATS:
+            raise ValueError("Unknown format: %r" % format)
+        limit = max(1, min(limit, exporter.MAXIMUM_CHUNK))
+        if kind == "periods":
+            if cursor is not None and cursor < 0:
+                # The log is done with; just the periods in progress remain.
+                rows, next_cursor = self.periods_in_progress(
+                    [], -1 - cursor, limit)
+                return {
+                    "data": exporter.format_rows(rows, periods.FIELDS,
+                                                 format, False),
+                    "cursor": next_cursor
+                }
+            return self.io.run(self.periods.read, cursor or 0, limit) \
+                .addCallback(self.export_periods, format, cursor is None,
+                             limit)
+        if kind != "intervals":
+            raise ValueError("Unknown kind: %r" % kind)
+        rows, next_cursor = exporter.intervals(
+            self.history, start, time.time() if end is None else end,
+            resolution, limit, cursor)
+        return {
+            "data": exporter.format_rows(rows, exporter.INTERVAL_FIELDS,
+                                         format, cursor is None),
+            "cursor": next_cursor
+        }
+
+
+    def export_periods(self, chunk, format, header, limit):
+        """Formats a chunk read from the periods log, for export_usage()."""
+        rows, next_cursor = chunk
+        if next_cursor is None:
+            rows, next_cursor = self.periods_in_progress(rows, 0, limit)
+        return {
+            "data": exporter.format_rows(rows, periods.FIELDS, format, header),
+            "cursor": next_cursor
+        }
+
+
+    def periods_in_progress(self, rows, first, limit):
+        """
+        Adds the periods in progress, from the first'th, to rows, as far as
+        limit allows.  Returns the rows, and the cursor for the rest (-1
+        less the index of the next), or None if there are no more.
+        """
+        directions = ("upload", "download", "total")
+        last = min(len(directions), first + limit - len(rows))
+        for direction in directions[first:last]:
+            rows.append([direction, self.config["label"],
+                         self.config["reset_time_" + direction], None,
+                         getattr(self, direction), False])
+        return rows, -1 - last if last < len(directions) else None
+
+
 class TrafficLimitUpdate (DelugeEvent):
     """
     Emitted when the ammount of transferred data changes.
     """
-    def __init__(self, label, upload, download, total, maximum_upload,
-                 maximum_download, maximum_total, reset_time_upload,
-                 reset_time_download, reset_time_total):
-        """
-        :param label: str, a description of the current period
-        :param upload: int, bytes uploaded during the current period
-        :param download: int, bytes downloaded during the current period
-        :param total: int, bytes up/downloaded during the current period
-        :param maximum_upload: int, upper bound for bytes transmitted
-        :param maximum_download: int, upper bound for bytes received
-        :param maximum_total: int, upper bound for bytes transferred
-        :param reset_time_upload: float, secs since epoch that upload was reset
-        :param reset_time_download: float, secs since epoch download was reset
-        :param reset_time_total: float, secs since epoch total was reset
-        """
-        self._args = [label, upload, download, total, maximum_upload,
-                      maximum_download, maximum_total, reset_time_upload,
-                      reset_time_download, reset_time_total]
+    def __init__(self, version, changes):
+        """
+        :param version: int, increases whenever anything changes
+        :param changes: dict, the fields of Core.get_state() (named as in
+            common.STATE_FIELDS) that changed since this client was last
+            sent an update; all of them in the first update a client gets
+        """
+        self._args = [version, changes]
@@ -31,6 +31,124 @@ Copyright:
     statement from all source files in the program, then also delete it here.
 */
 
+Ext.ns('Deluge.ux.preferences');
+
+// The fields of the plugin's get_state(), in order.
+Deluge.ux.TrafficLimitsFields = [
+	'label', 'upload', 'download', 'total',
+	'maximum_upload', 'maximum_download', 'maximum_total',
+	'reset_time_upload', 'reset_time_download', 'reset_time_total',
+	'buckets', 'windows', 'rules'
+];
+
+/**
+ * @class Deluge.ux.preferences.TrafficLimitsPage
+ * @extends Ext.Panel
+ */
+Deluge.ux.preferences.TrafficLimitsPage = Ext.extend(Ext.Panel, {
+
+	title: _('TrafficLimits'),
+	layout: 'form',
+	border: false,
+	autoScroll: true,
+
+	initComponent: function() {
+		Deluge.ux.preferences.TrafficLimitsPage.superclass.initComponent.call(this);
+
+		var limits = this.add({
+			xtype: 'fieldset',
+			border: false,
+			title: _('Pause all torrents after...'),
+			autoHeight: true,
+			defaultType: 'spinnerfield',
+			defaults: {
+				width: 160,
+				minValue: -1,
+				maxValue: 1e43,
+				incrementValue: 1048576,
+				decimalPrecision: 0
+			}
+		});
+		this.labelField = limits.add({
+			xtype: 'textfield',
+			fieldLabel: _('Label')
+		});
+		this.uploadField = limits.add({
+			fieldLabel: _('Upload (bytes)')
+		});
+		this.downloadField = limits.add({
+			fieldLabel: _('Download (bytes)')
+		});
+		this.totalField = limits.add({
+			fieldLabel: _('Total (bytes)')
+		});
+
+		var stats = this.add({
+			xtype: 'fieldset',
+			border: false,
+			title: _('Statistics'),
+			autoHeight: true,
+			defaultType: 'displayfield'
+		});
+		this.uploaded = stats.add({fieldLabel: _('Uploaded')});
+		this.downloaded = stats.add({fieldLabel: _('Downloaded')});
+		this.transferred = stats.add({fieldLabel: _('Total')});
+		stats.add({
+			xtype: 'button',
+			text: _('Clear'),
+			handler: this.onClear,
+			scope: this
+		});
+
+		this.on('show', this.onPageShow, this);
+	},
+
+	onPageShow: function() {
+		deluge.client.trafficlimits.get_config({
+			success: function(config) {
+				this.labelField.setValue(config['label']);
+				this.uploadField.setValue(config['maximum_upload']);
+				this.downloadField.setValue(config['maximum_download']);
+				this.totalField.setValue(config['maximum_total']);
+			},
+			scope: this
+		});
+	},
+
+	onApply: function() {
+		deluge.client.trafficlimits.set_config({
+			'label': this.labelField.getValue(),
+			'maximum_upload': Number(this.uploadField.getValue()),
+			'maximum_download': Number(this.downloadField.getValue()),
+			'maximum_total': Number(this.totalField.getValue())
+		});
+	},
+
+	onClear: function() {
+		deluge.client.trafficlimits.reset_initial();
+	},
+
+	/**
+	 * Shows the usage from state, touching only the fields whose text has
+	 * changed.
+	 */
+	update: function(state) {
+		var rows = [
+			[this.uploaded, 'upload'],
+			[this.downloaded, 'download'],
+			[this.transferred, 'total']
+		];
+		Ext.each(rows, function(row) {
+			var text = String.format(_('{0} bytes since {1}'),
+				state[row[1]],
+				new Date(state['reset_time_' + row[1]] * 1000).toLocaleString());
+			if (row[0].rendered && row[0].getValue() != text) {
+				row[0].setValue(text);
+			}
+		});
+	}
+});
+
 TrafficLimitsPlugin = Ext.extend(Deluge.Plugin, {
 	constructor: function(config) {
 		config = Ext.apply({
@@ -40,11 +158,120 @@ TrafficLimitsPlugin = Ext.extend(Deluge.Plugin, {
 	},
 
 	onDisable: function() {
-
+		deluge.events.un('TrafficLimitUpdate', this.onUpdate, this);
+		deluge.preferences.removePage(this.prefsPage);
+		deluge.statusbar.remove(this.statusItem);
+		deluge.statusbar.doLayout();
+		this.state = null;
 	},
 
 	onEnable: function() {
+		this.state = null;
+		this.version = 0;
+		this.statusText = null;
+		this.statusTooltip = null;
+
+		this.prefsPage = deluge.preferences.addPage(
+			new Deluge.ux.preferences.TrafficLimitsPage());
+		this.statusItem = deluge.statusbar.add({
+			id: 'trafficlimits',
+			text: '',
+			cls: 'x-btn-text-icon',
+			iconCls: 'x-deluge-traffic',
+			tooltip: _('TrafficLimits plugin'),
+			handler: function() {
+				deluge.preferences.show();
+				deluge.preferences.selectPage(_('TrafficLimits'));
+			}
+		});
+		deluge.statusbar.doLayout();
+
+		// Fetch the whole state once; after that, the daemon pushes just
+		// the fields that change, through the web event queue.
+		deluge.events.on('TrafficLimitUpdate', this.onUpdate, this);
+		deluge.client.trafficlimits.get_state({
+			success: this.onGetState,
+			scope: this
+		});
+	},
+
+	onGetState: function(state) {
+		this.state = {};
+		Ext.each(Deluge.ux.TrafficLimitsFields, function(field, i) {
+			this.state[field] = state[i];
+		}, this);
+		this.refresh();
+	},
+
+	onUpdate: function(version, changes) {
+		if (version <= this.version) return;
+		this.version = version;
+		// If this.state is not set yet, the get_state() reply is still to
+		// come, and will be newer than this.
+		if (!this.state) return;
+		Ext.apply(this.state, changes);
+		this.refresh();
+	},
+
+	refresh: function() {
+		var state = this.state;
+		var limits = [
+			[state['download'], state['maximum_download'], _('download')],
+			[state['upload'], state['maximum_upload'], _('upload')],
+			[state['total'], state['maximum_total'], _('total')]
+		];
+		var used = [], percent = [], names = [];
+		Ext.each(limits, function(limit) {
+			if (limit[1] < 0) return;
+			used.push(fsize(limit[0]));
+			percent.push(Math.floor(100 * limit[0] / limit[1]) + '%');
+			names.push(limit[2]);
+		});
+
+		// Without fixed limits, show the fullest limit of each window.
+		var lines = [];
+		Ext.each(state['windows'] || [], function(window) {
+			var fullest = null;
+			for (var i = 2; i < 5; i++) {
+				if (window[i + 3] > 0 && (!fullest
+						|| window[i] / window[i + 3] > fullest[0] / fullest[1])) {
+					fullest = [window[i], window[i + 3]];
+				}
+			}
+			if (!fullest) return;
+			lines.push(String.format(_('{0}: {1} of {2}'), window[0],
+				fsize(fullest[0]), fsize(fullest[1])));
+			if (!names.length) {
+				used.push(fsize(fullest[0]));
+				percent.push(Math.floor(100 * fullest[0] / fullest[1]) + '%');
+			}
+		});
+
+		var text = state['label'];
+		if (used.length) {
+			text = (text ? text + ': ' : '') + used.join('/')
+				+ ' (' + percent.join('/') + ')';
+		}
+		Ext.each(state['rules'] || [], function(rule) {
+			if (rule[3] < 0) return;
+			lines.push(String.format(_('{0}: {1} of {2} {3}'), rule[0],
+				fsize(rule[2]), fsize(rule[3]), _(rule[1])));
+		});
+
+		var tooltip = [names.length
+			? Ext.util.Format.capitalize(names.join('/'))
+				+ _(' during this period')
+			: _('TrafficLimits plugin')].concat(lines).join('<br>');
+		if (text != this.statusText) {
+			this.statusText = text;
+			this.statusItem.setText(text);
+		}
+		if (tooltip != this.statusTooltip) {
+			this.statusTooltip = tooltip;
+			this.statusItem.setTooltip(tooltip);
+		}
 
+		this.prefsPage.update(state);
 	}
 });
 new TrafficLimitsPlugin();
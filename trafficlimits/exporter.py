@@ -0,0 +1,172 @@
+#
+# exporter.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+"""
+Usage for reconciling against a bill, in chunks small enough not to hold up
+the daemon, and the trafficlimits-export command that fetches them all:
+
+    trafficlimits-export --format csv --resolution 3600 intervals > usage.csv
+    trafficlimits-export --format jsonl periods > periods.jsonl
+"""
+
+import calendar
+import csv
+import json
+import optparse
+import sys
+import time
+from cStringIO import StringIO
+
+from history import TIERS
+
+# The fields of each interval, in order.
+INTERVAL_FIELDS = ["start", "end", "upload", "download", "total"]
+FORMATS = ("csv", "jsonl")
+# Most rows returned by one call.
+MAXIMUM_CHUNK = 10000
+
+def intervals(history, start, end, resolution, limit, cursor=None):
+    """
+    Returns up to limit intervals from start, or from cursor when carrying
+    on, as lists of INTERVAL_FIELDS, and the cursor to carry on from, or
+    None if there are no more.  Only the slots returned are read.  The
+    resolution is settled by how far back start is, so every chunk comes
+    at the same one.
+    """
+    resolution = max(resolution,
+                     TIERS[history.tier_for(resolution, start)][0])
+    rows = []
+    for interval_start, upload, download in history.iterate(
+            start if cursor is None else cursor, end, resolution):
+        if len(rows) == limit:
+            return rows, interval_start
+        rows.append([interval_start, interval_start + resolution,
+                     upload, download, upload + download])
+    return rows, None
+
+def format_rows(rows, fields, format, header=False):
+    """
+    Returns rows as text: CSV, starting with the field names if header,
+    or JSON Lines, each row an object keyed by field.
+    """
+    if format == "jsonl":
+        return "".join(json.dumps(dict(zip(fields, row)), sort_keys=True)
+                       + "\n" for row in rows)
+    output = StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    if header:
+        writer.writerow(fields)
+    for row in rows:
+        writer.writerow([value.encode("utf-8") if isinstance(value, unicode)
+                         else value for value in row])
+    return output.getvalue()
+
+def parse_time(value):
+    """Seconds since the epoch, from a number or a UTC YYYY-MM-DD date."""
+    try:
+        return float(value)
+    except ValueError:
+        return calendar.timegm(time.strptime(value, "%Y-%m-%d"))
+
+def main():
+    parser = optparse.OptionParser(
+        usage="%prog [options] intervals|periods",
+        description="Writes the usage recorded by a deluged's TrafficLimits "
+        "plugin to standard output: the traffic in each interval of "
+        "--resolution seconds, or each period between resets of the "
+        "counters, with its label.")
+    parser.add_option("--host", default="127.0.0.1",
+                      help="deluged to connect to [%default]")
+    parser.add_option("--port", type="int", default=58846,
+                      help="its daemon port [%default]")
+    parser.add_option("--username", default="",
+                      help="defaults to the local client's")
+    parser.add_option("--password", default="")
+    parser.add_option("--format", choices=FORMATS, default="csv",
+                      help="%s [%%default]" % ", ".join(FORMATS))
+    parser.add_option("--start", type="string", default="0",
+                      help="first interval, as secs since epoch or a UTC "
+                      "YYYY-MM-DD date [the earliest recorded]")
+    parser.add_option("--end", type="string", default=None,
+                      help="end of the last interval, likewise [now]")
+    parser.add_option("--resolution", type="int", default=3600,
+                      help="seconds per interval [%default]")
+    parser.add_option("--chunk", type="int", default=1000,
+                      help="rows fetched per call [%default]")
+    options, args = parser.parse_args()
+    if args not in (["intervals"], ["periods"]):
+        parser.error("say either intervals or periods")
+    try:
+        start = parse_time(options.start)
+        end = None if options.end is None else parse_time(options.end)
+    except ValueError as error:
+        parser.error(str(error))
+
+    from twisted.internet import reactor
+    from deluge.ui.client import client
+
+    status = []
+
+    def fetch(cursor):
+        client.trafficlimits.export_usage(
+            args[0], options.format, start, end, options.resolution, cursor,
+            options.chunk
+        ).addCallbacks(on_chunk, on_error)
+
+    def on_chunk(chunk):
+        sys.stdout.write(chunk["data"])
+        if chunk["cursor"] is None:
+            client.disconnect().addBoth(lambda result: reactor.stop())
+        else:
+            fetch(chunk["cursor"])
+
+    def on_error(failure):
+        sys.stderr.write("trafficlimits-export: %s\n"
+                         % failure.getErrorMessage())
+        status.append(1)
+        if client.connected():
+            client.disconnect()
+        reactor.stop()
+
+    client.connect(options.host, options.port, options.username,
+                   options.password).addCallbacks(
+        lambda result: fetch(None), on_error)
+    reactor.run()
+    sys.exit(status and status[0] or 0)
@@ -0,0 +1,144 @@
+#
+# fileio.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+from deluge.log import LOG as log
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+def read_file(path):
+    with open(path) as source:
+        return source.read()
+
+class BackgroundIO(object):
+    """
+    Runs blocking file operations in a thread of their own, so that the
+    reactor thread, which also serves every RPC, never waits on a slow disk.
+    There is just the one thread, so operations happen in the order they
+    were asked for, and never overlap.
+    """
+
+    def __init__(self):
+        self.pool = ThreadPool(0, 1, "TrafficLimits")
+        self.pool.start()
+
+    def run(self, function, *args, **kwargs):
+        """Returns a Deferred firing with function(*args, **kwargs)."""
+        return threads.deferToThreadPool(reactor, self.pool, function,
+                                         *args, **kwargs)
+
+    def read(self, path):
+        """Returns a Deferred firing with the contents of the file."""
+        return self.run(read_file, path)
+
+    def stop(self):
+        """Waits for whatever is under way to finish."""
+        self.pool.stop()
+
+class _Pending(object):
+    """Stands in for a Deluge config's own save timer, never going off."""
+
+    def active(self):
+        return True
+
+    def cancel(self):
+        pass
+
+class ConfigSaver(object):
+    """
+    Saves a Deluge config in the background, at most once every delay
+    seconds however often it is asked to, and never twice at once.
+
+    Left to itself, a Deluge config saves itself on the reactor thread five
+    seconds after any change, which would also race a save here for the same
+    file.  While there is a ConfigSaver, the config is made to believe such
+    a save is always pending, so it never schedules one, and changes are
+    only saved when save() is called.
+
+    What is still done on the reactor thread: the final save in close(), and
+    writes to the usage history and shared quota, which are memory mapped
+    and so can stall if the kernel has to fetch a page from disk.
+    """
+
+    def __init__(self, config, io, delay=1.0):
+        self.config = config
+        self.io = io
+        self.delay = delay
+        self.timer = None
+        self.saving = False
+        self.dirty = False
+        self.config._save_timer = _Pending()
+
+    def save(self):
+        self.dirty = True
+        if self.timer is None and not self.saving:
+            self.timer = reactor.callLater(self.delay, self._save)
+
+    def _save(self):
+        self.timer = None
+        self.dirty = False
+        self.saving = True
+        self.io.run(self.config.save).addErrback(self._on_error) \
+            .addBoth(self._on_saved)
+
+    def _on_error(self, failure):
+        log.error("TrafficLimits: Unable to save the config: "
+                  + failure.getErrorMessage())
+
+    def _on_saved(self, result):
+        self.saving = False
+        if self.dirty:
+            self.timer = reactor.callLater(self.delay, self._save)
+
+    def cancel(self):
+        """Forgets any save pending, e.g., as it is about to be done anyway."""
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self.dirty = False
+
+    def close(self):
+        """
+        Saves the config now, in this thread, once whatever is under way in
+        the background has finished (so io must already have been stopped),
+        and hands saving back to Deluge.
+        """
+        self.cancel()
+        self.config._save_timer = None
+        self.config.save()
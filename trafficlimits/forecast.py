@@ -0,0 +1,98 @@
+#
+# forecast.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import math
+
+class RateEstimator(object):
+    """
+    Exponentially weighted moving average of a transfer rate.
+
+    The weight given to each new sample depends on how long it covers, so
+    that irregular update intervals still give a rate with a time constant
+    of roughly tau seconds.
+    """
+
+    def __init__(self, tau=30.0):
+        self.tau = tau
+        self.rate = 0.0
+        self.last_rate = 0.0
+
+    def update(self, transferred, elapsed):
+        """
+        :param transferred: int, bytes moved since the previous update
+        :param elapsed: float, seconds since the previous update
+        """
+        if elapsed <= 0:
+            return
+        self.last_rate = transferred / float(elapsed)
+        alpha = 1 - math.exp(-elapsed / self.tau)
+        self.rate += alpha * (self.last_rate - self.rate)
+
+    def peak(self):
+        """
+        Returns the higher of the smoothed and the latest rate, so that a
+        sudden burst is not hidden by the average.
+        """
+        return max(self.rate, self.last_rate)
+
+def time_to_limit(used, maximum, rate):
+    """
+    Returns the number of seconds until used reaches maximum at rate, 0 if
+    it already has, or None if there is no limit or nothing is moving.
+    """
+    if maximum < 0:
+        return None
+    if used >= maximum:
+        return 0.0
+    if rate <= 0:
+        return None
+    return (maximum - used) / float(rate)
+
+def next_interval(seconds, minimum, maximum):
+    """
+    Returns how long to wait before checking again, given the seconds until
+    the nearest limit is reached.  Waiting for half that time means the gap
+    shrinks geometrically as the limit approaches, so while the rate holds
+    steady the overshoot is about what is transferred in minimum seconds.
+    A burst after a quiet spell is only seen at the next check, though, so
+    it can overshoot by as much as its rate times maximum seconds.
+    """
+    if seconds is None:
+        return maximum
+    return min(maximum, max(minimum, seconds / 2.0))
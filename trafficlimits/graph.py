@@ -0,0 +1,279 @@
+#
+# graph.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+import gtk
+
+import deluge.common
+
+# The counters drawn, with their state field and colour.
+SERIES = [
+    ("download", (0.16, 0.38, 0.74)),
+    ("upload", (0.20, 0.60, 0.20)),
+    ("total", (0.80, 0.20, 0.20)),
+]
+
+MARGIN = 4
+
+class Samples(object):
+    """
+    Client-side buffer of the counters, as they arrive in state updates.
+    Once full, every other sample is dropped, so the buffer covers however
+    long a period in bounded memory, at a resolution that halves as needed.
+    """
+
+    def __init__(self, capacity=2048):
+        self.capacity = capacity
+        self.clear()
+
+    def __len__(self):
+        return len(self.times)
+
+    def clear(self, start=None):
+        self.start = start
+        self.times = array("d")
+        self.values = [array("d") for series in SERIES]
+
+    def append(self, now, values):
+        """
+        :param values: list, a value for each of SERIES
+        """
+        if len(self.times) >= self.capacity:
+            self.times = self.times[::2]
+            self.values = [column[::2] for column in self.values]
+        self.times.append(now)
+        for column, value in zip(self.values, values):
+            column.append(value)
+
+    def prepend(self, times, values):
+        """Adds earlier samples, from before the first."""
+        self.times = array("d", times) + self.times
+        self.values = [array("d", earlier) + column
+                       for earlier, column in zip(values, self.values)]
+        while len(self.times) > self.capacity:
+            # Keep the latest sample.
+            first = (len(self.times) - 1) % 2
+            self.times = self.times[first::2]
+            self.values = [column[first::2] for column in self.values]
+
+    def rate(self, series, span=300):
+        """
+        Returns the rate of series over the last span seconds, in bytes/s.
+        """
+        if len(self.times) < 2:
+            return 0.0
+        i = min(bisect_left(self.times, self.times[-1] - span),
+                len(self.times) - 2)
+        elapsed = self.times[-1] - self.times[i]
+        if elapsed <= 0:
+            return 0.0
+        column = self.values[series]
+        return max(0.0, (column[-1] - column[i]) / elapsed)
+
+class UsageGraph(gtk.DrawingArea):
+    """
+    Plots the counters against their limits, with the projection of each
+    at its current rate.
+
+    What has been plotted is kept in an off-screen pixmap, and each update
+    draws just the new segments onto it.  The axes grow by doubling, so the
+    whole plot is redrawn only occasionally: when the samples outgrow them,
+    the limits change or the widget is resized.  Exposing copies the pixmap
+    and adds the projections, which move with every update.
+    """
+
+    def __init__(self, samples):
+        gtk.DrawingArea.__init__(self)
+        self.samples = samples
+        self.limits = [-1] * len(SERIES)
+        self.pixmap = None
+        self.drawn = None	# time of the last sample plotted
+        self.span = 0
+        self.top = 0
+        self.set_size_request(-1, 160)
+        self.connect("configure-event", self.on_configure)
+        self.connect("expose-event", self.on_expose)
+
+    def update(self, limits):
+        """Plots whatever samples arrived since the last call."""
+        if self.pixmap is None or not len(self.samples):
+            return
+        if list(limits) != self.limits or not self.span or not self.fits():
+            self.limits = list(limits)
+            self.redraw()
+        else:
+            self.plot(self.drawn)
+        self.queue_draw()
+
+    def reset(self):
+        """Starts again, as the samples have been cleared."""
+        self.span = 0
+
+    def fits(self):
+        """Returns whether the samples still fit the axes."""
+        samples = self.samples
+        if samples.start is None or samples.times[0] < samples.start \
+                or samples.times[-1] > samples.start + self.span:
+            return False
+        return all(column[-1] <= self.top for column in samples.values)
+
+    def scale(self):
+        samples = self.samples
+        if samples.start is None or samples.times[0] < samples.start:
+            samples.start = samples.times[0]
+        elapsed = samples.times[-1] - samples.start
+        self.span = 3600
+        while self.span <= elapsed:
+            self.span *= 2
+
+        highest = max([max(column) for column in samples.values]
+                      + [limit for limit in self.limits if limit >= 0])
+        self.top = 1024 ** 2
+        while self.top < highest * 1.05:
+            self.top *= 2
+
+    def point(self, t, value):
+        width, height = self.pixmap.get_size()
+        return (MARGIN + (width - 2 * MARGIN)
+                * (t - self.samples.start) / float(self.span),
+                height - MARGIN - (height - 2 * MARGIN)
+                * value / float(self.top))
+
+    def redraw(self):
+        self.scale()
+        width, height = self.pixmap.get_size()
+        context = self.pixmap.cairo_create()
+        context.set_source_rgb(1, 1, 1)
+        context.paint()
+
+        context.set_line_width(1)
+        context.set_dash([4, 4])
+        for (name, colour), limit in zip(SERIES, self.limits):
+            if limit >= 0:
+                context.set_source_rgb(*colour)
+                x, y = self.point(self.samples.start, limit)
+                context.move_to(MARGIN, int(y) + 0.5)
+                context.line_to(width - MARGIN, int(y) + 0.5)
+                context.stroke()
+        context.set_dash([])
+
+        context.set_source_rgb(0.4, 0.4, 0.4)
+        context.move_to(MARGIN + 2, MARGIN + 10)
+        context.show_text(deluge.common.fsize(self.top))
+        self.drawn = None
+        self.plot(None)
+
+    def plot(self, since):
+        """Draws the samples after time since onto the pixmap."""
+        samples = self.samples
+        first = 0 if since is None \
+            else max(0, bisect_right(samples.times, since) - 1)
+        if first >= len(samples.times) - 1 and since is not None:
+            return
+        context = self.pixmap.cairo_create()
+        context.set_line_width(1.5)
+        for (name, colour), column in zip(SERIES, samples.values):
+            context.set_source_rgb(*colour)
+            context.move_to(*self.point(samples.times[first], column[first]))
+            for i in xrange(first + 1, len(samples.times)):
+                context.line_to(*self.point(samples.times[i], column[i]))
+            context.stroke()
+        self.drawn = samples.times[-1]
+
+    def on_configure(self, widget, event):
+        self.pixmap = gtk.gdk.Pixmap(self.window, event.width, event.height)
+        if len(self.samples):
+            self.redraw()
+        else:
+            context = self.pixmap.cairo_create()
+            context.set_source_rgb(1, 1, 1)
+            context.paint()
+        return True
+
+    def on_expose(self, widget, event):
+        if self.pixmap is None:
+            return False
+        area = event.area
+        self.window.draw_drawable(self.get_style().fg_gc[gtk.STATE_NORMAL],
+                                  self.pixmap, area.x, area.y, area.x, area.y,
+                                  area.width, area.height)
+        if len(self.samples) and self.span:
+            self.draw_projections(self.window.cairo_create())
+        return False
+
+    def draw_projections(self, context):
+        """Extends each counter at its current rate, up to its limit."""
+        samples = self.samples
+        now = samples.times[-1]
+        end = samples.start + self.span
+        context.set_line_width(1)
+        context.set_dash([2, 3])
+        for i, ((name, colour), limit) in enumerate(zip(SERIES,
+                                                        self.limits)):
+            rate = samples.rate(i)
+            if rate <= 0:
+                continue
+            used = samples.values[i][-1]
+            until = end if limit < 0 or used >= limit \
+                else min(end, now + (limit - used) / rate)
+            context.set_source_rgb(*colour)
+            context.move_to(*self.point(now, used))
+            context.line_to(*self.point(until,
+                                        min(self.top,
+                                            used + rate * (until - now))))
+            context.stroke()
+
+def projection(samples, limits):
+    """
+    Returns a line of text for each limit that will be reached at the
+    current rate, saying roughly when.
+    """
+    lines = []
+    for i, ((name, colour), limit) in enumerate(zip(SERIES, limits)):
+        if limit < 0 or not len(samples):
+            continue
+        rate = samples.rate(i)
+        used = samples.values[i][-1]
+        if rate > 0 and used < limit:
+            lines.append("%s limit reached in about %s at the current rate"
+                         % (name.capitalize(),
+                            deluge.common.ftime((limit - used) / rate)))
+    return lines
@@ -44,18 +44,20 @@ from deluge.ui.client import client
 from deluge.plugins.pluginbase import GtkPluginBase
 import deluge.component as component
 import deluge.common
-from common import get_resource
+from common import get_resource, STATE_FIELDS
+from graph import Samples, UsageGraph, SERIES, projection
 import time
 
 class GtkUI(GtkPluginBase):
     def enable(self):
-        self.builder = gtk.Builder();
-        self.builder.add_from_file(get_resource("config.ui"))
-        self.builder.connect_signals({
-                "on_button_clear_clicked": self.on_button_clear_clicked,
-                });
+        self.samples = Samples()
+        self.seeded = False
 
-        component.get("Preferences").add_page("TrafficLimits", self.builder.get_object("prefs_box"))
+        # The page's contents are only loaded when it is first shown.
+        self.builder = None
+        self.graph = None
+        self.prefs_page = gtk.VBox()
+        component.get("Preferences").add_page("TrafficLimits", self.prefs_page)
         component.get("PluginManager").register_hook("on_apply_prefs", self.on_apply_prefs)
         component.get("PluginManager").register_hook("on_show_prefs", self.on_show_prefs)
 
@@ -66,20 +68,41 @@ class GtkUI(GtkPluginBase):
             tooltip="TrafficLimits plugin"
         )
 
-        def on_get_state(state):
-            self.set_status(*state)
-
-        self.state_deferred = client.trafficlimits.get_state().addCallback(on_get_state)
+        self.state = None
+        self.version = 0
+        client.trafficlimits.get_state().addCallback(self.on_get_state)
         client.register_event_handler("TrafficLimitUpdate", self.on_trafficlimit_update)
 
     def disable(self):
+        client.deregister_event_handler("TrafficLimitUpdate", self.on_trafficlimit_update)
         component.get("StatusBar").remove_item(self.status_item)
         del self.status_item
         component.get("Preferences").remove_page("TrafficLimits")
         component.get("PluginManager").deregister_hook("on_apply_prefs", self.on_apply_prefs)
         component.get("PluginManager").deregister_hook("on_show_prefs", self.on_show_prefs)
 
+    def build_prefs(self):
+        self.builder = gtk.Builder();
+        self.builder.add_from_file(get_resource("config.ui"))
+        self.builder.connect_signals({
+                "on_button_clear_clicked": self.on_button_clear_clicked,
+                });
+
+        self.graph = UsageGraph(self.samples)
+        if self.state is not None:
+            self.graph.limits = [self.state["maximum_" + name]
+                                 for name, colour in SERIES]
+        self.builder.get_object("alignment_graph").add(self.graph)
+
+        prefs_box = self.builder.get_object("prefs_box")
+        prefs_box.get_parent().remove(prefs_box)
+        self.prefs_page.pack_start(prefs_box)
+        self.prefs_page.show_all()
+
     def on_apply_prefs(self):
+        if self.builder is None:
+            # Never shown, so nothing can have changed.
+            return
         log.debug("applying prefs for TrafficLimits")
         config = {
             "label": self.builder.get_object("txt_label").get_text(),
@@ -93,8 +116,40 @@ class GtkUI(GtkPluginBase):
         client.trafficlimits.set_config(config)
 
     def on_show_prefs(self):
+        if self.builder is None:
+            self.build_prefs()
         client.trafficlimits.get_config().addCallback(self.cb_get_config)
         client.trafficlimits.get_state().addCallback(self.cb_get_state)
+        if not self.seeded and len(self.samples):
+            # Fill in the graph from before we were connected, at about a
+            # pixel's resolution, so however long the period it is quick.
+            self.seeded = True
+            start, end = self.samples.start, self.samples.times[0]
+            client.trafficlimits.get_history(
+                start, end, max(10, (end - start) / 1024)
+            ).addCallback(self.on_get_history, start)
+
+    def on_get_history(self, history, start):
+        if self.samples.start != start or not len(self.samples):
+            return
+        # Work back from the first sample, so that the two join up.
+        end = self.samples.times[0]
+        values = [column[0] for column in self.samples.values]
+        times = []
+        columns = [[] for series in SERIES]
+        for row_start, upload, download in reversed(history):
+            if row_start >= end:
+                continue
+            for i, delta in enumerate((download, upload, upload + download)):
+                values[i] = max(0, values[i] - delta)
+                columns[i].append(values[i])
+            times.append(row_start)
+        times.reverse()
+        for column in columns:
+            column.reverse()
+        self.samples.prepend(times, columns)
+        self.graph.reset()
+        self.graph.update(self.graph.limits)
 
     def cb_get_config(self, config):
         "callback for on show_prefs"
@@ -129,7 +184,8 @@ class GtkUI(GtkPluginBase):
 
     def set_status(self, label, upload, download, total,
                    maximum_upload, maximum_download, maximum_total,
-                   reset_time_upload, reset_time_download, reset_time_total):
+                   reset_time_upload, reset_time_download, reset_time_total,
+                   buckets=(), windows=(), rules=()):
         status = ""
         pairs = [
              [download, maximum_download],
@@ -139,6 +195,18 @@ class GtkUI(GtkPluginBase):
         used = "/".join(
             ["%s" % deluge.common.fsize(p[0]) for p in pairs if p[1] >= 0]
         )
+        if used == "" and windows:
+            # Without fixed limits, show the fullest limit of each window.
+            pairs = []
+            for window in windows:
+                limits = [p for p in zip(window[2:5], window[5:8])
+                          if p[1] > 0]
+                if limits:
+                    pairs.append(max(limits,
+                                     key=lambda p: float(p[0]) / p[1]))
+            used = "/".join(
+                ["%s" % deluge.common.fsize(p[0]) for p in pairs]
+            )
         if used == "":
             status = label
         else:
@@ -161,20 +229,82 @@ class GtkUI(GtkPluginBase):
             tooltip = "TrafficLimits plugin"
         else:
             tooltip += " during this period"
+
+        for (name, upload, download, total, maximum_upload, maximum_download,
+             maximum_total, reset_time) in buckets:
+            used = "/".join(
+                ["%s of %s %s" % (deluge.common.fsize(p[0]),
+                                  deluge.common.fsize(p[1]), p[2])
+                 for p in [
+                     [download, maximum_download, "download"],
+                     [upload, maximum_upload, "upload"],
+                     [total, maximum_total, "total"],
+                 ] if p[1] >= 0]
+            )
+            if used != "":
+                tooltip += "\n" + name + ": " + used
+
+        for (name, length, upload, download, total, maximum_upload,
+             maximum_download, maximum_total) in windows:
+            used = "/".join(
+                ["%s of %s %s" % (deluge.common.fsize(p[0]),
+                                  deluge.common.fsize(p[1]), p[2])
+                 for p in [
+                     [download, maximum_download, "download"],
+                     [upload, maximum_upload, "upload"],
+                     [total, maximum_total, "total"],
+                 ] if p[1] >= 0]
+            )
+            if used != "":
+                tooltip += "\n" + name + ": " + used
+
+        for (name, direction, used, maximum, reset_time, next_reset,
+             action) in rules:
+            if maximum >= 0:
+                tooltip += "\n%s: %s of %s %s" % (
+                    name, deluge.common.fsize(used),
+                    deluge.common.fsize(maximum), direction)
+
+        for line in projection(self.samples, [maximum_download,
+                                              maximum_upload,
+                                              maximum_total]):
+            tooltip += "\n" + line
         self.status_item.set_tooltip(tooltip)
         
-    def on_trafficlimit_update(self, label, upload, download, total,
-                               maximum_upload, maximum_download, maximum_total,
-                               reset_time_upload, reset_time_download,
-                               reset_time_total):
-        def on_state_deferred(s):
-            self.set_status(label, upload, download, total,
-                            maximum_upload, maximum_download, maximum_total,
-                            reset_time_upload, reset_time_download,
-                            reset_time_total)
-            self.cb_get_state([label, upload, download, total,
-                               maximum_upload, maximum_download, maximum_total,
-                               reset_time_upload, reset_time_download,
-                               reset_time_total])
-
-        self.state_deferred.addCallback(on_state_deferred)
+    def record(self, state):
+        """Adds the counters to the samples, and plots them."""
+        start = min([state["reset_time_" + name] for name, colour in SERIES])
+        if self.samples.start is None:
+            self.samples.start = start
+        elif start > self.samples.start:
+            # Every counter has been cleared since the samples began.
+            self.samples.clear(start)
+            if self.graph is not None:
+                self.graph.reset()
+            self.seeded = False
+        self.samples.append(time.time(),
+                            [state[name] for name, colour in SERIES])
+        if self.graph is not None:
+            self.graph.update([state["maximum_" + name]
+                               for name, colour in SERIES])
+
+    def on_get_state(self, state):
+        self.state = dict(zip(STATE_FIELDS, state))
+        self.refresh()
+
+    def on_trafficlimit_update(self, version, changes):
+        if version <= self.version:
+            return
+        self.version = version
+        if self.state is None:
+            # The reply to get_state() is still on its way, and will be newer.
+            return
+        self.state.update(changes)
+        self.refresh()
+
+    def refresh(self):
+        self.record(self.state)
+        state = [self.state[field] for field in STATE_FIELDS]
+        self.set_status(*state)
+        if self.builder is not None:
+            self.cb_get_state(state)
@@ -0,0 +1,242 @@
+#
+# history.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from bisect import bisect_left
+import mmap
+import os
+import struct
+
+from deluge.log import LOG as log
+
+# (seconds per sample, number of samples) for each rollup tier: a day of
+# 10 second samples, a week of minutes, a year of hours and ten years of
+# days.
+TIERS = [(10, 8640), (60, 10080), (3600, 8760), (86400, 3660)]
+
+MAGIC = "TLH1"
+HEADER = struct.Struct("<4sI")
+TIER_HEADER = struct.Struct("<ii")	# newest slot, number of slots used
+SLOT = struct.Struct("<dqq")		# start time, bytes up, bytes down
+
+class _Times(object):
+    """Sequence view of the slot start times of a tier, oldest first."""
+
+    def __init__(self, history, tier):
+        self.history = history
+        self.tier = tier
+        self.length = history.count[tier]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        return self.history.slot(self.tier, i)[0]
+
+class History(object):
+    """
+    Fixed-size usage history, kept in a memory-mapped file.
+
+    Every sample is added into the current slot of each tier, so the
+    rollups are always up to date and a query never has to aggregate more
+    than the tier whose resolution is closest to the one asked for.  The
+    file never grows: each tier is a ring buffer that overwrites its oldest
+    slot.
+    """
+
+    def __init__(self, filename, readonly=False):
+        """
+        :param readonly: bool, open an existing history just to query it,
+            raising an error (IOError, OSError or ValueError) if it cannot
+            be read or is not a history with these TIERS; otherwise the
+            file is created, or started again, as needed
+        """
+        self.readonly = readonly
+        self.offsets = []
+        size = HEADER.size
+        for resolution, capacity in TIERS:
+            self.offsets.append(size)
+            size += TIER_HEADER.size + capacity * SLOT.size
+        self.size = size
+
+        if readonly:
+            self._open_readonly(filename)
+            return
+        try:
+            fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                self.map = mmap.mmap(fd, size)
+            finally:
+                os.close(fd)
+        except (IOError, OSError, mmap.error) as error:
+            log.error("TrafficLimits: " + filename + ": " + str(error)
+                      + "; history will not be kept across restarts.")
+            self.map = mmap.mmap(-1, size)
+
+        if HEADER.unpack_from(self.map, 0) != (MAGIC, len(TIERS)):
+            self.map[:size] = "\0" * size
+            HEADER.pack_into(self.map, 0, MAGIC, len(TIERS))
+            for tier in xrange(len(TIERS)):
+                TIER_HEADER.pack_into(self.map, self.offsets[tier],
+                                      TIERS[tier][1] - 1, 0)
+
+        self.head = []
+        self.count = []
+        for tier in xrange(len(TIERS)):
+            head, count = TIER_HEADER.unpack_from(self.map, self.offsets[tier])
+            self.head.append(head)
+            self.count.append(count)
+
+    def _open_readonly(self, filename):
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                raise ValueError(filename + ": not a usage history")
+            self.map = mmap.mmap(fd, self.size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if HEADER.unpack_from(self.map, 0) != (MAGIC, len(TIERS)):
+            self.map.close()
+            raise ValueError(filename + ": not a usage history")
+        self.head = []
+        self.count = []
+        for tier in xrange(len(TIERS)):
+            head, count = TIER_HEADER.unpack_from(self.map, self.offsets[tier])
+            self.head.append(head)
+            self.count.append(count)
+
+    def close(self):
+        if not self.readonly:
+            self.map.flush()
+        self.map.close()
+
+    def _offset(self, tier, physical):
+        return (self.offsets[tier] + TIER_HEADER.size
+                + physical * SLOT.size)
+
+    def slot(self, tier, i):
+        """Returns (start, upload, download) of slot i, oldest first."""
+        capacity = TIERS[tier][1]
+        physical = (self.head[tier] - self.count[tier] + 1 + i) % capacity
+        return SLOT.unpack_from(self.map, self._offset(tier, physical))
+
+    def record(self, now, upload, download):
+        """Adds bytes transferred up to time now into every tier."""
+        for tier, (resolution, capacity) in enumerate(TIERS):
+            start = now - now % resolution
+            offset = self._offset(tier, self.head[tier])
+            if self.count[tier]:
+                head_start, head_upload, head_download \
+                    = SLOT.unpack_from(self.map, offset)
+                if start <= head_start:
+                    SLOT.pack_into(self.map, offset, head_start,
+                                   head_upload + upload,
+                                   head_download + download)
+                    continue
+
+            self.head[tier] = (self.head[tier] + 1) % capacity
+            self.count[tier] = min(self.count[tier] + 1, capacity)
+            SLOT.pack_into(self.map, self._offset(tier, self.head[tier]),
+                           start, upload, download)
+            TIER_HEADER.pack_into(self.map, self.offsets[tier],
+                                  self.head[tier], self.count[tier])
+
+    def oldest(self, tier):
+        """Returns the start of the oldest slot of tier, or None if empty."""
+        if not self.count[tier]:
+            return None
+        return self.slot(tier, 0)[0]
+
+    def reaches(self, tier, start):
+        """Tells whether tier still holds everything recorded since start."""
+        return (self.count[tier] < TIERS[tier][1]
+                or self.oldest(tier) <= start - start % TIERS[tier][0])
+
+    def tier_for(self, resolution, start=None):
+        """
+        Returns the coarsest tier at least as fine as resolution (which is
+        also the one reaching furthest back), or the finest tier, but only
+        counting tiers that reach back to start, if given.  If none are fine
+        enough, the finest of those is chosen, and if none reach back that
+        far, the coarsest tier.
+        """
+        best = None
+        for tier, (tier_resolution, capacity) in enumerate(TIERS):
+            if start is not None and not self.reaches(tier, start):
+                continue
+            if best is None or tier_resolution <= resolution:
+                best = tier
+        if best is None:
+            return len(TIERS) - 1
+        return best
+
+    def query(self, start, end, resolution):
+        """
+        Returns [start, upload, download] for each interval of resolution
+        seconds between start and end that saw any samples.
+        """
+        return list(self.iterate(start, end, resolution))
+
+    def iterate(self, start, end, resolution):
+        """
+        Like query(), but yields the intervals one at a time, reading the
+        slots as it goes.
+        """
+        tier = self.tier_for(resolution, start)
+        resolution = max(resolution, TIERS[tier][0])
+        times = _Times(self, tier)
+
+        interval = None
+        for i in xrange(bisect_left(times, start - start % TIERS[tier][0]),
+                        len(times)):
+            slot_start, upload, download = self.slot(tier, i)
+            if slot_start >= end:
+                break
+            bucket = slot_start - slot_start % resolution
+            if interval and interval[0] == bucket:
+                interval[1] += upload
+                interval[2] += download
+            else:
+                if interval:
+                    yield interval
+                interval = [bucket, upload, download]
+        if interval:
+            yield interval
@@ -0,0 +1,139 @@
+#
+# interface.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import os
+
+from deluge.log import LOG as log
+
+SYSFS = "/sys/class/net/%s/statistics/%s_bytes"
+PROC = "/proc/net/dev"
+
+def unwrap(previous, current):
+    """
+    Returns how much a byte counter has moved from previous to current,
+    allowing for it having wrapped round at 32 or 64 bits.  A counter that
+    went backwards any other way (say, the interface was recreated) is taken
+    to have started again from zero.
+    """
+    if current >= previous:
+        return current - previous
+    for bits in (32, 64):
+        if previous < 2 ** bits:
+            delta = current + 2 ** bits - previous
+            if delta < 2 ** (bits - 1):
+                return delta
+    return current
+
+class InterfaceCounters(object):
+    """
+    Bytes sent and received by a network interface, including protocol
+    overhead and traffic other than Deluge's, which is what ISPs bill for.
+
+    The sysfs counter files are opened once and re-read from the start
+    each time, so a tick costs two short reads and no opens.  Without
+    sysfs, /proc/net/dev is read the same way, and the interface's line
+    found in it.  Totals are counted from when the counters were opened.
+    """
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.fds = None
+        self.proc = None
+        self.last = None
+        self.upload = 0
+        self.download = 0
+
+    def open(self):
+        """Opens the counters.  Returns False if that was not possible."""
+        try:
+            fds = []
+            try:
+                for counter in ("tx", "rx"):
+                    fds.append(os.open(SYSFS % (self.interface, counter),
+                                       os.O_RDONLY))
+                self.fds = fds
+            except OSError:
+                for fd in fds:
+                    os.close(fd)
+                self.proc = os.open(PROC, os.O_RDONLY)
+            self.last = self.read()
+        except (OSError, ValueError) as error:
+            log.error("TrafficLimits: Unable to read the counters of "
+                      + self.interface + ": " + str(error))
+            self.close()
+            return False
+        return True
+
+    def close(self):
+        for fd in (self.fds or []) + [self.proc]:
+            if fd is not None:
+                os.close(fd)
+        self.fds = None
+        self.proc = None
+
+    def _read(self, fd, size):
+        if hasattr(os, "pread"):
+            return os.pread(fd, size, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        return os.read(fd, size)
+
+    def read(self):
+        """Returns the interface's raw (sent, received) byte counters."""
+        if self.fds is not None:
+            return tuple([int(self._read(fd, 32)) for fd in self.fds])
+
+        prefix = self.interface + ":"
+        for line in self._read(self.proc, 65536).splitlines():
+            line = line.strip()
+            if line.startswith(prefix):
+                # Receive bytes is the first field; transmit bytes the ninth.
+                fields = line[len(prefix):].split()
+                return int(fields[8]), int(fields[0])
+        raise ValueError("no such interface in " + PROC)
+
+    def update(self):
+        """
+        Reads the counters, and returns the bytes (uploaded, downloaded) by
+        the interface since they were opened.
+        """
+        current = self.read()
+        self.upload += unwrap(self.last[0], current[0])
+        self.download += unwrap(self.last[1], current[1])
+        self.last = current
+        return self.upload, self.download
@@ -0,0 +1,190 @@
+#
+# journal.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import json
+import os
+import struct
+import time
+import zlib
+
+from deluge.log import LOG as log
+
+# time, upload, download, total, reset times for upload, download and
+# total, and the length of the JSON that follows, holding the other counters
+RECORD = struct.Struct("<dqqqdddI")
+CRC = struct.Struct("<I")
+
+class Journal(object):
+    """
+    Append-only log of counter checkpoints, so that a crash loses no more
+    than the last update.
+
+    Each record is a complete checkpoint with a CRC, so replaying means
+    finding the last intact record, and compacting means starting a new file
+    holding only that.  Anything after the last intact record was torn by a
+    crash, and is cut off when the journal is opened.  Records are written, fsynced at most every
+    sync_interval seconds, and compacted once the file holds max_records,
+    all through a fileio.BackgroundIO, so an update never waits on the disk
+    and the journal's file operations are ordered with the plugin's others.
+    If the disk falls behind, only the latest checkpoint is written.
+    """
+
+    def __init__(self, filename, io, sync_interval=60, max_records=4096):
+        """
+        :param io: fileio.BackgroundIO, to do the writing
+        """
+        self.filename = filename
+        self.io = io
+        self.sync_interval = sync_interval
+        self.max_records = max_records
+        self.fd = None
+        self.records = 0
+        self.intact = None	# bytes up to the end of the last intact record
+        self.last_sync = time.time()
+        self.record = None	# the latest checkpoint, packed
+        self.writing = False
+
+    def replay(self):
+        """
+        Returns the last intact checkpoint, as a tuple of (time, upload,
+        download, total, reset_time_upload, reset_time_download,
+        reset_time_total), and a dict of the other counters, keyed by their
+        config keys; or None.
+        """
+        try:
+            with open(self.filename, "rb") as journal:
+                data = journal.read()
+        except (IOError, OSError):
+            return None
+
+        checkpoint = None
+        offset = 0
+        self.records = 0
+        while offset + RECORD.size + CRC.size <= len(data):
+            fields = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + fields[-1]
+            if end + CRC.size > len(data):
+                break
+            crc, = CRC.unpack_from(data, end)
+            if zlib.crc32(data[offset:end]) & 0xffffffff != crc:
+                break
+            checkpoint = (fields[:-1],
+                          json.loads(data[offset + RECORD.size:end]))
+            self.records += 1
+            offset = end + CRC.size
+        self.intact = offset
+        return checkpoint
+
+    def open(self):
+        try:
+            self.fd = os.open(self.filename,
+                              os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            if self.intact is not None \
+                    and os.fstat(self.fd).st_size > self.intact:
+                os.ftruncate(self.fd, self.intact)
+        except OSError as error:
+            log.error("TrafficLimits: " + self.filename + ": " + str(error))
+            self.fd = None
+
+    def close(self, clean=False):
+        """
+        Closes the journal, once the BackgroundIO has been stopped.  If
+        clean, the counters have been saved elsewhere, so the journal is
+        emptied and there is nothing to replay.
+        """
+        if self.fd is None:
+            return
+        if clean:
+            os.ftruncate(self.fd, 0)
+        os.close(self.fd)
+        self.fd = None
+
+    def append(self, checkpoint, counters):
+        """Writes a checkpoint; see replay() for what goes in it."""
+        if self.fd is None:
+            return
+        counters = json.dumps(counters, separators=(",", ":"))
+        record = RECORD.pack(*(tuple(checkpoint) + (len(counters),))) \
+            + counters
+        self.record = record + CRC.pack(zlib.crc32(record) & 0xffffffff)
+        if not self.writing:
+            self._queue()
+
+    def _queue(self):
+        self.writing = True
+        self.io.run(self._write, self.record) \
+            .addCallbacks(self._on_written, self._on_error)
+
+    def _write(self, record):
+        """Runs in the background: appends record, and syncs or compacts."""
+        os.write(self.fd, record)
+        self.records += 1
+        if self.records >= self.max_records:
+            self._compact(record)
+        elif time.time() - self.last_sync >= self.sync_interval:
+            os.fsync(self.fd)
+            self.last_sync = time.time()
+        return record
+
+    def _compact(self, record):
+        """Runs in the background: replaces the journal with just record."""
+        temporary = self.filename + ".new"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, record)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(temporary, self.filename)
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND)
+        os.close(self.fd)
+        self.fd = fd
+        self.records = 1
+        self.last_sync = time.time()
+
+    def _on_written(self, record):
+        self.writing = False
+        if self.record is not record and self.fd is not None:
+            # Another checkpoint came in meanwhile.
+            self._queue()
+
+    def _on_error(self, failure):
+        self.writing = False
+        log.error("TrafficLimits: " + self.filename + ": "
+                  + failure.getErrorMessage())
@@ -0,0 +1,191 @@
+#
+# metrics.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from bisect import bisect_left
+from timeit import default_timer as timer
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+class Histogram(object):
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)	# the last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Returns [(upper bound, observations <= it)], ending with +Inf."""
+        result = []
+        running = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+class Metrics(object):
+    """
+    Counters and latency histograms for the plugin's own work.
+
+    Stages of an update are timed by chaining calls to stage():
+
+        start = timer()
+        do_something()
+        start = metrics.stage("something", start)
+        do_something_else()
+        metrics.stage("something_else", start)
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def stage(self, name, start):
+        """
+        Records the time since start against stage name, and returns the
+        current time, to start timing the next stage.
+        """
+        now = timer()
+        try:
+            histogram = self.histograms[name]
+        except KeyError:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(now - start)
+        return now
+
+    def snapshot(self):
+        """
+        Returns a dict of "counters", name -> value, and "stages", name ->
+        {"count", "sum", "buckets": [[upper bound, cumulative count]]}, with
+        the last upper bound None for +Inf.
+        """
+        return {
+            "counters": dict(self.counters),
+            "stages": dict(
+                (name, {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": [[None if bound == float("inf") else bound,
+                                 count]
+                                for bound, count in histogram.cumulative()],
+                })
+                for name, histogram in self.histograms.iteritems()
+            ),
+        }
+
+    def exposition(self, gauges=()):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+
+        :param gauges: list of (name, {label: value}, value) to include
+        """
+        lines = []
+        for name in sorted(self.counters):
+            lines.append("# TYPE trafficlimits_%s_total counter" % name)
+            lines.append("trafficlimits_%s_total %d"
+                         % (name, self.counters[name]))
+
+        if self.histograms:
+            lines.append("# TYPE trafficlimits_stage_seconds histogram")
+        for name in sorted(self.histograms):
+            histogram = self.histograms[name]
+            for bound, count in histogram.cumulative():
+                lines.append(
+                    'trafficlimits_stage_seconds_bucket{stage="%s",le="%s"} %d'
+                    % (name, "+Inf" if bound == float("inf") else repr(bound),
+                       count))
+            lines.append('trafficlimits_stage_seconds_sum{stage="%s"} %r'
+                         % (name, histogram.sum))
+            lines.append('trafficlimits_stage_seconds_count{stage="%s"} %d'
+                         % (name, histogram.count))
+
+        declared = set()
+        for name, labels, value in gauges:
+            if value is None:
+                continue
+            if name not in declared:
+                lines.append("# TYPE trafficlimits_%s gauge" % name)
+                declared.add(name)
+            lines.append("trafficlimits_%s%s %r" % (name, format_labels(labels),
+                                                    float(value)))
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '%s="%s"' % (key, unicode(value).replace("\\", "\\\\")
+                     .replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in sorted(labels.iteritems())
+    ) + "}"
+
+def listen(port, path, render):
+    """
+    Serves the output of render() over HTTP on 127.0.0.1:port, or on the
+    UNIX socket at path (accessible to our own user only), whichever is
+    set.  Returns the listening port, or None if neither is set.
+    """
+    if not path and not port:
+        # Without importing twisted.web, which is slow.
+        return None
+    from twisted.internet import reactor
+    from twisted.web import resource, server
+
+    class MetricsResource(resource.Resource):
+        isLeaf = True
+
+        def render_GET(self, request):
+            request.setHeader("Content-Type",
+                              "text/plain; version=0.0.4; charset=utf-8")
+            return render().encode("utf-8")
+
+    site = server.Site(MetricsResource())
+    if path:
+        # The PID lock lets a socket left behind by a crash be replaced.
+        return reactor.listenUNIX(path, site, mode=0o600, wantPID=True)
+    return reactor.listenTCP(port, site, interface="127.0.0.1")
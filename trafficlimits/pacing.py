@@ -0,0 +1,177 @@
+#
+# pacing.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import deluge.component as component
+from deluge.log import LOG as log
+
+# Don't touch the speed limits unless they would change by more than this
+# fraction, or more often than this many seconds.
+HYSTERESIS = 0.1
+MINIMUM_CHANGE_INTERVAL = 60
+
+SETTINGS = ("max_upload_speed", "max_download_speed")
+
+def allowed_rate(used, maximum, start, end, now, window):
+    """
+    Returns the rate, in bytes/s, that spreads what is left of maximum over
+    the period from start to end, or None if there is no limit.
+
+    This is a token bucket filling at maximum / (end - start), holding at
+    most window seconds' worth: allowance saved by being idle can be spent
+    over about window seconds, and going over the even rate is repaid over
+    the same time.
+    """
+    if maximum < 0 or end <= start:
+        return None
+    fill_rate = maximum / float(end - start)
+    earned = fill_rate * min(max(now - start, 0), end - start)
+    tokens = min(earned - used, fill_rate * window)
+    return max(0.0, fill_rate + tokens / float(window))
+
+class Pacer(object):
+    """
+    Sets Deluge's global speed limits to pace usage, and restores them
+    afterwards.  Any limit the user had set is kept as a ceiling.
+
+    The user's own limits are kept in the plugin's config while pacing, so
+    that they can be put back after a crash rather than the paced ones
+    being taken for them.  Limits the user changes while pacing become the
+    new ceiling, and are left alone on restoring.
+    """
+
+    def __init__(self, config, save):
+        """
+        :param config: the plugin's config, to keep the user's limits in,
+            as "pacing_original"
+        :param save: function to call to have the config saved
+        """
+        self.config = config
+        self.save = save
+        self.original = None
+        self.applied = None
+        self.last_change = 0
+
+    def active(self):
+        return self.original is not None
+
+    def recover(self):
+        """Puts back the user's limits, if pacing was cut short last time."""
+        original = self.config["pacing_original"]
+        if not original:
+            return
+        log.info("TrafficLimits: Restoring the speed limits in force before "
+                 "pacing was interrupted.")
+        component.get("Core").set_config(dict(original))
+        self.config["pacing_original"] = {}
+        self.save()
+
+    def apply(self, upload, download, now):
+        """
+        :param upload: float, bytes/s to allow up, or None for no pacing
+        :param download: float, bytes/s to allow down, or None
+        :param now: float, secs since epoch
+        """
+        core = component.get("Core")
+        current = dict((key, core.get_config_value(key)) for key in SETTINGS)
+        if self.original is None:
+            self.original = current
+            self.remember()
+        elif self.applied is not None:
+            changed = [key for key in SETTINGS
+                       if current[key] != self.applied[key]]
+            if changed:
+                log.debug("TrafficLimits: Speed limits changed while pacing; "
+                          "keeping them as the ceiling.")
+                for key in changed:
+                    self.original[key] = current[key]
+                self.remember()
+                self.applied = None
+
+        limits = {}
+        for key, rate in zip(SETTINGS, (upload, download)):
+            original = self.original[key]
+            if rate is None:
+                limits[key] = original
+                continue
+            # Deluge counts in KiB/s, and takes anything below 0 as
+            # unlimited, so never go below 1.
+            limit = max(1.0, rate / 1024.0)
+            if original > 0:
+                limit = min(limit, original)
+            limits[key] = limit
+
+        if self.applied is not None:
+            if now - self.last_change < MINIMUM_CHANGE_INTERVAL:
+                return
+            if all(self._close(self.applied[key], limits[key])
+                   for key in SETTINGS):
+                return
+
+        log.debug("TrafficLimits: Pacing to %.1f KiB/s up, %.1f KiB/s down."
+                  % (limits["max_upload_speed"], limits["max_download_speed"]))
+        core.set_config(limits)
+        self.applied = limits
+        self.last_change = now
+
+    def remember(self):
+        self.config["pacing_original"] = dict(self.original)
+        self.save()
+
+    def restore(self):
+        """
+        Puts back the user's limits, except any they have changed since
+        they were last paced.
+        """
+        if self.original is None:
+            return
+        core = component.get("Core")
+        limits = dict((key, self.original[key]) for key in SETTINGS
+                      if self.applied is None
+                      or core.get_config_value(key) == self.applied[key])
+        if limits:
+            core.set_config(limits)
+        self.original = None
+        self.applied = None
+        self.config["pacing_original"] = {}
+        self.save()
+
+    def _close(self, old, new):
+        if old <= 0 or new <= 0:
+            return old == new
+        return abs(new - old) <= HYSTERESIS * old
@@ -0,0 +1,173 @@
+#
+# partial.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import heapq
+import itertools
+import math
+
+# Torrents not seen transferring for this long drop out of the ranking.
+IDLE = 5 * 60
+
+# Priorities, higher meaning keep running for longer, and the torrent status
+# keys each needs.
+PRIORITY_KEYS = {
+    "queue": ["queue"],
+    "ratio": ["ratio"],
+    "label": ["label"],
+}
+
+class PartialPauser(object):
+    """
+    Pauses the least important transferring torrents, a few more at each
+    threshold, as usage approaches a limit.
+
+    Configured with thresholds like [[0.9, 0.25], [0.98, 0.5]]: once 90% of
+    a limit is used, a quarter of the transferring torrents are paused, and
+    half of them from 98%.  The torrents are ranked by priority in a heap
+    that is updated as the status of active torrents comes in each tick.
+    A torrent whose priority changes gets a new entry, and the old one is
+    just left to be skipped when it reaches the top, so a tick costs
+    O(log n) per torrent whose priority changed rather than a sort.
+    """
+
+    def __init__(self, thresholds, priority="queue", label_priorities=None):
+        """
+        :param thresholds: list of [fraction of a limit used, fraction of
+            torrents to pause]
+        :param priority: str, "queue" (by queue position, seeding torrents
+            last), "ratio" (highest ratio paused first) or "label" (by
+            label_priorities)
+        :param label_priorities: dict, label -> number, higher to keep
+        """
+        self.thresholds = sorted([tuple(threshold)
+                                  for threshold in thresholds])
+        self.priority = priority if priority in PRIORITY_KEYS else "queue"
+        self.label_priorities = label_priorities or {}
+        self.heap = []
+        self.entries = {}	# torrent_id -> its live heap entry
+        self.seen = {}		# torrent_id -> when it was last transferring
+        self.counter = itertools.count()
+        self.pruned = 0
+
+    def __nonzero__(self):
+        return bool(self.thresholds)
+
+    def status_keys(self):
+        return PRIORITY_KEYS[self.priority] if self.thresholds else []
+
+    def rank(self, status):
+        if self.priority == "ratio":
+            return -status.get("ratio", 0)
+        if self.priority == "label":
+            return self.label_priorities.get(status.get("label", ""), 0)
+        queue = status.get("queue", -1)
+        return -queue if queue >= 0 else float("-inf")
+
+    def update(self, torrents_status, now):
+        """
+        :param torrents_status: dict, torrent_id -> status dict, including
+            status_keys(), for the torrents that transferred this tick
+        """
+        for torrent_id, status in torrents_status.iteritems():
+            self.seen[torrent_id] = now
+            rank = self.rank(status)
+            entry = self.entries.get(torrent_id)
+            if entry is None or entry[0] != rank:
+                entry = [rank, next(self.counter), torrent_id]
+                self.entries[torrent_id] = entry
+                heapq.heappush(self.heap, entry)
+
+        if now - self.pruned >= IDLE / 10:
+            self.prune(now)
+        # Don't let skipped entries pile up.
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = self.entries.values()
+            heapq.heapify(self.heap)
+
+    def prune(self, now):
+        """Drops the torrents not seen transferring for IDLE seconds."""
+        cutoff = now - IDLE
+        for torrent_id in [torrent_id for torrent_id, seen
+                           in self.seen.iteritems() if seen < cutoff]:
+            self.remove(torrent_id)
+        self.pruned = now
+
+    def remove(self, torrent_id):
+        self.entries.pop(torrent_id, None)
+        self.seen.pop(torrent_id, None)
+
+    def target(self, used):
+        """
+        Returns the fraction of torrents that should be paused when the
+        given fraction of a limit is used.
+        """
+        fraction = 0.0
+        for threshold, paused in self.thresholds:
+            if used >= threshold:
+                fraction = paused
+        return fraction
+
+    def wanted(self, used, paused, now):
+        """
+        Returns how many more torrents to pause when the given fraction of
+        a limit is used and paused torrents have been paused already, out
+        of those that have been transferring within IDLE seconds.
+        """
+        fraction = self.target(used)
+        if fraction <= 0:
+            return 0
+        self.prune(now)
+        return int(math.ceil(fraction * (len(self.entries) + paused))) \
+            - paused
+
+    def lowest(self, count, now):
+        """
+        Takes up to count of the lowest ranked torrents that are still
+        transferring out of the ranking, and returns them.
+        """
+        torrent_ids = []
+        while self.heap and len(torrent_ids) < count:
+            rank, sequence, torrent_id = entry = heapq.heappop(self.heap)
+            if self.entries.get(torrent_id) is not entry:
+                continue
+            del self.entries[torrent_id]
+            if self.seen.pop(torrent_id, 0) < now - IDLE:
+                continue
+            torrent_ids.append(torrent_id)
+        return torrent_ids
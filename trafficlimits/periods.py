@@ -0,0 +1,91 @@
+#
+# periods.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import errno
+import json
+
+from deluge.log import LOG as log
+
+# The fields of each record, in order.
+FIELDS = ["direction", "label", "start", "end", "used", "breached"]
+
+class PeriodLog(object):
+    """
+    Text log of the periods that have ended, one JSON array of FIELDS per
+    line, so that usage can be reconciled against a bill long after the
+    counters were cleared.  A period ends a few times a month at most, so
+    the file is simply appended to, and read back from a byte offset.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def append(self, direction, label, start, end, used, breached):
+        try:
+            with open(self.filename, "a") as periods:
+                periods.write(json.dumps([direction, label, start, end, used,
+                                          breached]) + "\n")
+        except (IOError, OSError) as error:
+            log.error("TrafficLimits: " + self.filename + ": " + str(error))
+
+    def read(self, offset=0, limit=1000):
+        """
+        Returns up to limit records from offset bytes into the file, and the
+        offset of the next record, or None if there are no more.
+        """
+        records = []
+        try:
+            with open(self.filename, "r") as periods:
+                periods.seek(offset)
+                while len(records) < limit:
+                    line = periods.readline()
+                    if not line:
+                        return records, None
+                    if line.endswith("\n"):
+                        records.append(json.loads(line))
+                    offset += len(line)
+                if not periods.readline():
+                    return records, None
+                return records, offset
+        except (IOError, OSError, ValueError) as error:
+            if getattr(error, "errno", None) != errno.ENOENT:
+                log.error("TrafficLimits: " + self.filename + ": "
+                          + str(error))
+            return records, None
@@ -0,0 +1,606 @@
+#
+# replay.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+"""
+Replays recorded traffic against alternative limits, to see what each would
+have done: how far past its limits it would have let usage go, how long it
+would have kept transfers paused, and how much it would have delivered.
+
+    trafficlimits-replay --maximum-download 10G,20G --reset monthly \\
+        --interval 60,300,900 --pacing both usage.csv
+
+The traffic comes from a CSV or JSON Lines file with start, upload and
+download for each interval, such as trafficlimits-export writes, or
+straight from a history file.  Each policy is a dict like
+
+    {"name": "20G a month, paced", "maximum_upload": -1,
+     "maximum_download": 21474836480, "maximum_total": -1,
+     "reset": "monthly", "interval": 60, "pacing": true,
+     "pacing_period": 2592000, "pacing_window": 3600, "schedule": []}
+
+where reset is as for rules.Rules, interval is the seconds between checks,
+and a schedule, as for schedule.Schedule, overrides the maximum_* values
+(and clears the counters as it would in the plugin).  Breaches are found
+with rules.over() and rules.decide(), as in the plugin, and pacing works
+like pacing.allowed_rate().  Requires NumPy: policies without pacing are
+replayed a period at a time, with cumulative sums, and paced ones together,
+a step at a time, as a vector.
+"""
+
+import csv
+import itertools
+import json
+import optparse
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import rules
+from schedule import Schedule
+
+DIRECTIONS = rules.DIRECTIONS
+DEFAULTS = {
+    "maximum_upload": -1,
+    "maximum_download": -1,
+    "maximum_total": -1,
+    "reset": "breach",
+    "interval": 60,
+    "pacing": False,
+    "pacing_period": 30 * 24 * 60 * 60,
+    "pacing_window": 60 * 60,
+    "schedule": [],
+}
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+class Traffic(object):
+    """Recorded traffic, in equal steps of step seconds."""
+
+    def __init__(self, samples, step=None):
+        """
+        :param samples: list of (start, upload, download), sorted by start
+        :param step: seconds per step; by default, the shortest gap between
+            samples
+        """
+        starts = numpy.array([sample[0] for sample in samples], dtype=float)
+        if step is None:
+            gaps = numpy.diff(starts)
+            gaps = gaps[gaps > 0]
+            step = gaps.min() if len(gaps) else 60
+        self.step = float(step)
+        self.start = starts[0] - starts[0] % self.step
+        index = ((starts - self.start) // self.step).astype(int)
+        length = index[-1] + 1
+        self.upload = numpy.bincount(
+            index, [sample[1] for sample in samples], length)
+        self.download = numpy.bincount(
+            index, [sample[2] for sample in samples], length)
+        self.times = self.start + self.step * numpy.arange(length)
+
+    def __len__(self):
+        return len(self.times)
+
+def read_samples(path):
+    """
+    Returns [(start, upload, download)] from a CSV file with a header, or a
+    JSON Lines file, such as trafficlimits-export writes.
+    """
+    with open(path) as source:
+        first = source.readline()
+        source.seek(0)
+        if first.startswith("{"):
+            rows = (json.loads(line) for line in source if line.strip())
+        else:
+            rows = csv.DictReader(source)
+        samples = [(float(row["start"]), float(row["upload"]),
+                    float(row["download"])) for row in rows]
+    samples.sort()
+    return samples
+
+def read_history(path, resolution):
+    """
+    Returns [(start, upload, download)] from a history file, which is only
+    ever read.
+    """
+    from history import History
+    history = History(path, readonly=True)
+    try:
+        # From as far back as the tier at this resolution goes, rather than
+        # from the epoch, which only the coarsest tier might reach.
+        start = history.oldest(history.tier_for(resolution)) or 0
+        return [tuple(interval) for interval
+                in history.iterate(start, float("inf"), resolution)]
+    finally:
+        history.close()
+
+def boundaries(traffic, reset):
+    """
+    Returns a boolean array, true at each step in which a period with the
+    reset policy ends, and the end of the period in progress at each step.
+    """
+    flags = numpy.zeros(len(traffic), dtype=bool)
+    ends = numpy.empty(len(traffic))
+    start = traffic.times[0]
+    previous = 0
+    while True:
+        end = rules.next_reset(reset, start)
+        i = int(numpy.searchsorted(traffic.times, end))
+        ends[previous:i] = end
+        if i >= len(traffic):
+            return flags, ends
+        flags[i] = True
+        previous = i
+        start = end
+
+def scheduled(traffic, schedule):
+    """
+    Returns the maximum_* values in force at each step under the schedule,
+    as an array of steps by DIRECTIONS, an array of the steps at which the
+    counters are cleared, and the next transition after each step.
+    """
+    schedule = Schedule(schedule)
+    maxima = numpy.empty((len(traffic), len(DIRECTIONS)))
+    flags = numpy.zeros(len(traffic), dtype=bool)
+    ends = numpy.empty(len(traffic))
+    now = traffic.times[0]
+    label = None
+    while True:
+        active = schedule.active(now)
+        rule = active[1] if active else DEFAULTS
+        end = schedule.next_transition(now) or float("inf")
+        i = int(numpy.searchsorted(traffic.times, now))
+        j = int(numpy.searchsorted(traffic.times, end))
+        maxima[i:j] = [rule.get("maximum_" + direction, -1)
+                       for direction in DIRECTIONS]
+        ends[i:j] = end
+        reset = rule.get("reset")
+        if label is not None and (reset or (reset is None
+                                            and rule.get("label") != label)):
+            flags[i] = True
+        label = rule.get("label", "")
+        if j >= len(traffic):
+            break
+        now = end
+    return maxima, flags, ends
+
+def replay(traffic, policies):
+    """
+    Returns a dict per policy, of the number of "breaches" in each
+    direction, the greatest "overshoot" past a limit (bytes), the "paused"
+    seconds, and the bytes "delivered" and "demanded" in total.
+
+    Without pacing, what a policy lets through depends only on the demand,
+    so each is replayed a period at a time, with cumulative sums.  Paced
+    policies are replayed a step at a time, all together.
+    """
+    demand = numpy.column_stack((traffic.upload, traffic.download,
+                                 traffic.upload + traffic.download))
+    periods = Periods(traffic)
+    results = [None] * len(policies)
+    usage = {}
+    checked = {}
+    paced = []
+    for p, policy in enumerate(policies):
+        if policy["pacing"]:
+            paced.append(p)
+            continue
+        key = periods.key(policy)
+        if key not in usage:
+            usage[key] = accumulate(demand, periods.flags(policy))
+        interval = max(1, int(round(policy["interval"] / traffic.step)))
+        if (key, interval) not in checked:
+            checks = numpy.arange(0, len(traffic), interval)
+            checked[key, interval] = (checks, usage[key][2][checks])
+        results[p] = replay_unpaced(traffic, usage[key],
+                                    checked[key, interval],
+                                    periods.maxima(policy))
+    if paced:
+        for p, result in zip(paced, replay_paced(
+                traffic, [policies[p] for p in paced], periods)):
+            results[p] = result
+
+    demanded = demand[:, 2].sum()
+    for result in results:
+        result["demanded"] = demanded
+    return results
+
+class Periods(object):
+    """
+    When each policy's periods end, and the limits in force in them, worked
+    out once for all the policies sharing a reset policy or a schedule.
+    """
+
+    def __init__(self, traffic):
+        self.traffic = traffic
+        self.resets = {}
+        self.schedules = {}
+
+    def key(self, policy):
+        return (policy["reset"],
+                json.dumps(policy["schedule"], sort_keys=True))
+
+    def _schedule(self, policy):
+        key = self.key(policy)[1]
+        if key not in self.schedules:
+            self.schedules[key] = scheduled(self.traffic, policy["schedule"])
+        return self.schedules[key]
+
+    def _reset(self, policy):
+        if policy["reset"] not in self.resets:
+            self.resets[policy["reset"]] = boundaries(self.traffic,
+                                                      policy["reset"])
+        return self.resets[policy["reset"]]
+
+    def flags(self, policy):
+        """Returns an array, true at each step that starts a new period."""
+        flags = self._reset(policy)[0]
+        if policy["schedule"]:
+            flags = flags | self._schedule(policy)[1]
+        return flags
+
+    def ends(self, policy):
+        """Returns the end of the period in progress at each step."""
+        ends = self._reset(policy)[1]
+        if policy["schedule"]:
+            ends = numpy.minimum(ends, self._schedule(policy)[2])
+        return ends
+
+    def maxima(self, policy):
+        """Returns the maximum_* values in force at each step."""
+        if policy["schedule"]:
+            return self._schedule(policy)[0]
+        return numpy.array([[policy["maximum_" + direction]
+                             for direction in DIRECTIONS]], dtype=float)
+
+def accumulate(demand, flags):
+    """
+    Returns the first step of each period, the period of each step, the
+    demand so far in the period at each step, and the total demand so far
+    at each step, given the steps that start periods.
+    """
+    flags = flags.copy()
+    flags[0] = True
+    starts = numpy.flatnonzero(flags)
+    period = numpy.cumsum(flags) - 1
+    totals = numpy.cumsum(demand, axis=0)
+    before = (totals - demand)[starts]
+    return starts, period, totals - before[period], totals[:, 2]
+
+def replay_unpaced(traffic, usage, checked, maxima):
+    """
+    Replays a policy without pacing: in each period, everything is
+    delivered up to the first check that finds a limit exceeded, and
+    nothing after that until the period ends.
+
+    :param usage: as returned by accumulate()
+    :param checked: (the steps with a check, the usage at each)
+    :param maxima: the maximum_* values at each step, or a single row
+    """
+    starts, period, used, totals = usage
+    checks, used_at_checks = checked
+    if len(maxima) > 1:
+        maxima_at_checks = maxima[checks]
+    else:
+        maxima_at_checks = maxima
+    over = rules.over(used_at_checks, maxima_at_checks)
+    breaches = checks[over.any(axis=1)]
+    # Only the first breach in each period counts; the rest are paused.
+    breaches = breaches[numpy.unique(period[breaches], return_index=True)[1]]
+
+    ends = numpy.append(starts[1:], len(traffic))[period[breaches]]
+    paused = ends - breaches - 1
+    withheld = totals[ends - 1] - totals[breaches]
+
+    counts = dict((direction, 0) for direction in DIRECTIONS)
+    overshoot = 0.0
+    for t in breaches:
+        limits = maxima[t % len(maxima)]
+        directions = rules.over(used[t], limits)
+        action, direction = rules.decide(
+            [DIRECTIONS[i] for i in numpy.flatnonzero(directions)],
+            ["pause"] * int(directions.sum()))
+        counts[direction] += 1
+        overshoot = max(overshoot, (used[t] - limits)[directions].max())
+    return {"breaches": counts, "overshoot": overshoot,
+            "paused": paused.sum() * traffic.step,
+            "delivered": totals[-1] - withheld.sum()}
+
+def replay_paced(traffic, policies, periods):
+    """Replays the policies a step at a time, pacing those that pace."""
+    count = len(policies)
+    step = traffic.step
+    maxima = numpy.array([[policy["maximum_" + direction]
+                           for direction in DIRECTIONS]
+                          for policy in policies], dtype=float)
+    intervals = numpy.array([max(1, int(round(policy["interval"] / step)))
+                             for policy in policies])
+    paced = numpy.array([bool(policy["pacing"]) for policy in policies])
+    pacing_period = numpy.array([policy["pacing_period"]
+                                 for policy in policies], dtype=float)
+    window = numpy.array([policy["pacing_window"] for policy in policies],
+                         dtype=float)
+    period_flags = numpy.array([periods.flags(policy)
+                                for policy in policies])
+    period_ends = numpy.array([periods.ends(policy) for policy in policies])
+    scheduled_maxima = dict((p, periods.maxima(policy))
+                            for p, policy in enumerate(policies)
+                            if policy["schedule"])
+    any_reset = period_flags.any(axis=0)
+
+    used = numpy.zeros((count, len(DIRECTIONS)))
+    paused = numpy.zeros(count, dtype=bool)
+    period_start = numpy.repeat(traffic.times[0], count)
+    caps = numpy.full((count, 2), numpy.inf)
+    delivered = numpy.zeros(count)
+    paused_steps = numpy.zeros(count)
+    overshoot = numpy.zeros(count)
+    breaches = [dict((direction, 0) for direction in DIRECTIONS)
+                for policy in policies]
+
+    for t in xrange(len(traffic)):
+        now = traffic.times[t]
+        if any_reset[t]:
+            cleared = period_flags[:, t]
+            used[cleared] = 0
+            paused[cleared] = False
+            period_start[cleared] = now
+        if scheduled_maxima:
+            for p, schedule_maxima in scheduled_maxima.iteritems():
+                maxima[p] = schedule_maxima[t]
+
+        checking = t % intervals == 0
+        if paced.any():
+            pacing = paced & checking
+            if pacing.any():
+                caps[pacing] = rates(used[pacing], maxima[pacing],
+                                     period_start[pacing],
+                                     period_ends[pacing, t],
+                                     pacing_period[pacing], now,
+                                     window[pacing],
+                                     traffic.upload[t], traffic.download[t])
+                caps[pacing] *= step
+
+        upload = numpy.where(paused, 0,
+                             numpy.minimum(traffic.upload[t], caps[:, 0]))
+        download = numpy.where(paused, 0,
+                               numpy.minimum(traffic.download[t], caps[:, 1]))
+        used[:, 0] += upload
+        used[:, 1] += download
+        used[:, 2] += upload + download
+        delivered += upload + download
+        paused_steps += paused
+
+        over = rules.over(used, maxima) & (checking & ~paused)[:, None]
+        for p in numpy.flatnonzero(over.any(axis=1)):
+            directions = [DIRECTIONS[i] for i in numpy.flatnonzero(over[p])]
+            action, direction = rules.decide(directions,
+                                             ["pause"] * len(directions))
+            breaches[p][direction] += 1
+            overshoot[p] = max(overshoot[p],
+                               (used[p] - maxima[p])[over[p]].max())
+            paused[p] = True
+            if policies[p]["reset"] == "breach":
+                # The plugin clears the counter as it pauses.
+                used[p][over[p]] = 0
+
+    return [{"breaches": breaches[p], "overshoot": overshoot[p],
+             "paused": paused_steps[p] * step, "delivered": delivered[p]}
+            for p in xrange(count)]
+
+def rates(used, maxima, start, end, pacing_period, now, window, upload,
+          download):
+    """
+    Returns the (upload, download) rates, in bytes/s, that pace each policy,
+    as pacing.allowed_rate() and Core.update_pacing() would, with the total
+    shared out as the demand is.  The period ends at the next reset or
+    scheduled transition, or failing those after pacing_period.
+    """
+    end = numpy.where(numpy.isinf(end), start + pacing_period, end)
+    length = numpy.maximum(end - start, 1)
+    fill_rate = maxima / length[:, None]
+    earned = fill_rate * numpy.clip(now - start, 0, length)[:, None]
+    tokens = numpy.minimum(earned - used, fill_rate * window[:, None])
+    allowed = numpy.maximum(0, fill_rate + tokens / window[:, None])
+    share = upload / float(upload + download) if upload + download else 0.5
+    shares = numpy.column_stack((allowed[:, 2] * share,
+                                 allowed[:, 2] * (1 - share)))
+    shares[maxima[:, 2] < 0] = numpy.inf
+    allowed[maxima < 0] = numpy.inf
+    return numpy.minimum(allowed[:, :2], shares)
+
+def parse_size(value):
+    """Bytes, from a number with an optional K, M, G or T (binary)."""
+    value = value.strip().upper().rstrip("B").rstrip("I")
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+def parse_reset(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def describe(policy):
+    parts = []
+    for direction in DIRECTIONS:
+        maximum = policy["maximum_" + direction]
+        if maximum >= 0 and not policy["schedule"]:
+            parts.append("%s<=%s" % (direction, format_size(maximum)))
+    if policy["schedule"]:
+        parts.append("scheduled")
+    parts.append("reset=%s" % policy["reset"])
+    parts.append("every %ds" % policy["interval"])
+    if policy["pacing"]:
+        parts.append("paced")
+    return " ".join(parts)
+
+def format_size(size):
+    for unit in "TGMK":
+        if abs(size) >= UNITS[unit]:
+            return "%.4g%s" % (size / float(UNITS[unit]), unit)
+    return "%d" % size
+
+def sweep(options):
+    """Returns the policies given by the options, every combination."""
+    def values(option, parse):
+        return [parse(value) for value in option.split(",")]
+    schedule = []
+    if options.schedule:
+        with open(options.schedule) as source:
+            schedule = json.load(source)
+    pacing = {"no": [False], "yes": [True], "both": [False, True]}
+    policies = []
+    for upload, download, total, reset, interval, paced in itertools.product(
+            values(options.maximum_upload, parse_size),
+            values(options.maximum_download, parse_size),
+            values(options.maximum_total, parse_size),
+            values(options.reset, parse_reset),
+            values(options.interval, float),
+            pacing[options.pacing]):
+        policy = dict(DEFAULTS)
+        policy.update({"maximum_upload": upload,
+                       "maximum_download": download,
+                       "maximum_total": total, "reset": reset,
+                       "interval": interval, "pacing": paced,
+                       "schedule": schedule})
+        policies.append(policy)
+    return policies
+
+def main():
+    parser = optparse.OptionParser(
+        usage="%prog [options] [USAGE_FILE]",
+        description="Replays recorded traffic against alternative limits, "
+        "and reports for each how many times it paused, how far past its "
+        "limits usage went, how long transfers were paused, and the share "
+        "of the traffic it let through.  Give either a CSV or JSON Lines "
+        "file of start, upload and download (as trafficlimits-export "
+        "writes), or --history.  Lists of values are separated by commas; "
+        "every combination is replayed.")
+    parser.add_option("--history", metavar="FILE",
+                      help="read the traffic from a history file instead")
+    parser.add_option("--resolution", type="int", default=60,
+                      help="seconds per step read from --history [%default]")
+    parser.add_option("--step", type="float",
+                      help="seconds per step [the shortest gap in the data]")
+    parser.add_option("--policies", metavar="FILE",
+                      help="JSON list of policies, instead of the options "
+                      "below")
+    parser.add_option("--maximum-upload", default="-1",
+                      help="e.g., 500M,1G [%default]")
+    parser.add_option("--maximum-download", default="-1")
+    parser.add_option("--maximum-total", default="-1")
+    parser.add_option("--reset", default="breach",
+                      help="breach, daily, weekly, monthly or seconds "
+                      "[%default]")
+    parser.add_option("--interval", default="60",
+                      help="seconds between checks [%default]")
+    parser.add_option("--pacing", choices=("no", "yes", "both"),
+                      default="no", help="no, yes or both [%default]")
+    parser.add_option("--schedule", metavar="FILE",
+                      help="JSON schedule to apply, overriding the maxima")
+    parser.add_option("--csv", action="store_true", default=False,
+                      help="write the results as CSV")
+    options, args = parser.parse_args()
+    if numpy is None:
+        parser.error("NumPy is needed to replay traffic.")
+    if bool(args) == bool(options.history) or len(args) > 1:
+        parser.error("give one usage file, or --history")
+
+    try:
+        if options.history:
+            samples = read_history(options.history, options.resolution)
+        else:
+            samples = read_samples(args[0])
+        if options.policies:
+            with open(options.policies) as source:
+                policies = [dict(DEFAULTS, **policy)
+                            for policy in json.load(source)]
+        else:
+            policies = sweep(options)
+    except (IOError, OSError, ValueError, KeyError) as error:
+        parser.error(str(error))
+    if not samples:
+        parser.error("no traffic recorded")
+
+    traffic = Traffic(samples, options.step)
+    short = sorted(set(policy["interval"] for policy in policies
+                       if policy["interval"] < traffic.step))
+    if short:
+        sys.stderr.write(
+            "%s: warning: the traffic is in steps of %g s, so checks every "
+            "%s s are replayed as checks every step\n"
+            % (parser.get_prog_name(), traffic.step,
+               ", ".join("%g" % interval for interval in short)))
+    results = replay(traffic, policies)
+
+    header = ["policy", "breaches", "max overshoot", "paused hours",
+              "delivered", "delivered %"]
+    rows = []
+    for policy, result in zip(policies, results):
+        rows.append([
+            policy.get("name") or describe(policy),
+            sum(result["breaches"].itervalues()),
+            int(result["overshoot"]),
+            "%.1f" % (result["paused"] / 3600.0),
+            int(result["delivered"]),
+            "%.1f" % (100.0 * result["delivered"]
+                      / max(1, result["demanded"])),
+        ])
+    if options.csv:
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+        return
+
+    print("%d steps of %g s from %s, %s demanded"
+          % (len(traffic), traffic.step,
+             time.strftime("%c", time.localtime(traffic.start)),
+             format_size(results[0]["demanded"] if results else 0)))
+    width = max([len(row[0]) for row in rows] + [len(header[0])])
+    print("%-*s %8s %13s %12s %10s %11s"
+          % ((width,) + tuple(header)))
+    for row in rows:
+        print("%-*s %8d %13s %12s %10s %11s"
+              % (width, row[0], row[1], format_size(row[2]), row[3],
+                 format_size(row[4]), row[5]))
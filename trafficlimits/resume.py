@@ -0,0 +1,184 @@
+#
+# resume.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import time
+
+import deluge.component as component
+from deluge.log import LOG as log
+from twisted.internet import reactor
+
+# Orders in which paused torrents can be brought back, and the torrent
+# status key each sorts on, lowest first.
+ORDERS = {
+    "queue": "queue",
+    "ratio": "ratio",
+    "size": "total_size",
+}
+
+class ResumeScheduler(object):
+    """
+    Resumes torrents a batch at a time, rather than all at once, so that a
+    reset does not set off thousands of announces, connections and checks
+    together.
+
+    The torrents still waiting are kept in the plugin's config, so that
+    they are not left paused for good if Deluge stops in the meantime.
+    """
+
+    def __init__(self, batch=0, interval=10, order="queue", config=None,
+                 save=None):
+        """
+        :param batch: int, torrents per batch; 0 to resume them all at once
+        :param interval: float, seconds between batches
+        :param order: str, one of ORDERS, for which torrents go first
+        :param config: the plugin's config, to keep the torrents waiting in,
+            as "resume_pending"; or None
+        :param save: function to call to have the config saved
+        """
+        self.batch = batch
+        self.interval = interval
+        self.order = order
+        self.config = config
+        self.save = save
+        self.pending = []
+        self.resumed = 0
+        self.started = None
+        self.timer = None
+
+    def active(self):
+        return bool(self.pending)
+
+    def recover(self):
+        """Carries on resuming whatever was still waiting last time."""
+        pending = self.config["resume_pending"]
+        if not pending:
+            return
+        # Any that have been removed meanwhile are left out.
+        status = component.get("Core").get_torrents_status(
+            {"id": pending}, ["state"])
+        log.info("TrafficLimits: Resuming torrents left paused when "
+                 "resuming was interrupted.")
+        self.start([torrent_id for torrent_id in pending
+                    if torrent_id in status])
+        self.remember()
+
+    def remember(self):
+        if self.config is None:
+            return
+        self.config["resume_pending"] = self.pending[::-1]
+        self.save()
+
+    def start(self, torrent_ids):
+        """Begins resuming torrent_ids, after any still waiting."""
+        pending = set(self.pending)
+        torrent_ids = [torrent_id for torrent_id in torrent_ids
+                       if torrent_id not in pending]
+        if not torrent_ids:
+            return
+        if self.batch <= 0:
+            component.get("Core").resume_torrent(torrent_ids)
+            return
+
+        key = ORDERS.get(self.order, "queue")
+        status = component.get("Core").get_torrents_status(
+            {"id": torrent_ids}, [key])
+        torrent_ids.sort(key=lambda torrent_id:
+                         status.get(torrent_id, {}).get(key))
+        if not self.pending:
+            self.resumed = 0
+            self.started = time.time()
+        # Kept in reverse, so that each batch comes off the end.
+        self.pending = torrent_ids[::-1] + self.pending
+        self.remember()
+        log.info("TrafficLimits: Resuming %d torrents, %d at a time."
+                 % (len(self.pending), self.batch))
+        if self.timer is None:
+            self.next_batch()
+
+    def next_batch(self):
+        self.timer = None
+        batch = self.pending[-self.batch:][::-1]
+        del self.pending[-self.batch:]
+        if batch:
+            component.get("Core").resume_torrent(batch)
+            self.resumed += len(batch)
+            self.remember()
+        if self.pending:
+            self.timer = reactor.callLater(self.interval, self.next_batch)
+
+    def stop(self):
+        """
+        Stops resuming, and returns the torrents that were still waiting.
+        """
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        pending = self.pending[::-1]
+        self.pending = []
+        if pending:
+            self.remember()
+        return pending
+
+    def finish(self):
+        """Resumes everything still waiting straight away."""
+        pending = self.stop()
+        if pending:
+            component.get("Core").resume_torrent(pending)
+            self.resumed += len(pending)
+
+    def discard(self, torrent_id):
+        if torrent_id in self.pending:
+            self.pending.remove(torrent_id)
+            self.remember()
+
+    def progress(self):
+        """
+        Returns a dict with the number of torrents "resumed" and still
+        "pending", when resuming "started" (secs since epoch, or None), and
+        the seconds until the "next_batch" (or None).
+        """
+        next_batch = None
+        if self.timer is not None and self.timer.active():
+            next_batch = max(0, self.timer.getTime() - time.time())
+        return {
+            "resumed": self.resumed,
+            "pending": len(self.pending),
+            "started": self.started,
+            "next_batch": next_batch,
+        }
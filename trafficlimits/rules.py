@@ -0,0 +1,274 @@
+#
+# rules.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from array import array
+import time
+
+from forecast import time_to_limit
+
+DIRECTIONS = ("upload", "download", "total")
+# Actions a rule can take, least severe first.
+ACTIONS = ("log", "pause")
+# The counters a rule can be evaluated against, in snapshot order: the main
+# period counters (for the whole host, with a shared quota), then this
+# session's running totals.
+SOURCES = ("period_upload", "period_download", "period_total",
+           "session_upload", "session_download", "session_total")
+# Rules 0-2 are the main limits, on sources 0-2; the rest are configured.
+MAIN = 3
+
+INFINITY = float("inf")
+
+def over(used, maximum):
+    """
+    Returns whether used is over maximum, where a negative maximum means no
+    limit.  Works element-wise on NumPy arrays as well as on numbers.
+    """
+    return (maximum >= 0) & (used > maximum)
+
+def decide(directions, actions):
+    """
+    Returns the one (action, direction) to take in a tick in which rules
+    with the given directions and actions were breached, or None.  The most
+    severe action wins; if rules in different directions call for it, it
+    is taken for "total".
+    """
+    if not actions:
+        return None
+    action = max(actions, key=ACTIONS.index)
+    chosen = set([direction for direction, candidate
+                  in zip(directions, actions) if candidate == action])
+    return action, chosen.pop() if len(chosen) == 1 else "total"
+
+def next_reset(policy, start):
+    """
+    Returns when a period that began at start ends: at the next local
+    midnight, Monday or first of the month for "daily", "weekly" or
+    "monthly", after policy seconds for a number, or never for "breach".
+    """
+    if isinstance(policy, (int, long, float)):
+        return start + policy
+    t = time.localtime(start)
+    if policy == "daily":
+        return time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1,
+                            0, 0, 0, 0, 0, -1))
+    if policy == "weekly":
+        return time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 7 - t.tm_wday,
+                            0, 0, 0, 0, 0, -1))
+    if policy == "monthly":
+        return time.mktime((t.tm_year, t.tm_mon + 1, 1, 0, 0, 0, 0, 0, -1))
+    return INFINITY
+
+class Rules(object):
+    """
+    The limits, as a vector of rules evaluated together each tick.
+
+    Rules other than the main ones are configured as dicts like
+
+        {"name": "Daily total", "direction": "total",
+         "maximum": 2147483648, "reset": "daily", "action": "pause"}
+
+    where reset is "breach" (the default: start again once exceeded),
+    "daily", "weekly", "monthly" or a number of seconds, and action is
+    "pause" (the default) or "log".  A rule that resets on a schedule stays
+    breached, and holds its pause, until the end of its period.
+
+    Each rule's usage is its source counter plus an offset, so nothing is
+    added up per rule per tick.  For each source, the lowest value at which
+    any rule would be breached is kept, so a tick in which nothing is
+    breached costs a comparison per source however many rules there are.
+    """
+
+    def __init__(self, rules, usage=None, snapshot=(0,) * len(SOURCES),
+                 now=None):
+        """
+        :param rules: list of rule dicts, as described above
+        :param usage: dict, name -> [used, reset_time], as previously
+            returned by usage()
+        :param snapshot: the counters now, in SOURCES order
+        """
+        now = time.time() if now is None else now
+        rules = [rule for rule in rules
+                 if rule.get("direction") in DIRECTIONS
+                 and rule.get("action", "pause") in ACTIONS]
+        self.names = list(DIRECTIONS) + [rule["name"] for rule in rules]
+        self.directions = list(DIRECTIONS) + [rule["direction"]
+                                              for rule in rules]
+        self.sources = range(MAIN) + [
+            MAIN + DIRECTIONS.index(rule["direction"]) for rule in rules]
+        self.maximum = array("d", [-1] * MAIN
+                             + [rule.get("maximum", -1) for rule in rules])
+        self.actions = ["pause"] * MAIN + [rule.get("action", "pause")
+                                           for rule in rules]
+        self.policies = ["breach"] * MAIN + [rule.get("reset", "breach")
+                                             for rule in rules]
+        self.offset = array("d", [0]) * len(self.names)
+        self.reset_time = [now] * len(self.names)
+        self.next_reset = [INFINITY] * len(self.names)
+        self.held = [False] * len(self.names)
+
+        for i in xrange(MAIN, len(self.names)):
+            used, reset_time = 0, now
+            if usage and self.names[i] in usage:
+                used, reset_time = usage[self.names[i]]
+            self.offset[i] = used - snapshot[self.sources[i]]
+            self.reset_time[i] = reset_time
+            self.next_reset[i] = next_reset(self.policies[i], reset_time)
+            # A rule still over from before a restart is only held if it
+            # just logs; one that pauses is breached again on the first
+            # tick, so that the session is paused again.
+            self.held[i] = bool(over(used, self.maximum[i])) \
+                and self.policies[i] != "breach" \
+                and self.actions[i] != "pause"
+
+        self.soonest = min(self.next_reset)
+        self.triggers = [INFINITY] * len(SOURCES)
+        self.update_triggers()
+
+    def __len__(self):
+        return len(self.names) - MAIN
+
+    def update_triggers(self):
+        """Recomputes the lowest value of each source that breaches a rule."""
+        triggers = [INFINITY] * len(SOURCES)
+        for i, source in enumerate(self.sources):
+            if self.maximum[i] >= 0 and not self.held[i]:
+                triggers[source] = min(triggers[source],
+                                       self.maximum[i] - self.offset[i])
+        self.triggers = triggers
+
+    def set_limits(self, maximum_upload, maximum_download, maximum_total):
+        """Sets the main limits."""
+        self.maximum[0] = maximum_upload
+        self.maximum[1] = maximum_download
+        self.maximum[2] = maximum_total
+        self.update_triggers()
+
+    def used(self, i, snapshot):
+        return self.offset[i] + snapshot[self.sources[i]]
+
+    def expire(self, snapshot, now):
+        """
+        Starts a new period for every rule whose period has ended.  Returns
+        True if that released a rule that was holding a pause.
+        """
+        if now < self.soonest:
+            return False
+        released = False
+        for i in xrange(MAIN, len(self.names)):
+            if self.next_reset[i] <= now:
+                released = released or (self.held[i]
+                                        and self.actions[i] == "pause")
+                self.reset(i, snapshot, now)
+        return released
+
+    def breached(self, snapshot):
+        """
+        Returns the indices of the rules newly over their limits, given the
+        counters in SOURCES order.
+        """
+        for source, trigger in enumerate(self.triggers):
+            if snapshot[source] > trigger:
+                break
+        else:
+            return []
+        return [i for i, source in enumerate(self.sources)
+                if not self.held[i]
+                and over(self.offset[i] + snapshot[source], self.maximum[i])]
+
+    def hold(self, i):
+        """Keeps rule i breached, and out of the triggers, until it resets."""
+        self.held[i] = True
+        self.update_triggers()
+
+    def holding(self):
+        """Returns whether a held rule is keeping the session paused."""
+        return any(held and action == "pause"
+                   for held, action in zip(self.held, self.actions))
+
+    def reset(self, i, snapshot, now):
+        """Starts a new period for rule i, which must not be a main one."""
+        self.offset[i] = -snapshot[self.sources[i]]
+        self.reset_time[i] = now
+        self.next_reset[i] = next_reset(self.policies[i], now)
+        self.held[i] = False
+        self.soonest = min(self.next_reset)
+        self.update_triggers()
+
+    def reset_all(self, snapshot, now):
+        for i in xrange(MAIN, len(self.names)):
+            self.reset(i, snapshot, now)
+
+    def time_to_limit(self, snapshot, upload_rate, download_rate):
+        """
+        Returns a dict, name -> seconds until the configured rule reaches
+        its limit at the given rates, for rules with a forecast.
+        """
+        rates = {"upload": upload_rate, "download": download_rate,
+                 "total": upload_rate + download_rate}
+        forecast = {}
+        for i in xrange(MAIN, len(self.names)):
+            if self.held[i]:
+                continue
+            seconds = time_to_limit(self.used(i, snapshot), self.maximum[i],
+                                    rates[self.directions[i]])
+            if seconds is not None:
+                forecast[self.names[i]] = seconds
+        return forecast
+
+    def usage(self, snapshot):
+        """Returns the counters in a form suitable for saving to config."""
+        return dict(
+            (self.names[i], [self.used(i, snapshot), self.reset_time[i]])
+            for i in xrange(MAIN, len(self.names))
+        )
+
+    def state(self, snapshot):
+        """
+        Returns a list with, for each configured rule, [name, direction,
+        used, maximum, reset_time, next_reset, action], next_reset being
+        None if the rule only resets when breached.
+        """
+        return [
+            [self.names[i], self.directions[i], self.used(i, snapshot),
+             self.maximum[i], self.reset_time[i],
+             None if self.next_reset[i] == INFINITY else self.next_reset[i],
+             self.actions[i]]
+            for i in xrange(MAIN, len(self.names))
+        ]
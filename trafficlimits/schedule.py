@@ -0,0 +1,144 @@
+#
+# schedule.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from bisect import bisect_right
+import datetime
+import time
+
+# How far ahead (and behind, to find the rule already in force) to compile
+# transitions.  This must be longer than a month, so that rules for a day of
+# the month are always found.
+HORIZON = 35 * 24 * 60 * 60
+
+def parse_time(value):
+    """Returns seconds after midnight for "HH:MM" or "HH:MM:SS"."""
+    fields = [int(field) for field in value.split(":")]
+    if not 2 <= len(fields) <= 3:
+        raise ValueError("Invalid time: " + value)
+    fields.extend([0] * (3 - len(fields)))
+    return fields[0] * 3600 + fields[1] * 60 + fields[2]
+
+class Schedule(object):
+    """
+    Limits that change according to the time.
+
+    Each rule is a dict like
+
+        {"label": "Evening", "time": "16:00", "weekdays": [0, 1, 2, 3, 4],
+         "days": [], "maximum_upload": 400000000,
+         "maximum_download": 750000000, "maximum_total": -1}
+
+    and comes into force at the given local time on the given weekdays
+    (0 is Monday) and days of the month (an empty list matches any), staying
+    in force until the next rule does.  Where two rules start at the same
+    moment, the later one in the list wins.  An optional "reset" of true or
+    false forces the counters to be cleared, or not, when the rule starts;
+    otherwise, they are cleared if the label changes.
+
+    The rules are compiled into a sorted list of transitions, so that the
+    rule in force is found by bisection.
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        self.offsets = []
+        for rule in rules:
+            self.rules.append(rule)
+            self.offsets.append(parse_time(rule.get("time", "00:00")))
+        self.times = []
+        self.indices = []
+        self.start = 0
+
+    def __len__(self):
+        return len(self.rules)
+
+    def compile(self, now):
+        """Lists the transitions within HORIZON either side of now."""
+        transitions = []
+        day = datetime.date.fromtimestamp(now - HORIZON)
+        last = datetime.date.fromtimestamp(now + HORIZON)
+        one_day = datetime.timedelta(days=1)
+        while day <= last:
+            weekday = day.weekday()
+            for i, rule in enumerate(self.rules):
+                if rule.get("weekdays") and weekday not in rule["weekdays"]:
+                    continue
+                if rule.get("days") and day.day not in rule["days"]:
+                    continue
+                offset = self.offsets[i]
+                transitions.append((
+                    time.mktime((day.year, day.month, day.day,
+                                 offset // 3600, offset // 60 % 60,
+                                 offset % 60, 0, 0, -1)),
+                    i
+                ))
+            day += one_day
+
+        transitions.sort()
+        self.times = [transition[0] for transition in transitions]
+        self.indices = [transition[1] for transition in transitions]
+        self.start = now
+
+    def _check(self, now):
+        # Recompile once half the horizon has been used up.
+        if not self.start <= now < self.start + HORIZON / 2:
+            self.compile(now)
+
+    def active(self, now):
+        """
+        Returns (start time, rule) for the rule in force at now, or None if
+        there is none.
+        """
+        if not self.rules:
+            return None
+        self._check(now)
+        i = bisect_right(self.times, now) - 1
+        if i < 0:
+            return None
+        return (self.times[i], self.rules[self.indices[i]])
+
+    def next_transition(self, now):
+        """Returns the time of the next transition after now, or None."""
+        if not self.rules:
+            return None
+        self._check(now)
+        i = bisect_right(self.times, now)
+        if i >= len(self.times):
+            return None
+        return self.times[i]
@@ -0,0 +1,247 @@
+#
+# sharedquota.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import errno
+import fcntl
+import mmap
+import os
+import struct
+import zlib
+
+from deluge.log import LOG as log
+
+DIRECTIONS = ("upload", "download", "total")
+MAGIC = "TLSQ"
+SLOTS = 32
+
+# magic, version, then for each direction: generation, reset time, and
+# whether the reset was because a limit was exceeded.
+HEADER = struct.Struct("<4sI" + "QdI4x" * len(DIRECTIONS))
+HEADER_SIZE = 128
+# sequence, pid, instance key, then for each direction: bytes used and the
+# generation they belong to.
+SLOT = struct.Struct("<IiQ" + "qQ" * len(DIRECTIONS))
+SLOT_SIZE = 96
+SIZE = HEADER_SIZE + SLOTS * SLOT_SIZE
+
+class SharedQuota(object):
+    """
+    Usage shared between several deluged instances on one host, through a
+    small memory-mapped file.
+
+    Each instance owns one slot, which only it writes, so publishing is
+    lock-free; a sequence number, odd while a write is in progress, lets
+    readers spot and retry torn reads.  The host-wide usage is the sum of
+    the slots.  Resets are coordinated by a generation number per
+    direction in the header, bumped under a file lock: only usage from the
+    current generation counts, and an instance that sees a newer generation
+    than its own resets its counters too.
+    """
+
+    def __init__(self, path, key):
+        """
+        :param path: str, the shared file, e.g., under /dev/shm
+        :param key: str, identifies this instance across restarts, so that
+            it gets its own slot back
+        """
+        self.path = path
+        self.key = zlib.crc32(key) & 0xffffffff or 1
+        self.fd = None
+        self.map = None
+        self.slot = None
+        self.sequence = 0
+        self.values = [0] * 2 * len(DIRECTIONS)
+        self.generations = [0] * len(DIRECTIONS)
+
+    def open(self):
+        """Claims a slot.  Returns False if that was not possible."""
+        try:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self.fd).st_size < SIZE:
+                    os.ftruncate(self.fd, SIZE)
+                self.map = mmap.mmap(self.fd, SIZE)
+                if self.map[:len(MAGIC)] != MAGIC:
+                    HEADER.pack_into(self.map, 0, MAGIC, 1,
+                                     *([0, 0.0, 0] * len(DIRECTIONS)))
+                self.slot = self._claim()
+                if self.slot is not None:
+                    self._write(os.getpid())
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+        except (IOError, OSError, mmap.error) as error:
+            log.error("TrafficLimits: " + self.path + ": " + str(error))
+            self.close()
+            return False
+
+        if self.slot is None:
+            log.error("TrafficLimits: " + self.path + ": no free slots.")
+            self.close()
+            return False
+
+        header = self._header()
+        self.generations = [generation for generation, reset_time, breached
+                            in header]
+        return True
+
+    def close(self):
+        """
+        Gives up the slot.  Our usage still counts towards the period: it
+        was transferred all the same.
+        """
+        if self.map is not None:
+            if self.slot is not None:
+                self._write(0)
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.slot = None
+
+    def _claim(self):
+        """
+        Returns our slot from last time, else an unused one, else one left
+        by an instance that has gone and whose usage no longer counts.
+        """
+        generations = [generation for generation, reset_time, breached
+                       in self._header()]
+        unused = stale = None
+        for slot in xrange(SLOTS):
+            fields = SLOT.unpack_from(self.map,
+                                      HEADER_SIZE + slot * SLOT_SIZE)
+            if fields[2] == self.key:
+                return slot
+            if unused is None and fields[2] == 0:
+                unused = slot
+            elif stale is None and not self._alive(fields[1]) \
+                    and all(fields[4 + 2 * i] != generation
+                            for i, generation in enumerate(generations)):
+                stale = slot
+        return unused if unused is not None else stale
+
+    def _alive(self, pid):
+        if pid <= 0:
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError as error:
+            return error.errno != errno.ESRCH
+        return True
+
+    def _header(self):
+        """Returns [(generation, reset time, breached)] per direction."""
+        fields = HEADER.unpack_from(self.map, 0)[2:]
+        return [tuple(fields[i:i + 3]) for i in xrange(0, len(fields), 3)]
+
+    def _write(self, pid):
+        offset = HEADER_SIZE + self.slot * SLOT_SIZE
+        self.sequence += 1
+        struct.pack_into("<I", self.map, offset, self.sequence | 1)
+        SLOT.pack_into(self.map, offset, self.sequence | 1, pid, self.key,
+                       *self.values)
+        self.sequence = (self.sequence | 1) + 1
+        struct.pack_into("<I", self.map, offset, self.sequence)
+
+    def publish(self, upload, download, total):
+        """Makes this instance's usage for the period visible to the rest."""
+        self.values = []
+        for used, generation in zip((upload, download, total),
+                                    self.generations):
+            self.values.extend((used, generation))
+        self._write(os.getpid())
+
+    def totals(self):
+        """Returns the host-wide (upload, download, total)."""
+        generations = [generation for generation, reset_time, breached
+                       in self._header()]
+        totals = [0] * len(DIRECTIONS)
+        for slot in xrange(SLOTS):
+            offset = HEADER_SIZE + slot * SLOT_SIZE
+            for attempt in xrange(3):
+                fields = SLOT.unpack_from(self.map, offset)
+                if fields[0] % 2 == 0 and struct.unpack_from(
+                        "<I", self.map, offset)[0] == fields[0]:
+                    break
+            if fields[2] == 0:
+                continue
+            for i in xrange(len(DIRECTIONS)):
+                if fields[4 + 2 * i] == generations[i]:
+                    totals[i] += fields[3 + 2 * i]
+        return tuple(totals)
+
+    def resets(self):
+        """
+        Returns [(direction, reset time, breached)] for each direction that
+        another instance has reset since we last looked.
+        """
+        resets = []
+        for i, (generation, reset_time, breached) \
+                in enumerate(self._header()):
+            if generation != self.generations[i]:
+                self.generations[i] = generation
+                resets.append((DIRECTIONS[i], reset_time, bool(breached)))
+        return resets
+
+    def reset(self, direction, reset_time, breached):
+        """
+        Starts a new period for direction, unless another instance beat us
+        to it, in which case we just join theirs.  Returns the reset time of
+        the period now in force.
+        """
+        i = DIRECTIONS.index(direction)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            header = self._header()
+            generation = header[i][0]
+            if generation == self.generations[i]:
+                generation += 1
+                header[i] = (generation, reset_time, int(breached))
+                fields = []
+                for entry in header:
+                    fields.extend(entry)
+                HEADER.pack_into(self.map, 0, MAGIC, 1, *fields)
+            self.generations[i] = generation
+            return header[i][1]
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def reset_time(self, direction):
+        return self._header()[DIRECTIONS.index(direction)][1]
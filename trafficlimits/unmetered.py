@@ -0,0 +1,213 @@
+#
+# unmetered.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+
+import binascii
+import socket
+
+from deluge.log import LOG as log
+
+# Seconds after which a torrent not scanned is forgotten.
+IDLE = 60 * 60
+# Most addresses whose match is remembered.
+MATCHES = 65536
+
+BITS = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+def address_family(address):
+    return socket.AF_INET6 if ":" in address else socket.AF_INET
+
+def address_number(family, address):
+    """Returns the address as an integer; raises socket.error if invalid."""
+    return int(binascii.hexlify(socket.inet_pton(family, address)), 16)
+
+def parse(cidr):
+    """
+    Returns (family, prefix length, network number) for a range such as
+    "192.168.0.0/16" or "fd00::/8"; a bare address is a range of one.
+    Raises ValueError if it is not valid.
+    """
+    address, slash, length = cidr.strip().partition("/")
+    family = address_family(address)
+    bits = BITS[family]
+    try:
+        number = address_number(family, address)
+        length = int(length) if slash else bits
+    except (socket.error, ValueError):
+        raise ValueError("Not a CIDR range: " + cidr)
+    if not 0 <= length <= bits:
+        raise ValueError("Not a CIDR range: " + cidr)
+    return family, length, number >> (bits - length)
+
+class Ranges(object):
+    """
+    A set of CIDR ranges, indexed by prefix length: the network numbers of
+    each (family, prefix length) are kept in a set, so matching an address
+    takes one lookup per prefix length in use, however many ranges there
+    are.
+    """
+
+    def __init__(self, cidrs):
+        self.index = {}
+        for cidr in cidrs:
+            try:
+                family, length, network = parse(cidr)
+            except ValueError as error:
+                log.error("TrafficLimits: " + str(error))
+                continue
+            self.index.setdefault((family, length), set()).add(network)
+        # Longest prefixes first, though any match will do.
+        self.lengths = sorted(self.index, key=lambda key: -key[1])
+
+    def __nonzero__(self):
+        return bool(self.index)
+
+    def __contains__(self, address):
+        if address.startswith("::ffff:") and "." in address:
+            address = address[len("::ffff:"):]	# IPv4-mapped
+        family = address_family(address)
+        try:
+            number = address_number(family, address)
+        except socket.error:
+            return False
+        bits = BITS[family]
+        for key in self.lengths:
+            if key[0] == family \
+                    and number >> (bits - key[1]) in self.index[key]:
+                return True
+        return False
+
+class PeerTable(object):
+    """
+    Works out the traffic with peers in unmetered ranges, incrementally.
+
+    Only unmetered peers are kept, each with the byte counts it had when
+    last seen, so a scan yields just what they transferred since.  Whether
+    an address is unmetered is remembered, so each is matched against the
+    ranges once.  A torrent's peers that have gone are dropped when it is
+    next scanned, and torrents not scanned for IDLE seconds are dropped
+    altogether.
+    """
+
+    def __init__(self, ranges):
+        """
+        :param ranges: Ranges, the unmetered ones
+        """
+        self.ranges = ranges
+        self.peers = {}		# torrent id -> {(ip, port): [up, down, scan]}
+        self.scanned = {}	# torrent id -> when last scanned
+        self.matches = {}	# ip -> whether unmetered
+        self.next_expiry = None
+        self.generation = 0	# counts scans
+
+    def __len__(self):
+        return sum(len(peers) for peers in self.peers.itervalues())
+
+    def update(self, torrents, now):
+        """
+        Returns the bytes (uploaded, downloaded) to and from unmetered peers
+        since the last update.
+
+        :param torrents: iterable of (torrent id, peers), where peers are as
+            from libtorrent's torrent_handle.get_peer_info(), with ip (a
+            tuple of address and port), total_upload and total_download
+        """
+        upload = download = 0
+        matches = self.matches
+        self.generation += 1
+        generation = self.generation
+        for torrent_id, peers in torrents:
+            known = self.peers.get(torrent_id)
+            if known is None:
+                known = self.peers[torrent_id] = {}
+            # Peers found connected to a torrent we have not been watching
+            # may have transferred anything before now, so are only noted.
+            watched = now - self.scanned.get(torrent_id, now - IDLE) < IDLE
+            seen = 0
+            for peer in peers:
+                unmetered = matches.get(peer.ip[0])
+                if unmetered is None:
+                    if len(matches) >= MATCHES:
+                        matches.clear()
+                    unmetered = matches[peer.ip[0]] = peer.ip[0] in self.ranges
+                if not unmetered:
+                    continue
+                seen += 1
+                last = known.get(peer.ip)
+                if last is None:
+                    if watched:
+                        upload += peer.total_upload
+                        download += peer.total_download
+                    known[peer.ip] = [peer.total_upload, peer.total_download,
+                                      generation]
+                    continue
+                if peer.total_upload >= last[0] \
+                        and peer.total_download >= last[1]:
+                    upload += peer.total_upload - last[0]
+                    download += peer.total_download - last[1]
+                else:
+                    # Connected again since the last scan.
+                    upload += peer.total_upload
+                    download += peer.total_download
+                last[0] = peer.total_upload
+                last[1] = peer.total_download
+                last[2] = generation
+            self.scanned[torrent_id] = now
+            if not seen:
+                del self.peers[torrent_id]
+            elif seen < len(known):
+                # Some have gone.
+                self.peers[torrent_id] = dict(
+                    (ip, counts) for ip, counts in known.iteritems()
+                    if counts[2] == generation)
+
+        if self.next_expiry is None or now >= self.next_expiry:
+            self.expire(now)
+        return upload, download
+
+    def expire(self, now):
+        """Forgets torrents that have not been scanned for IDLE seconds."""
+        for torrent_id, scanned in self.scanned.items():
+            if now - scanned >= IDLE:
+                self.remove(torrent_id)
+        self.next_expiry = now + IDLE / 10
+
+    def remove(self, torrent_id):
+        self.peers.pop(torrent_id, None)
+        self.scanned.pop(torrent_id, None)
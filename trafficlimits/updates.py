@@ -0,0 +1,163 @@
+#
+# updates.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import time
+
+# The usage counters in the state, to which the threshold applies: whole
+# fields, or the positions of the counters in each row of a list field.
+COUNTERS = {
+    "upload": None,
+    "download": None,
+    "total": None,
+    "buckets": (1, 2, 3),
+    "windows": (2, 3, 4),
+    "rules": (2,),
+}
+
+def significant(old, new, threshold, counters=None):
+    """
+    Returns True if new differs from old enough to be worth telling clients
+    about.  Counters must move by more than threshold; anything else must
+    simply differ.
+
+    :param counters: None if old and new are counters themselves, or the
+        positions of the counters in each row if they are lists of rows
+    """
+    if counters is None:
+        if isinstance(new, (int, long, float)) \
+                and isinstance(old, (int, long, float)):
+            return abs(new - old) > threshold
+        return new != old
+    if len(new) != len(old):
+        return True
+    for old_row, new_row in zip(old, new):
+        if len(new_row) != len(old_row):
+            return True
+        for i, (o, n) in enumerate(zip(old_row, new_row)):
+            if i in counters:
+                if significant(o, n, threshold):
+                    return True
+            elif o != n:
+                return True
+    return False
+
+class UpdateCoalescer(object):
+    """
+    Works out what each client needs to be told about the plugin state.
+
+    Every field remembers the version at which it last changed
+    significantly, and every client the version it last received, so each
+    client can be sent exactly the fields that changed since then, however
+    many updates it missed while throttled.  Memory use depends only on the
+    number of fields and clients.
+    """
+
+    def __init__(self, threshold=0, interval=0):
+        """
+        :param threshold: number, smallest change in a usage counter (see
+            COUNTERS) that counts; other fields count on any change
+        :param interval: float, minimum seconds between updates to a client
+        """
+        self.threshold = threshold
+        self.interval = interval
+        # Clients ignore updates no newer than the last they saw, so start
+        # from the time (in ms) rather than 0, to stay ahead of the versions
+        # sent before the plugin was last enabled.
+        self.version = int(time.time() * 1000)
+        self.state = {}
+        self.field_version = {}
+        self.client_version = {}
+        self.client_time = {}
+
+    def update(self, state):
+        """
+        Records the latest state, a dict of field -> value.  Returns True if
+        anything changed significantly.
+        """
+        changed = False
+        for field, value in state.iteritems():
+            if field not in self.state \
+                    or (significant(self.state[field], value, self.threshold,
+                                    COUNTERS[field])
+                        if field in COUNTERS
+                        else self.state[field] != value):
+                if not changed:
+                    self.version += 1
+                    changed = True
+                self.state[field] = value
+                self.field_version[field] = self.version
+        return changed
+
+    def changes(self, client, now=None):
+        """
+        Returns the dict of fields that client has not yet been sent, or None
+        if there are none or it is too soon to send them.  The client is
+        then assumed to be up to date.
+        """
+        if now is None:
+            now = time.time()
+        since = self.client_version.get(client, 0)
+        if since >= self.version:
+            return None
+        if now - self.client_time.get(client, 0) < self.interval:
+            return None
+
+        self.client_version[client] = self.version
+        self.client_time[client] = now
+        return dict((field, self.state[field])
+                    for field, version in self.field_version.iteritems()
+                    if version > since)
+
+    def waiting(self, client, now=None):
+        """
+        Returns how many seconds until client may be sent pending changes,
+        or None if it has none.
+        """
+        if now is None:
+            now = time.time()
+        if self.client_version.get(client, 0) >= self.version:
+            return None
+        return max(0, self.client_time.get(client, 0) + self.interval - now)
+
+    def forget(self, clients):
+        """Discards everything about clients that are not in clients."""
+        for client in self.client_version.keys():
+            if client not in clients:
+                del self.client_version[client]
+                self.client_time.pop(client, None)
@@ -0,0 +1,142 @@
+#
+# watcher.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+import os
+
+from deluge.log import LOG as log
+from twisted.internet import reactor
+
+# twisted.internet.inotify, imported by the first start(), as finding libc
+# for it is slow; None if it is unavailable.
+inotify = False
+
+class LimitsWatcher(object):
+    """
+    Calls back when the limits file changes.
+
+    Where inotify is available, the directory containing the file is
+    watched, so that an atomic rename onto the file is seen as well as a
+    rewrite in place, and bursts of events are collapsed into one call after
+    a short delay.  Otherwise poll() has to be called regularly, and compares
+    the file's inode, size and mtime, which are read in the background.
+    """
+
+    def __init__(self, path, callback, io, delay=0.2):
+        """
+        :param io: fileio.BackgroundIO, to stat the file with
+        """
+        self.path = path
+        self.callback = callback
+        self.io = io
+        self.delay = delay
+        self.notifier = None
+        self.timer = None
+        self.signature = None
+        self.known = False	# whether signature has been read yet
+        self.polling = False
+
+    def start(self):
+        global inotify
+        if inotify is False:
+            try:
+                from twisted.internet import inotify
+            except ImportError:
+                inotify = None
+        if inotify is None:
+            self.poll()
+            return
+        from twisted.python import filepath
+        try:
+            notifier = inotify.INotify()
+            notifier.startReading()
+            notifier.watch(
+                filepath.FilePath(os.path.dirname(self.path)),
+                mask=(inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO
+                      | inotify.IN_CREATE),
+                callbacks=[self.on_notify]
+            )
+        except (inotify.INotifyError, IOError, OSError) as error:
+            log.debug("TrafficLimits: inotify unavailable, polling "
+                      + self.path + ": " + str(error))
+            self.poll()
+            return
+        self.notifier = notifier
+
+    def stop(self):
+        if self.notifier:
+            self.notifier.loseConnection()
+            self.notifier = None
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+
+    def stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError as error:
+            log.debug("TrafficLimits: " + self.path + ": " + str(error))
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def poll(self):
+        """
+        Checks the file, unless inotify is doing that already, or the last
+        check has not finished.
+        """
+        if self.notifier or self.polling:
+            return
+        self.polling = True
+        self.io.run(self.stat).addCallback(self.on_stat)
+
+    def on_stat(self, signature):
+        self.polling = False
+        if not self.known:
+            # The first look, from start().
+            self.known = True
+            self.signature = signature
+        elif signature != self.signature:
+            self.signature = signature
+            self.callback()
+
+    def on_notify(self, ignored, path, mask):
+        if path.basename() != os.path.basename(self.path):
+            return
+        if self.timer and self.timer.active():
+            self.timer.reset(self.delay)
+        else:
+            self.timer = reactor.callLater(self.delay, self.callback)
@@ -0,0 +1,214 @@
+#
+# windows.py
+#
+# Copyright (C) 2010 Peter Oliver <TrafficLimits@mavit.org.uk>
+#
+# Basic plugin template created by:
+# Copyright (C) 2008 Martijn Voncken <mvoncken@gmail.com>
+# Copyright (C) 2007-2009 Andrew Resch <andrewresch@gmail.com>
+# Copyright (C) 2009 Damien Churchill <damoxc@gmail.com>
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+
+from array import array
+
+from forecast import time_to_limit
+
+# Slots per window: a 24 hour window moves in steps of 15 minutes.
+SLOTS = 96
+
+class SlidingWindow(object):
+    """
+    Bytes transferred in the last length seconds.
+
+    The window is a ring of SLOTS time slots, with running sums, so adding
+    traffic only clears the slots that have fallen out of the window since
+    the last call and adjusts the sums: constant time per tick, whatever the
+    window length.  Traffic leaves the window one whole slot at a time.
+    """
+
+    def __init__(self, length, slots=SLOTS):
+        self.length = length
+        self.width = float(length) / slots
+        self.upload = array("d", [0]) * slots
+        self.download = array("d", [0]) * slots
+        self.upload_sum = 0.0
+        self.download_sum = 0.0
+        self.current = None	# number of the newest slot, counting from 0
+
+    def add(self, now, upload, download):
+        slot = int(now // self.width)
+        if self.current is None:
+            self.current = slot
+        count = len(self.upload)
+        # Clear the slots that have fallen out, at most once round the ring.
+        for expired in xrange(self.current + 1,
+                              min(slot, self.current + count) + 1):
+            i = expired % count
+            self.upload_sum -= self.upload[i]
+            self.download_sum -= self.download[i]
+            self.upload[i] = 0
+            self.download[i] = 0
+        # If the clock went back, count it in the newest slot.
+        self.current = max(self.current, slot)
+
+        i = self.current % count
+        self.upload[i] += upload
+        self.download[i] += download
+        self.upload_sum += upload
+        self.download_sum += download
+
+    def release(self, now, maximum_upload, maximum_download, maximum_total):
+        """
+        Returns the seconds until, with no more traffic, enough has left the
+        window to be within all the given limits (-1 for none).
+        """
+        def exceeded(upload, download):
+            return (0 <= maximum_upload < upload
+                    or 0 <= maximum_download < download
+                    or 0 <= maximum_total < upload + download)
+
+        upload, download = self.upload_sum, self.download_sum
+        if self.current is None or not exceeded(upload, download):
+            return 0.0
+        count = len(self.upload)
+        for slot in xrange(self.current - count + 1, self.current + 1):
+            upload -= self.upload[slot % count]
+            download -= self.download[slot % count]
+            if not exceeded(upload, download):
+                break
+        # That slot is cleared once the window has moved on past it.
+        return max(0.0, (slot + count) * self.width - now)
+
+def describe(length):
+    """Returns a name for a window of length seconds, e.g., "Last 24 hours"."""
+    if length > 2 * 86400 and length % 86400 == 0:
+        return "Last %d days" % (length // 86400)
+    if length == 3600:
+        return "Last hour"
+    return "Last %g hours" % (length / 3600.0)
+
+class Windows(object):
+    """
+    Limits on the traffic in the last so many seconds, rather than since a
+    reset.  Each window is configured as a dict like
+
+        {"name": "Last 24 hours", "length": 86400,
+         "maximum_upload": -1, "maximum_download": -1,
+         "maximum_total": 10737418240}
+
+    A window that goes over a limit pauses transfers until enough traffic
+    has slid out of it.
+    """
+
+    def __init__(self, windows):
+        self.names = [window.get("name") or describe(window["length"])
+                      for window in windows]
+        self.maximum_upload = [window.get("maximum_upload", -1)
+                               for window in windows]
+        self.maximum_download = [window.get("maximum_download", -1)
+                                 for window in windows]
+        self.maximum_total = [window.get("maximum_total", -1)
+                              for window in windows]
+        self.windows = [SlidingWindow(window["length"])
+                        for window in windows]
+
+    def __len__(self):
+        return len(self.windows)
+
+    def load(self, history, now):
+        """Fills the windows with past traffic from history."""
+        for window in self.windows:
+            for start, upload, download in history.query(
+                    now - window.length, now, window.width):
+                window.add(start, upload, download)
+            window.add(now, 0, 0)
+
+    def add(self, now, upload, download):
+        for window in self.windows:
+            window.add(now, upload, download)
+
+    def limits(self, i):
+        return (self.maximum_upload[i], self.maximum_download[i],
+                self.maximum_total[i])
+
+    def exceeded(self):
+        """
+        Returns a list of (window index, direction) for every window that is
+        over one of its limits.
+        """
+        exceeded = []
+        for i, window in enumerate(self.windows):
+            if 0 <= self.maximum_upload[i] < window.upload_sum:
+                exceeded.append((i, "upload"))
+            elif 0 <= self.maximum_download[i] < window.download_sum:
+                exceeded.append((i, "download"))
+            elif 0 <= self.maximum_total[i] \
+                    < window.upload_sum + window.download_sum:
+                exceeded.append((i, "total"))
+        return exceeded
+
+    def time_to_limit(self, now, upload_rate, download_rate):
+        """
+        Returns a dict, name -> seconds until the window reaches its nearest
+        limit at the given rates, or, if it is already over one, until it
+        will be back within its limits.  Traffic leaving the window is not
+        counted, so the former is a little pessimistic.
+        """
+        forecast = {}
+        for i, window in enumerate(self.windows):
+            seconds = window.release(now, *self.limits(i))
+            if seconds == 0:
+                seconds = [s for s in [
+                    time_to_limit(window.upload_sum, self.maximum_upload[i],
+                                  upload_rate),
+                    time_to_limit(window.download_sum,
+                                  self.maximum_download[i], download_rate),
+                    time_to_limit(window.upload_sum + window.download_sum,
+                                  self.maximum_total[i],
+                                  upload_rate + download_rate),
+                ] if s is not None]
+                if not seconds:
+                    continue
+                seconds = min(seconds)
+            forecast[self.names[i]] = seconds
+        return forecast
+
+    def state(self):
+        """
+        Returns a list with, for each window, [name, length, upload,
+        download, total, maximum_upload, maximum_download, maximum_total].
+        """
+        return [
+            [name, window.length, window.upload_sum, window.download_sum,
+             window.upload_sum + window.download_sum]
+            + list(self.limits(i))
+            for i, (name, window) in enumerate(zip(self.names, self.windows))
+        ]